@@ -5,6 +5,7 @@ from flask_login import LoginManager
 from config import Config
 import os
 from app.jinja_filters import register_filters
+from app.cli import register_commands
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -21,6 +22,7 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
 
     register_filters(app)
+    register_commands(app)
 
     from app.auth import bp as auth_bp
 
@@ -49,6 +51,14 @@ def create_app(config_class=Config):
     if user_db_path:
         os.makedirs(user_db_path, exist_ok=True)
 
+    # Warm up the audio features dataset so the first sync doesn't pay for it
+    if app.config.get("PRELOAD_TRACK_FEATURES") and app.config.get(
+        "USE_CSV_FOR_AUDIO_FEATURES"
+    ):
+        from app.spotify.csv_data_manager import start_track_features_warmup
+
+        start_track_features_warmup(app)
+
     # Register custom template filters
     @app.template_filter("from_json")
     def from_json_filter(value):
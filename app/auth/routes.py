@@ -9,46 +9,30 @@ from flask import (
 )
 from flask_login import login_user, logout_user, current_user, login_required
 from datetime import datetime
-import spotipy
 from spotipy.oauth2 import SpotifyOAuth
+from app.spotify.token_cache import (
+    TEMP_KEY_PREFIX,
+    delete_cached_token,
+    get_cache_handler,
+)
 from app import db
 from app.auth import bp
 from app.models import User, BetaSignup
+from app.spotify.clients import spotify_client
 from app.auth.forms import BetaSignupForm
 
 
 def get_spotify_oauth(user_id=None):
     """
-    Get a SpotifyOAuth instance with user-specific cache path
+    Get a SpotifyOAuth instance whose token cache is the user's entry, or
+    this browser session's temporary entry before login
     """
-    import os
-
-    # Create cache directory if it doesn't exist
-    cache_dir = os.path.join(current_app.root_path, "spotify_caches")
-    os.makedirs(cache_dir, exist_ok=True)
-
-    # Create a unique cache path if user_id is provided
-    if user_id:
-        cache_path = os.path.join(cache_dir, f"user_{user_id}_cache")
-    else:
-        # For unauthenticated users, use a temporary cache with session ID
-        import secrets
-
-        cache_id = session.get("spotify_cache_id")
-        if not cache_id:
-            cache_id = secrets.token_urlsafe(8)
-            session["spotify_cache_id"] = cache_id
-        cache_path = os.path.join(cache_dir, f"temp_{cache_id}_cache")
-
-    # Log the cache path being used
-    current_app.logger.info(f"Using Spotify cache path: {cache_path}")
-
     return SpotifyOAuth(
         client_id=current_app.config["SPOTIFY_CLIENT_ID"],
         client_secret=current_app.config["SPOTIFY_CLIENT_SECRET"],
         redirect_uri=current_app.config["SPOTIFY_REDIRECT_URI"],
         scope=current_app.config["SPOTIFY_API_SCOPES"],
-        cache_path=cache_path,  # Use the user-specific cache path
+        cache_handler=get_cache_handler(user_id),
         requests_timeout=30,
         show_dialog=True,  # Always show dialog to force account selection
     )
@@ -116,7 +100,7 @@ def callback():
         current_app.logger.info("Token obtained successfully")
 
         # Create Spotify client with the new token
-        sp = spotipy.Spotify(auth=token_info["access_token"])
+        sp = spotify_client(token_info["access_token"])
 
         # Get user info from Spotify
         spotify_user = sp.current_user()
@@ -174,15 +158,10 @@ def callback():
 
             # Clean up the temporary cache if we have one
             if "spotify_cache_id" in session:
-                temp_cache = f".spotify_cache_temp_{session['spotify_cache_id']}"
                 try:
-                    import os
-
-                    if os.path.exists(temp_cache):
-                        os.remove(temp_cache)
-                        current_app.logger.info(
-                            f"Deleted temporary cache: {temp_cache}"
-                        )
+                    delete_cached_token(
+                        f"{TEMP_KEY_PREFIX}{session['spotify_cache_id']}"
+                    )
                 except Exception as cache_error:
                     current_app.logger.error(
                         f"Error deleting temp cache: {str(cache_error)}"
@@ -0,0 +1,82 @@
+"""
+Custom Flask CLI commands for the application.
+This module contains maintenance commands that are registered on the `flask` CLI.
+"""
+
+import click
+
+
+def register_commands(app):
+    """
+    Register all custom CLI commands with the Flask app.
+
+    Args:
+        app: Flask application instance
+    """
+
+    @app.cli.command("build-feature-store")
+    @click.option("--csv", "csv_path", help="Source CSV (defaults to config)")
+    @click.option("--out", "store_path", help="Store directory (defaults to config)")
+    def build_feature_store_command(csv_path, store_path):
+        """Build the memory-mapped audio feature store from the features CSV."""
+        from app.spotify.csv_data_manager import resolve_feature_columns
+        from app.spotify.feature_store import build_feature_store
+
+        csv_path = csv_path or app.config.get("TRACK_FEATURES_CSV_PATH")
+        store_path = (
+            store_path
+            or app.config.get("TRACK_FEATURES_STORE_PATH")
+            or f"{csv_path}.store"
+        )
+
+        columns = resolve_feature_columns(app.config.get("TRACK_FEATURES_COLUMNS"))
+        meta = build_feature_store(csv_path, store_path, columns=columns)
+        click.echo(f"Built feature store at {store_path} with {meta['count']} tracks")
+        if store_path != app.config.get("TRACK_FEATURES_STORE_PATH"):
+            click.echo(f"Set TRACK_FEATURES_STORE_PATH={store_path} to serve from it")
+
+    @app.cli.command("sync-worker")
+    @click.option("--once", is_flag=True, help="Exit once the queue is empty")
+    @click.option(
+        "--poll-interval",
+        default=2.0,
+        show_default=True,
+        help="Seconds to wait for a job before checking again",
+    )
+    def sync_worker_command(once, poll_interval):
+        """Run queued Spotify data syncs (enabled with SYNC_IN_BACKGROUND)."""
+        from app.spotify.jobs import get_sync_queue, run_sync_worker
+
+        queue = get_sync_queue(app)
+        click.echo(f"Sync worker waiting for jobs on the {queue.name} queue")
+        try:
+            jobs_run = run_sync_worker(queue, once=once, poll_interval=poll_interval)
+        except KeyboardInterrupt:
+            click.echo("Sync worker stopped")
+            return
+        click.echo(f"Ran {jobs_run} sync jobs")
+
+    @app.cli.command("sweep-token-cache")
+    @click.option(
+        "--max-age",
+        type=int,
+        help="Seconds before a temp entry expires (defaults to SPOTIFY_TEMP_TOKEN_TTL)",
+    )
+    @click.option(
+        "--remove-legacy-files",
+        is_flag=True,
+        help="Also delete the old file caches in app/spotify_caches",
+    )
+    def sweep_token_cache_command(max_age, remove_legacy_files):
+        """Delete cached Spotify tokens of logins that were never completed."""
+        import os
+        import shutil
+
+        from app.spotify.token_cache import sweep_temp_tokens
+
+        click.echo(f"Deleted {sweep_temp_tokens(max_age)} expired temp tokens")
+
+        legacy_dir = os.path.join(app.root_path, "spotify_caches")
+        if remove_legacy_files and os.path.isdir(legacy_dir):
+            shutil.rmtree(legacy_dir)
+            click.echo(f"Removed {legacy_dir}")
@@ -114,6 +114,46 @@ class UserDataSync(db.Model):
         return f"<UserDataSync {self.user_id}:{self.data_type.name}>"
 
 
+class SyncJob(db.Model):
+    """A queued sync of one data type for one user, run by `flask sync-worker`"""
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    data_type = db.Column(db.String(50), nullable=False)
+    operation_id = db.Column(db.String(100), index=True, nullable=False)
+    status = db.Column(
+        db.String(20), default="queued", index=True
+    )  # queued, running, done, failed
+    progress = db.Column(db.Text)  # JSON in the check_progress format
+    message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    user = db.relationship("User", backref="sync_jobs")
+
+    def get_progress(self):
+        try:
+            return json.loads(self.progress) if self.progress else None
+        except json.JSONDecodeError:
+            return None
+
+    def __repr__(self):
+        return f"<SyncJob {self.id} {self.data_type} ({self.status})>"
+
+
+class SpotifyTokenCache(db.Model):
+    """spotipy token cache entry, for a user or a login still in progress"""
+
+    cache_key = db.Column(db.String(64), primary_key=True)  # user_<id>, temp_<id>
+    token_info = db.Column(db.Text)  # JSON token_info dict from spotipy
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<SpotifyTokenCache {self.cache_key}>"
+
+
 class RandomizerConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
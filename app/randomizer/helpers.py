@@ -14,6 +14,7 @@ from app.models import (
     UserDataSync,
     PlaylistCreationHistory,
 )
+from app.spotify.shared_store import TRACK_TABLES, prepare_hot_track_columns
 from app.spotify.utils import get_spotify_client
 
 
@@ -181,12 +182,6 @@ def get_source_tracks_from_playlist(spotify, playlist_id):
                 tracks.extend(batch_tracks)
                 offset += limit
 
-                # Add a small delay to avoid rate limiting
-                if total > 200:
-                    import time
-
-                    time.sleep(0.1)
-
             except requests.exceptions.Timeout:
                 current_app.logger.warning(
                     f"Timeout fetching batch at offset {offset}. Continuing with collected tracks."
@@ -221,49 +216,45 @@ def get_source_tracks_from_db(data_type):
             )
             return []
 
+        if data_type not in TRACK_TABLES:
+            current_app.logger.error(f"{data_type} is not a track table")
+            return []
+
+        # Typed columns written by the sync; older databases are backfilled
+        # the first time they are read
+        prepare_hot_track_columns(cursor, data_type)
+
         current_app.logger.info(f"Fetching tracks from local database: {data_type}")
-        cursor.execute(f"SELECT * FROM {data_type}")
-        db_items = cursor.fetchall()
+        cursor.execute(
+            f"""
+            SELECT uri, name, artist, artist_id, duration_ms, album, explicit,
+                   popularity, release_year
+            FROM {data_type}
+            WHERE uri IS NOT NULL
+            """
+        )
 
-        # Extract track information from JSON data
         tracks = []
         explicit_tracks_count = 0
-        for item in db_items:
-            try:
-                # Parse the JSON data string
-                item_data = json.loads(item["data"])
-
-                # For saved_tracks, the track info is directly in the item_data
-                # since we already processed it during sync
-                track_info = item_data
-
-                # Make sure we have a URI for the track
-                if "uri" not in track_info:
-                    continue
-
-                # Check if the track has an explicit flag and count explicit tracks
-                is_explicit = False
-                if "explicit" in track_info:
-                    is_explicit = bool(track_info["explicit"])
-                    if is_explicit:
-                        explicit_tracks_count += 1
-
-                # Create a standardized track object
-                track = {
-                    "uri": track_info.get("uri"),
-                    "name": track_info.get("name", "Unknown"),
-                    "artist": track_info.get("artists", [{}])[0].get("name", "Unknown"),
-                    "artist_id": track_info.get("artists", [{}])[0].get("id", ""),
-                    "duration_ms": track_info.get("duration_ms", 0),
-                    "album": track_info.get("album", {}).get("name", "Unknown"),
+        for item in cursor.fetchall():
+            is_explicit = bool(item["explicit"])
+            if is_explicit:
+                explicit_tracks_count += 1
+
+            # Create a standardized track object
+            tracks.append(
+                {
+                    "uri": item["uri"],
+                    "name": item["name"] or "Unknown",
+                    "artist": item["artist"] or "Unknown",
+                    "artist_id": item["artist_id"] or "",
+                    "duration_ms": item["duration_ms"] or 0,
+                    "album": item["album"] or "Unknown",
                     "explicit": is_explicit,  # Explicitly include this field
-                    "popularity": track_info.get("popularity", 0),
+                    "popularity": item["popularity"] or 0,
+                    "release_year": item["release_year"],
                 }
-                tracks.append(track)
-
-            except (json.JSONDecodeError, KeyError) as e:
-                current_app.logger.error(f"Error parsing track data: {str(e)}")
-                continue
+            )
 
         conn.close()
         current_app.logger.info(
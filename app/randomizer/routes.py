@@ -18,8 +18,6 @@ import random
 from datetime import datetime
 
 from app.models import UserDataSync, SpotifyDataType, PlaylistCreationHistory
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 
 # Import helpers and rule processor functions
 from app.randomizer.helpers import (
@@ -172,29 +170,9 @@ def create_playlist():
         # Log a summary of the final playlist
         log_playlist_summary(shuffled_tracks, playlist_name, config)
 
-        # Get a fresh Spotify client with the correct scopes
-        sp_oauth = SpotifyOAuth(
-            client_id=current_app.config["SPOTIFY_CLIENT_ID"],
-            client_secret=current_app.config["SPOTIFY_CLIENT_SECRET"],
-            redirect_uri=current_app.config["SPOTIFY_REDIRECT_URI"],
-            scope=current_app.config["SPOTIFY_API_SCOPES"],
-            cache_path=None,
-            show_dialog=True,
-        )
-
-        if current_user.spotify_refresh_token:
-            token_info = sp_oauth.refresh_access_token(
-                current_user.spotify_refresh_token
-            )
-            current_user.set_spotify_tokens(
-                token_info["access_token"],
-                token_info.get("refresh_token", current_user.spotify_refresh_token),
-                token_info["expires_in"],
-            )
-            db.session.commit()
-
-            spotify = spotipy.Spotify(auth=token_info["access_token"])
-        else:
+        # Reuses the stored token, refreshing it only when it is about to expire
+        spotify = get_spotify_client(current_user)
+        if not spotify:
             flash("Could not refresh your Spotify token. Please log in again.")
             return redirect(url_for("auth.login"))
 
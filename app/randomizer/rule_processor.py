@@ -536,17 +536,22 @@ def apply_release_year_filter(tracks, rules):
         excluded_count = 0
 
         for track in tracks:
-            # Extract year from release_date if available
-            release_date = None
-            if "album" in track and "release_date" in track["album"]:
-                release_date = track["album"]["release_date"]
-            elif "release_date" in track:
-                release_date = track["release_date"]
-
-            if release_date:
-                # Extract just the year from formats like YYYY-MM-DD
-                year = int(release_date.split("-")[0])
-
+            # Tracks loaded from the database carry their release year
+            year = track.get("release_year")
+
+            # Otherwise extract it from release_date if available
+            if year is None:
+                release_date = None
+                if "album" in track and "release_date" in track["album"]:
+                    release_date = track["album"]["release_date"]
+                elif "release_date" in track:
+                    release_date = track["release_date"]
+
+                if release_date:
+                    # Extract just the year from formats like YYYY-MM-DD
+                    year = int(release_date.split("-")[0])
+
+            if year is not None:
                 if min_year <= year <= max_year:
                     filtered_tracks.append(track)
                 else:
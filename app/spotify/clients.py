@@ -0,0 +1,120 @@
+"""
+Reusable Spotify clients.
+
+Every client is built on one process-wide requests.Session whose connection
+pool keeps connections to the Spotify API alive, so calls made one after the
+other, inside a request or across requests, skip the TCP and TLS handshakes.
+Clients are cached per user and rebuilt when the user's access token
+changes; entries unused for SPOTIFY_CLIENT_IDLE_TIMEOUT seconds are dropped.
+"""
+
+import threading
+import time
+
+import requests
+from flask import current_app, has_app_context
+from urllib3.util.retry import Retry
+
+from app.spotify.rate_limit import RETRY_STATUS_CODES, RateLimitedSpotify
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_IDLE_TIMEOUT = 600
+# Seconds before a Spotify API request gives up
+REQUESTS_TIMEOUT = 10
+# How often the cache looks for idle clients to drop
+SWEEP_INTERVAL = 60
+
+_session = None
+_clients = {}  # user_id -> (access_token, client, last_used)
+_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def _build_session():
+    pool_size = _config("SPOTIFY_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE)
+    # Same retries spotipy sets up for its own sessions, minus 429 which
+    # the rate limiter handles
+    retry = Retry(
+        total=RateLimitedSpotify.max_retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=RateLimitedSpotify.max_retries,
+        backoff_factor=0.3,
+        status_forcelist=RETRY_STATUS_CODES,
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """The requests.Session shared by every Spotify client in this process"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def spotify_client(access_token):
+    """A client for a token that isn't tied to a stored user (e.g. at login)"""
+    return RateLimitedSpotify(
+        auth=access_token,
+        requests_session=get_session(),
+        requests_timeout=REQUESTS_TIMEOUT,
+    )
+
+
+def _sweep(now, idle_timeout):
+    global _last_sweep
+    _last_sweep = now
+    for user_id in [
+        user_id
+        for user_id, (_, _, last_used) in _clients.items()
+        if now - last_used > idle_timeout
+    ]:
+        del _clients[user_id]
+
+
+def get_user_client(user_id, access_token):
+    """
+    The cached client for a user, rebuilt if the access token has changed
+    since it was created.
+    """
+    session = get_session()
+    idle_timeout = _config("SPOTIFY_CLIENT_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT)
+    now = time.monotonic()
+
+    with _lock:
+        if now - _last_sweep > SWEEP_INTERVAL:
+            _sweep(now, idle_timeout)
+
+        entry = _clients.get(user_id)
+        if entry is not None and entry[0] == access_token:
+            client = entry[1]
+        else:
+            client = RateLimitedSpotify(
+                auth=access_token,
+                requests_session=session,
+                requests_timeout=REQUESTS_TIMEOUT,
+            )
+        _clients[user_id] = (access_token, client, now)
+        return client
+
+
+def evict_user_client(user_id):
+    """Forget a user's client, e.g. when they disconnect Spotify"""
+    with _lock:
+        _clients.pop(user_id, None)
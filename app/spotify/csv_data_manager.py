@@ -1,186 +1,1079 @@
 import os
+import ast
 import csv
+import json
+import numpy as np
 import pandas as pd
-from flask import current_app
 import logging
+import threading
 import time
+from app.spotify.search_index import TrigramIndex, search_fields
+from app.spotify.similarity_index import SimilarityIndex
+from app.spotify.feature_distributions import FeatureDistributions
+
+# Bump whenever the layout written by _write_cache changes
+CACHE_FORMAT_VERSION = 4
+CACHE_SUFFIX = ".cache.npz"
+# Rows replacing or deleting base rows, written by merge_csvs.py --mode incremental
+DELTA_SUFFIX = ".delta.csv"
+DELETED_COLUMN = "_deleted"
+# Rows parsed per chunk; progress is reported after every chunk
+CSV_CHUNK_ROWS = 100_000
+
+AUDIO_FEATURE_COLUMNS = [
+    "danceability",
+    "energy",
+    "key",
+    "loudness",
+    "mode",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+]
+
+# Fields the app reads from the dataset; everything else is skipped at load.
+# Names match with or without the _x/_y suffixes pandas adds when merging,
+# and suffixed columns are collapsed onto these names.
+DEFAULT_TRACK_FEATURE_COLUMNS = [
+    "id",
+    "name",
+    "album",
+    "artists",
+    *AUDIO_FEATURE_COLUMNS,
+    "duration_ms",
+    "time_signature",
+    "year",
+    "release_date",
+]
+
+# Continuous audio features, compared by find_similar and ranked by
+# percentile; key and mode are categorical and skipped
+CONTINUOUS_FEATURE_COLUMNS = [
+    "danceability",
+    "energy",
+    "loudness",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+]
+
+# Highly repetitive string columns stored as pandas categoricals
+CATEGORICAL_COLUMNS = {"album", "album_id", "artists", "artist_ids", "release_date"}
+
+MERGE_SUFFIXES = ("_x", "_y")
+
+# Columns always parsed as text
+READ_AS_STRING = ["id", "name", "album", "album_id", "artists", "artist_ids"]
+
+
+def _base_column(name):
+    """Column name without a pandas merge suffix"""
+    for suffix in MERGE_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def _column_priority(name):
+    """Sort key preferring plain names, then the left (_x), then the right (_y)"""
+    for position, suffix in enumerate(MERGE_SUFFIXES, start=1):
+        if name.endswith(suffix):
+            return position
+    return 0
+
+
+def canonicalize_feature_columns(df):
+    """
+    Collapse merge-suffixed columns onto their canonical names.
+
+    Files merged before merge_csvs.py wrote a canonical schema carry both
+    tempo_x and tempo_y; they become a single tempo column holding the
+    first non-null value in the order tempo, tempo_x, tempo_y.
+    """
+    groups = {}
+    for name in df.columns:
+        groups.setdefault(_base_column(name), []).append(name)
+
+    if all(names == [base] for base, names in groups.items()):
+        return df
+
+    columns = {}
+    for base, names in groups.items():
+        names = sorted(names, key=_column_priority)
+        series = df[names[0]]
+        for name in names[1:]:
+            series = series.fillna(df[name])
+        columns[base] = series
+    return pd.DataFrame(columns, copy=False)
+
+
+def canonicalize_record(record):
+    """
+    canonicalize_feature_columns for a single stored dict, so per-user data
+    saved from a suffixed CSV reads like current data.
+    """
+    if not any(_column_priority(key) for key in record):
+        return record
+
+    result = {}
+    for key in sorted(record, key=_column_priority):
+        base = _base_column(key)
+        if result.get(base) is None:
+            result[base] = record[key]
+    return result
+
+
+def continuous_feature_columns(df):
+    """Map each continuous feature present in df to its column"""
+    return {name: name for name in CONTINUOUS_FEATURE_COLUMNS if name in df.columns}
+
+
+def resolve_feature_columns(setting):
+    """
+    Turn the TRACK_FEATURES_COLUMNS setting into a column list.
+
+    None uses the default projection, "*" or "all" loads every column, and
+    anything else is a comma-separated list of column names.
+    """
+    if setting is None:
+        return list(DEFAULT_TRACK_FEATURE_COLUMNS)
+    if isinstance(setting, str):
+        if setting.strip().lower() in ("*", "all"):
+            return None
+        setting = [column.strip() for column in setting.split(",") if column.strip()]
+
+    columns = list(setting)
+    if "id" not in columns:
+        columns.insert(0, "id")
+    return columns
+
+
+def _encode_strings(series):
+    """Pack a string column into one NUL-separated UTF-8 buffer plus a null mask"""
+    values = series.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    joined = "\x00".join(
+        "" if is_missing else str(value) for value, is_missing in zip(values, missing)
+    )
+    if joined.count("\x00") != max(len(values) - 1, 0):
+        raise ValueError(f"Column {series.name} contains NUL characters")
+    return np.frombuffer(joined.encode("utf-8"), dtype=np.uint8), missing
+
+
+def _decode_strings(buffer, missing):
+    """Inverse of _encode_strings"""
+    values = np.array(buffer.tobytes().decode("utf-8").split("\x00"), dtype=object)
+    if len(missing) == 0:
+        return np.array([], dtype=object)
+    values[missing] = np.nan
+    return values
+
+
+def read_track_features_csv(csv_path, progress_callback=None, columns=None):
+    """
+    Parse the track features CSV with the dtypes the app expects.
+
+    Only the given columns are parsed (all of them when columns is None) and
+    the result is compacted with compact_track_features. The file is read
+    in chunks so progress_callback(rows, bytes_read, total_bytes) can report
+    how far along the load is.
+    """
+    dtype = {name: str for name in READ_AS_STRING}
+
+    usecols = None
+    if columns is not None:
+        wanted = set(columns)
+        usecols = lambda name: _base_column(name) in wanted
+
+    chunks = []
+    with open(csv_path, "rb") as f:
+        total_bytes = os.fstat(f.fileno()).st_size
+        rows = 0
+        for chunk in pd.read_csv(
+            f, dtype=dtype, usecols=usecols, chunksize=CSV_CHUNK_ROWS
+        ):
+            chunks.append(chunk)
+            rows += len(chunk)
+            if progress_callback:
+                progress_callback(rows, f.tell(), total_bytes)
+
+    if chunks:
+        df = pd.concat(chunks, ignore_index=True)
+    else:
+        df = pd.read_csv(csv_path, dtype=dtype, usecols=usecols)
+
+    df = canonicalize_feature_columns(df)
+
+    # Parse the stringified artist lists once here instead of on every lookup
+    if "artists" in df.columns:
+        df["artists"] = format_artists_column(df["artists"])
+
+    return compact_track_features(df)
+
+
+def track_features_signature(csv_path):
+    """Size and mtime of the features CSV and of its delta file, if any"""
+    stat = os.stat(csv_path)
+    signature = {
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "delta_size": None,
+        "delta_mtime_ns": None,
+    }
+    delta_path = f"{csv_path}{DELTA_SUFFIX}"
+    if os.path.exists(delta_path):
+        delta_stat = os.stat(delta_path)
+        signature["delta_size"] = delta_stat.st_size
+        signature["delta_mtime_ns"] = delta_stat.st_mtime_ns
+    return signature
+
+
+def signature_version(signature):
+    """Short version string for a track_features_signature"""
+    version = f"{signature['source_mtime_ns']:x}-{signature['source_size']:x}"
+    if signature.get("delta_mtime_ns") is not None:
+        version += f"-{signature['delta_mtime_ns']:x}-{signature['delta_size']:x}"
+    return version
+
+
+def read_track_features_delta(csv_path, columns=None):
+    """
+    Parse the delta file next to csv_path, or return None if there is none.
+
+    Every ID in the delta replaces all of its rows in the base CSV; rows
+    flagged in the _deleted column only remove them.
+    """
+    delta_path = f"{csv_path}{DELTA_SUFFIX}"
+    if not os.path.exists(delta_path):
+        return None
+
+    usecols = None
+    if columns is not None:
+        wanted = set(columns) | {DELETED_COLUMN}
+        usecols = lambda name: _base_column(name) in wanted
+
+    delta = pd.read_csv(delta_path, dtype=str, usecols=usecols)
+    deleted = (
+        delta.pop(DELETED_COLUMN).fillna("").isin(["1", "True", "true"])
+        if DELETED_COLUMN in delta.columns
+        else pd.Series(False, index=delta.index)
+    )
+    # Parsed as strings so tombstones don't skew dtypes; restore numbers
+    for name in delta.columns:
+        if name in READ_AS_STRING:
+            continue
+        values = delta[name]
+        if values.dropna().isin(["True", "False"]).all() and values.notna().any():
+            delta[name] = values.map({"True": True, "False": False})
+            continue
+        try:
+            delta[name] = pd.to_numeric(values)
+        except (ValueError, TypeError):
+            pass
+
+    delta = canonicalize_feature_columns(delta)
+    if "artists" in delta.columns:
+        delta["artists"] = format_artists_column(delta["artists"])
+    delta[DELETED_COLUMN] = deleted.to_numpy()
+    return delta
+
+
+def apply_track_features_delta(df, delta):
+    """Replace and delete base rows by ID, appending the delta's live rows"""
+    deleted = delta[DELETED_COLUMN].to_numpy(dtype=bool)
+    live = delta[~deleted]
+    base = df[~df["id"].isin(delta["id"])]
+
+    columns = {}
+    for name in df.columns:
+        left = base[name]
+        right = (
+            live[name]
+            if name in live.columns
+            else pd.Series(np.nan, index=live.index, dtype=object)
+        )
+        # Tombstones parse as NaN and widen integer columns to float; the
+        # live rows go back to integers (bools) when they have no missing
+        # values, and compact_track_features picks the width
+        if right.notna().all():
+            if pd.api.types.is_bool_dtype(left):
+                right = right.astype(bool)
+            elif pd.api.types.is_integer_dtype(left):
+                right = right.astype(np.int64)
+
+        if isinstance(left.dtype, pd.CategoricalDtype):
+            right = pd.Categorical(right.to_numpy(dtype=object))
+            columns[name] = pd.api.types.union_categoricals(
+                [left.array, right], ignore_order=True
+            )
+        elif len(right) == 0:
+            columns[name] = left.reset_index(drop=True)
+        else:
+            columns[name] = pd.concat(
+                [left.reset_index(drop=True), right.reset_index(drop=True)],
+                ignore_index=True,
+            )
+
+    return compact_track_features(pd.DataFrame(columns))
+
+
+def read_track_features(csv_path, progress_callback=None, columns=None):
+    """read_track_features_csv with the delta file, if any, applied"""
+    df = read_track_features_csv(csv_path, progress_callback, columns)
+    delta = read_track_features_delta(csv_path, columns)
+    return apply_track_features_delta(df, delta) if delta is not None else df
+
+
+def compact_track_features(df):
+    """
+    Shrink the DataFrame in place: floats become float32, integers the
+    smallest integer type that fits (int8 for key/mode and similar), and
+    repetitive strings become categoricals.
+    """
+    for name in df.columns:
+        series = df[name]
+        if series.dtype == object and _base_column(name) in CATEGORICAL_COLUMNS:
+            df[name] = series.astype("category")
+        elif pd.api.types.is_float_dtype(series):
+            df[name] = series.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(series):
+            df[name] = pd.to_numeric(series, downcast="integer")
+    return df
+
+
+def with_csv_precision(df):
+    """
+    Widen the float32 columns of a slice back to float64 at the precision the
+    CSV was written with, so records hold 0.123 rather than 0.12300000339746475.
+    The shortest repr of a float32 round-trips to the same float32, which is
+    the value the CSV held to float32 precision.
+    """
+    widened = {
+        name: df[name].to_numpy().astype(str).astype(np.float64)
+        for name in df.columns
+        if df[name].dtype == np.float32
+    }
+    return df.assign(**widened) if widened else df
+
+
+def memory_report(df, top=5):
+    """Total deep memory usage of df in MB plus its largest columns"""
+    usage = df.memory_usage(deep=True, index=False)
+    largest = ", ".join(
+        f"{name}={size / 1024 ** 2:.1f}MB"
+        for name, size in usage.sort_values(ascending=False).head(top).items()
+    )
+    return f"{usage.sum() / 1024 ** 2:.1f}MB (largest: {largest})"
+
+
+def format_artists(value):
+    """Turn a stringified list like "['A', 'B']" into "A, B" without eval"""
+    if not (isinstance(value, str) and value.startswith("[") and value.endswith("]")):
+        return value
+
+    # Fast path for the common repr form with only single-quoted names
+    if "\\" not in value and '"' not in value:
+        if value == "[]":
+            return ""
+        parts = value[2:-2].split("', '")
+        if value[:2] == "['" and value[-2:] == "']" and "'" not in "".join(parts):
+            return ", ".join(parts)
+
+    try:
+        artists_list = ast.literal_eval(value)
+        if isinstance(artists_list, (list, tuple)):
+            return ", ".join(str(artist) for artist in artists_list)
+    except (ValueError, SyntaxError):
+        pass
+    return value
+
+
+def format_artists_column(series):
+    """Apply format_artists to each distinct value of a column only once"""
+    codes, uniques = pd.factorize(series)
+    formatted = np.array([format_artists(value) for value in uniques], dtype=object)
+    result = np.full(len(series), np.nan, dtype=object)
+    has_value = codes >= 0
+    result[has_value] = formatted[codes[has_value]]
+    return pd.Series(result, index=series.index, name=series.name)
+
+
+class TrackFeaturesDataset:
+    """
+    One loaded version of the track features: the DataFrame, its ID index
+    and the search and similarity indexes built over it on first use.
+
+    A dataset is never modified after it is built. Reloading builds a new
+    one and swaps it into the manager, so a caller holding a dataset keeps
+    a consistent view while the swap happens.
+    """
+
+    def __init__(self, df, version=None, signature=None):
+        self.logger = logging.getLogger(__name__)
+        self.df = df
+        self.version = version
+        # Size/mtime of the source the dataset was built from
+        self.signature = signature or {}
+
+        self.index = self._create_index(df)
+        self.distributions = self._compute_distributions(df)
+        # Substring search indexes per column, built on first search
+        self._search_indexes = {}
+        self._search_lock = threading.Lock()
+        # Nearest-neighbour index over audio features, built on first use
+        self._similarity_index = None
+        self._similarity_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    def _create_index(self, df):
+        start_time = time.time()
+        self.logger.info("Creating track feature indices...")
+
+        # Map track ID -> row position. Only the first occurrence of a
+        # duplicated ID is indexed, matching the old lookup.
+        ids = df["id"]
+        first_rows = np.flatnonzero(~ids.duplicated(keep="first").to_numpy())
+        index = dict(zip(ids.to_numpy()[first_rows], first_rows.tolist()))
+
+        self.logger.info(
+            f"Indexed {len(index)} track IDs in {time.time() - start_time:.2f} seconds"
+        )
+        return index
+
+    def _positions_for_ids(self, track_ids):
+        """Resolve track IDs to unique row positions, preserving request order"""
+        positions = []
+        seen = set()
+        for track_id in track_ids:
+            position = self.index.get(track_id)
+            if position is not None and position not in seen:
+                seen.add(position)
+                positions.append(position)
+        return positions
+
+    def _compute_distributions(self, df):
+        """Quantile sketches of every continuous feature over unique tracks"""
+        start_time = time.time()
+        rows = np.fromiter(self.index.values(), dtype=np.int64)
+        distributions = FeatureDistributions.from_columns(
+            {
+                feature: df[column].to_numpy(dtype=np.float64, na_value=np.nan)[rows]
+                for feature, column in continuous_feature_columns(df).items()
+            }
+        )
+        self.logger.info(
+            f"Computed distributions of {len(distributions.features)} features in {time.time() - start_time:.2f} seconds"
+        )
+        return distributions
+
+    def percentile(self, feature, value):
+        return self.distributions.percentile(feature, value)
+
+    def percentiles(self, values):
+        return self.distributions.percentiles(values)
+
+    def _records(self, df):
+        """Convert rows to dicts column-wise, tagging them with their source"""
+        return with_csv_precision(df).assign(data_source="csv").to_dict("records")
+
+    def get_features_by_id(self, track_id):
+        position = self.index.get(track_id)
+        if position is None:
+            return None
+
+        return self._records(self.df.take([position]))[0]
+
+    def get_features_batch(self, track_ids):
+        # Resolve IDs through the index so the batch is a single positional take
+        positions = self._positions_for_ids(track_ids)
+
+        if not positions:
+            return []
+
+        return self._records(self.df.take(positions))
+
+    def _search_index(self, column):
+        """Trigram index for a column, built the first time it is searched"""
+        index = self._search_indexes.get(column)
+        if index is None:
+            with self._search_lock:
+                index = self._search_indexes.get(column)
+                if index is None:
+                    start_time = time.time()
+                    index = TrigramIndex(self.df[column])
+                    self._search_indexes[column] = index
+                    self.logger.info(
+                        f"Built search index for {column} ({len(index.values)} values) in {time.time() - start_time:.2f} seconds"
+                    )
+        return index
+
+    def search_tracks(self, name=None, artist=None, album=None, limit=10):
+        """
+        Case-insensitive substring search, best matches first.
+
+        Exact matches rank above prefix matches, which rank above matches
+        elsewhere in the value; scores are summed across the given fields.
+        """
+        fields = [
+            (column, text)
+            for column, text in (("name", name), ("artists", artist), ("album", album))
+            if text
+        ]
+        if not fields:
+            return with_csv_precision(self.df.head(limit)).to_dict("records")
+
+        rows = search_fields(
+            lambda column: (
+                self._search_index(column) if column in self.df.columns else None
+            ),
+            fields,
+            limit,
+        )
+        return with_csv_precision(self.df.take(rows)).to_dict("records")
+
+    def _get_similarity_index(self):
+        index = self._similarity_index
+        if index is None:
+            with self._similarity_lock:
+                index = self._similarity_index
+                if index is None:
+                    start_time = time.time()
+                    columns = continuous_feature_columns(self.df)
+                    if not columns:
+                        raise ValueError("No audio feature columns loaded")
+
+                    rows = np.fromiter(self.index.values(), dtype=np.int64)
+                    features = self.df[list(columns.values())].to_numpy(
+                        dtype=np.float32, na_value=np.nan
+                    )[rows]
+                    index = SimilarityIndex(features, rows)
+                    self._similarity_index = index
+                    self.logger.info(
+                        f"Built similarity index over {len(index)} tracks in {time.time() - start_time:.2f} seconds"
+                    )
+        return index
+
+    def find_similar(self, track_id, k=10):
+        """Up to k tracks with the closest audio features to track_id"""
+        return self.find_similar_batch([track_id], k).get(track_id, [])
+
+    def find_similar_batch(self, track_ids, k=10):
+        """
+        Nearest neighbours for many seed tracks at once.
+
+        Returns a dict mapping each known seed ID to its neighbours' feature
+        records, closest first, each with a "distance" in standardized
+        feature units. Search is approximate (LSH) with an exact re-rank.
+        """
+        seeds = [
+            (track_id, self.index[track_id])
+            for track_id in dict.fromkeys(track_ids)
+            if track_id in self.index
+        ]
+        if not seeds:
+            return {}
+
+        index = self._get_similarity_index()
+        neighbours = index.query_rows([row for _, row in seeds], k)
+
+        results = {}
+        for (track_id, _), found in zip(seeds, neighbours):
+            if found is None:
+                continue
+            rows, distances = found
+            records = self._records(self.df.take(rows))
+            for record, distance in zip(records, distances.tolist()):
+                record["distance"] = distance
+            results[track_id] = records
+        return results
+
+    def get_track_ids_in_csv(self):
+        return list(self.index)
 
 
 class TrackFeaturesManager:
     _instance = None
     _initialized = False
+    _init_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(TrackFeaturesManager, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, csv_path=None):
-        if self._initialized:
-            return
+    def __init__(
+        self,
+        csv_path=None,
+        use_cache=True,
+        columns=DEFAULT_TRACK_FEATURE_COLUMNS,
+        reload_check_interval=None,
+    ):
+        with self._init_lock:
+            if self._initialized:
+                return
 
-        self.logger = logging.getLogger(__name__)
-        self.csv_path = csv_path
-        self._df = None
-        self._indexed = False
-        self._index = {}
-        self._id_cache = {}
+            self.logger = logging.getLogger(__name__)
+            self.csv_path = csv_path
+            self.use_cache = use_cache
+            # None loads every column in the CSV
+            self.columns = list(columns) if columns is not None else None
+            # Seconds between checks for a replaced CSV; None or 0 disables them
+            self.reload_check_interval = reload_check_interval
+            # The current TrackFeaturesDataset, replaced wholesale on reload
+            self._dataset = None
+            self._reload_lock = threading.Lock()
+            self._reload_thread = None
+            self._last_change_check = 0.0
+
+            # Load state shared between the loading thread and request threads
+            self._load_lock = threading.Lock()
+            self._ready = threading.Event()
+            self._status_lock = threading.Lock()
+            self._status = {
+                "state": "idle",
+                "rows_loaded": 0,
+                "fraction": 0.0,
+                "started_at": None,
+                "eta_seconds": None,
+                "error": None,
+            }
+
+            self._initialized = True
+
+    def _set_status(self, **changes):
+        with self._status_lock:
+            self._status.update(changes)
+
+    def get_load_status(self):
+        """Snapshot of the load state: idle, loading, ready or failed"""
+        with self._status_lock:
+            status = dict(self._status)
+
+        if status["state"] == "loading" and status["started_at"]:
+            status["elapsed_seconds"] = round(time.time() - status["started_at"], 1)
+        return status
+
+    def get_load_progress(self):
+        """The load state in the progress_tracker format used by check_progress"""
+        status = self.get_load_status()
+        percent = int(status["fraction"] * 100)
+
+        if status["state"] == "ready":
+            message = f"Audio features database ready ({status['rows_loaded']} tracks)"
+        elif status["state"] == "failed":
+            message = f"Audio features database failed to load: {status['error']}"
+        elif status["state"] == "loading":
+            message = (
+                f"Loading audio features database: {status['rows_loaded']} tracks read"
+            )
+            if status["eta_seconds"] is not None:
+                message += f", about {status['eta_seconds']:.0f}s remaining"
+        else:
+            message = "Audio features database not loaded"
 
-        if csv_path and os.path.exists(csv_path):
-            self.load_csv(csv_path)
+        return {
+            "percent": percent,
+            "completed": status["rows_loaded"],
+            "total": status["rows_loaded"] if status["state"] == "ready" else 0,
+            "status": message,
+            "complete": status["state"] in ("ready", "failed"),
+            "eta_seconds": status["eta_seconds"],
+        }
 
-        self._initialized = True
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def start_background_load(self):
+        """Start loading in a daemon thread unless a load is running or done"""
+        with self._status_lock:
+            if self._status["state"] in ("loading", "ready"):
+                return None
+            # Claim the load before the thread starts so callers never race it
+            self._status.update(
+                {"state": "loading", "started_at": time.time(), "error": None}
+            )
+
+        thread = threading.Thread(
+            target=self.ensure_loaded, name="track-features-load", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def ensure_loaded(self):
+        """Load the dataset in this thread, or wait for a load already running"""
+        if self._ready.is_set():
+            return True
+        with self._load_lock:
+            if self._ready.is_set():
+                return True
+            return self._load()
 
     def load_csv(self, csv_path=None):
+        """Load csv_path (or the configured CSV), replacing any loaded dataset"""
         if csv_path:
             self.csv_path = csv_path
 
-        if not self.csv_path or not os.path.exists(self.csv_path):
-            self.logger.error(f"CSV file not found: {self.csv_path}")
-            return False
+        if not self._ready.is_set():
+            with self._load_lock:
+                return self._load()
+        return self.reload()
 
-        try:
-            start_time = time.time()
-            self.logger.info(f"Loading track features from CSV: {self.csv_path}")
+    def _on_csv_progress(self, rows, bytes_read, total_bytes):
+        # Parsing is ~90% of the load; the rest is indexing and caching
+        fraction = 0.9 * min(bytes_read / total_bytes, 1.0) if total_bytes else 0.0
+        elapsed = time.time() - (self._status["started_at"] or time.time())
+        eta = elapsed / fraction * (1 - fraction) if fraction > 0 else None
+        self._set_status(rows_loaded=rows, fraction=fraction, eta_seconds=eta)
+
+    @property
+    def dataset(self):
+        """The current TrackFeaturesDataset, or None before the first load"""
+        return self._dataset
 
-            # Read CSV in chunks to handle large files efficiently
-            self._df = pd.read_csv(
+    @property
+    def dataset_version(self):
+        """
+        Identifies the loaded dataset; it changes whenever a reload swaps in
+        a new one, so caches derived from the data can key on it.
+        """
+        dataset = self._dataset
+        return dataset.version if dataset else None
+
+    def _build_dataset(self, progress_callback=None):
+        """Read the cache or CSV and build a new dataset, without publishing it"""
+        start_time = time.time()
+        # Taken before reading: a CSV replaced mid-read is picked up next check
+        signature = track_features_signature(self.csv_path)
+
+        # Prefer the binary cache; it is only used while it matches the CSV
+        df = self._read_cache() if self.use_cache else None
+
+        if df is None:
+            self.logger.info(f"Loading track features from CSV: {self.csv_path}")
+            df = read_track_features_csv(
                 self.csv_path,
-                dtype={
-                    "id": str,
-                    "name": str,
-                    "album": str,
-                    "album_id": str,
-                    "artists": str,
-                    "artist_ids": str,
-                },
+                progress_callback=progress_callback,
+                columns=self.columns,
             )
 
-            self.logger.info(
-                f"Loaded {len(self._df)} tracks in {time.time() - start_time:.2f} seconds"
+            if self.use_cache:
+                self._write_cache(df)
+
+        # The cache holds the base CSV only, so an incremental merge costs
+        # parsing its delta rather than the whole file
+        delta = read_track_features_delta(self.csv_path, self.columns)
+        if delta is not None:
+            df = apply_track_features_delta(df, delta)
+            self.logger.info(f"Applied {len(delta)} delta rows")
+
+        self.logger.info(
+            f"Loaded {len(df)} tracks in {time.time() - start_time:.2f} seconds"
+        )
+        self.logger.info(f"Track features memory usage: {memory_report(df)}")
+
+        return TrackFeaturesDataset(
+            df, version=signature_version(signature), signature=signature
+        )
+
+    def _load(self):
+        if not self.csv_path or not os.path.exists(self.csv_path):
+            self.logger.error(f"CSV file not found: {self.csv_path}")
+            self._set_status(state="failed", error="CSV file not found")
+            return False
+
+        with self._status_lock:
+            self._status.update(
+                {
+                    "state": "loading",
+                    "rows_loaded": 0,
+                    "fraction": 0.0,
+                    "started_at": self._status["started_at"] or time.time(),
+                    "eta_seconds": None,
+                    "error": None,
+                }
             )
 
-            # Create indices for faster lookups
-            self._create_indices()
+        try:
+            self._dataset = self._build_dataset(self._on_csv_progress)
+
+            self._set_status(
+                state="ready",
+                rows_loaded=len(self._dataset),
+                fraction=1.0,
+                eta_seconds=0,
+                started_at=None,
+            )
+            self._ready.set()
             return True
         except Exception as e:
             self.logger.error(f"Failed to load CSV: {str(e)}")
+            self._set_status(state="failed", error=str(e), started_at=None)
             return False
 
-    def _create_indices(self):
-        if self._df is None:
-            return
+    def reload(self):
+        """
+        Rebuild the dataset from the CSV and swap it in.
 
-        start_time = time.time()
-        self.logger.info("Creating track feature indices...")
+        Readers keep using the current dataset while the new one is built;
+        if the rebuild fails the current dataset stays in place.
+        """
+        if not self.csv_path or not os.path.exists(self.csv_path):
+            self.logger.error(f"CSV file not found: {self.csv_path}")
+            return False
 
-        # Create primary index by track ID
-        self._index = {}
-        self._id_cache = set(self._df["id"].values)
-        self._indexed = True
+        with self._load_lock:
+            if not self._ready.is_set():
+                return self._load()
 
-        self.logger.info(f"Created indices in {time.time() - start_time:.2f} seconds")
+            try:
+                dataset = self._build_dataset()
+            except Exception as e:
+                self.logger.error(f"Failed to reload track features: {str(e)}")
+                return False
 
-    def get_features_by_id(self, track_id):
-        if self._df is None:
+            previous = self._dataset
+            self._dataset = dataset
+            self._set_status(rows_loaded=len(dataset))
+            self.logger.info(
+                f"Swapped track features dataset {previous.version if previous else None} -> {dataset.version}"
+            )
+            return True
+
+    def reload_if_changed(self):
+        """
+        Start a background reload if the CSV or its delta file changed since
+        the dataset was built. The file is stat'ed at most once per reload_check_interval.
+
+        Returns the reload thread, or None if no reload was started.
+        """
+        dataset = self._dataset
+        if not self.reload_check_interval or dataset is None or not self.csv_path:
             return None
 
-        if track_id not in self._id_cache:
+        now = time.time()
+        if now - self._last_change_check < self.reload_check_interval:
+            return None
+        self._last_change_check = now
+
+        try:
+            if track_features_signature(self.csv_path) == dataset.signature:
+                return None
+        except OSError:
             return None
 
-        # Use pandas filtering for efficient lookup
-        track = self._df[self._df["id"] == track_id]
+        with self._reload_lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return None
+            self.logger.info(f"{self.csv_path} changed, reloading track features")
+            self._reload_thread = threading.Thread(
+                target=self.reload, name="track-features-reload", daemon=True
+            )
+            self._reload_thread.start()
+            return self._reload_thread
+
+    @property
+    def cache_path(self):
+        return f"{self.csv_path}{CACHE_SUFFIX}" if self.csv_path else None
+
+    def _source_signature(self):
+        stat = os.stat(self.csv_path)
+        return {
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "projection": self.columns,
+        }
 
-        if len(track) == 0:
+    def _read_cache(self):
+        """Load the DataFrame from the sidecar cache, or None if it is missing or stale"""
+        cache_path = self.cache_path
+        if not cache_path or not os.path.exists(cache_path):
             return None
 
-        # Convert row to dictionary and process special fields
-        result = track.iloc[0].to_dict()
+        try:
+            with np.load(cache_path, allow_pickle=False) as cache:
+                meta = json.loads(str(cache["__meta__"]))
 
-        # Process artists field - convert from string representation to clean format
-        if "artists" in result and isinstance(result["artists"], str):
-            # Handle string representations like "['Artist1', 'Artist2']"
-            if result["artists"].startswith("[") and result["artists"].endswith("]"):
-                try:
-                    # Parse the string to get the actual list
-                    artists_list = eval(result["artists"])
-                    # Format as comma-separated string
-                    result["artists"] = ", ".join(artists_list)
-                except:
-                    # If parsing fails, keep as is
-                    pass
+                if meta.get("format_version") != CACHE_FORMAT_VERSION:
+                    self.logger.info("Track features cache format changed, rebuilding")
+                    return None
 
-        # Add data source indicator
-        result["data_source"] = "csv"
+                signature = self._source_signature()
+                if any(meta.get(key) != value for key, value in signature.items()):
+                    self.logger.info(
+                        "Track features CSV or column selection changed, rebuilding cache"
+                    )
+                    return None
 
-        return result
+                columns = {}
+                for position, column in enumerate(meta["columns"]):
+                    key = f"c{position}"
+                    if column["kind"] == "strings":
+                        columns[column["name"]] = _decode_strings(
+                            cache[key], cache[f"{key}_missing"]
+                        )
+                    elif column["kind"] == "category":
+                        categories = _decode_strings(
+                            cache[f"{key}_categories"],
+                            np.zeros(column["category_count"], dtype=bool),
+                        )
+                        columns[column["name"]] = pd.Categorical.from_codes(
+                            cache[key], categories=categories
+                        )
+                    else:
+                        columns[column["name"]] = cache[key]
 
-    def get_features_batch(self, track_ids):
-        if self._df is None:
-            return []
+            self.logger.info(f"Loaded track features from cache: {cache_path}")
+            return pd.DataFrame(columns, copy=False)
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable track features cache: {str(e)}")
+            return None
 
-        # Filter existing IDs first to make the dataframe operation more efficient
-        existing_ids = [
-            track_id for track_id in track_ids if track_id in self._id_cache
-        ]
+    def _write_cache(self, df):
+        """Write df next to the CSV as a columnar .npz keyed on the CSV's mtime/size"""
+        cache_path = self.cache_path
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
 
-        if not existing_ids:
-            return []
+        try:
+            start_time = time.time()
+            arrays = {}
+            columns = []
 
-        # Use isin for efficient batch filtering
-        tracks = self._df[self._df["id"].isin(existing_ids)]
-
-        # Convert to list of dictionaries and process special fields
-        results = []
-        for _, row in tracks.iterrows():
-            result = row.to_dict()
-
-            # Process artists field
-            if "artists" in result and isinstance(result["artists"], str):
-                if result["artists"].startswith("[") and result["artists"].endswith(
-                    "]"
-                ):
-                    try:
-                        artists_list = eval(result["artists"])
-                        result["artists"] = ", ".join(artists_list)
-                    except:
-                        pass
-
-            # Add data source indicator
-            result["data_source"] = "csv"
-            results.append(result)
+            for position, name in enumerate(df.columns):
+                key = f"c{position}"
+                series = df[name]
+                if isinstance(series.dtype, pd.CategoricalDtype):
+                    categories = pd.Series(series.cat.categories.astype(str))
+                    arrays[key] = series.cat.codes.to_numpy()
+                    arrays[f"{key}_categories"], _ = _encode_strings(categories)
+                    columns.append(
+                        {
+                            "name": name,
+                            "kind": "category",
+                            "category_count": len(categories),
+                        }
+                    )
+                elif series.dtype == object:
+                    arrays[key], arrays[f"{key}_missing"] = _encode_strings(series)
+                    columns.append({"name": name, "kind": "strings"})
+                else:
+                    arrays[key] = series.to_numpy()
+                    columns.append({"name": name, "kind": "array"})
 
-        return results
+            meta = {
+                "format_version": CACHE_FORMAT_VERSION,
+                "columns": columns,
+                **self._source_signature(),
+            }
+            arrays["__meta__"] = np.array(json.dumps(meta))
+
+            # Write to a temp file and rename so other workers never see a partial cache
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, cache_path)
+
+            self.logger.info(
+                f"Wrote track features cache {cache_path} in {time.time() - start_time:.2f} seconds"
+            )
+        except Exception as e:
+            self.logger.warning(f"Failed to write track features cache: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # Lookups run against whichever dataset is current when they start, so
+    # a reload swapping it mid-call cannot mix two versions.
+    def get_features_by_id(self, track_id):
+        dataset = self._dataset
+        return dataset.get_features_by_id(track_id) if dataset else None
+
+    def get_features_batch(self, track_ids):
+        dataset = self._dataset
+        return dataset.get_features_batch(track_ids) if dataset else []
 
     def search_tracks(self, name=None, artist=None, album=None, limit=10):
-        if self._df is None:
+        dataset = self._dataset
+        if dataset is None:
             return []
+        return dataset.search_tracks(name=name, artist=artist, album=album, limit=limit)
 
-        query = self._df
-
-        if name:
-            query = query[query["name"].str.contains(name, case=False, na=False)]
+    def find_similar(self, track_id, k=10):
+        dataset = self._dataset
+        return dataset.find_similar(track_id, k) if dataset else []
 
-        if artist:
-            query = query[query["artists"].str.contains(artist, case=False, na=False)]
+    def find_similar_batch(self, track_ids, k=10):
+        dataset = self._dataset
+        return dataset.find_similar_batch(track_ids, k) if dataset else {}
 
-        if album:
-            query = query[query["album"].str.contains(album, case=False, na=False)]
+    def percentile(self, feature, value):
+        """Percentage of dataset tracks with a lower value of feature (0-100)"""
+        dataset = self._dataset
+        return dataset.percentile(feature, value) if dataset else None
 
-        # Return limited results as list of dictionaries
-        return [row.to_dict() for _, row in query.head(limit).iterrows()]
+    def percentiles(self, values):
+        """Percentiles for a dict of feature -> value, e.g. a library average"""
+        dataset = self._dataset
+        return dataset.percentiles(values) if dataset else {}
 
     def get_track_ids_in_csv(self):
-        return list(self._id_cache) if self._df is not None else []
+        dataset = self._dataset
+        return dataset.get_track_ids_in_csv() if dataset else []
+
 
+def get_track_features_manager(app=None, wait=True):
+    """
+    Return the audio feature source for the app.
 
-def get_track_features_manager(app=None):
+    With wait=False the manager is returned without loading it, so callers
+    can report its load progress (see TrackFeaturesManager.get_load_progress).
+    """
     if app is None:
         from flask import current_app
 
         app = current_app
 
     csv_path = app.config.get("TRACK_FEATURES_CSV_PATH")
+    use_cache = app.config.get("TRACK_FEATURES_USE_CACHE", True)
+    columns = resolve_feature_columns(app.config.get("TRACK_FEATURES_COLUMNS"))
+
+    # A prebuilt memory-mapped store is shared by all workers, so prefer it
+    store_path = app.config.get("TRACK_FEATURES_STORE_PATH")
+    if store_path and os.path.exists(store_path):
+        from app.spotify.feature_store import get_feature_store
+
+        try:
+            store = get_feature_store(store_path)
+        except ValueError as e:
+            app.logger.warning(f"{str(e)}; falling back to the CSV")
+        else:
+            store.warn_if_stale(csv_path)
+            return store
+
+    manager = TrackFeaturesManager(
+        csv_path,
+        use_cache=use_cache,
+        columns=columns,
+        reload_check_interval=app.config.get("TRACK_FEATURES_RELOAD_INTERVAL"),
+    )
+    if wait:
+        manager.ensure_loaded()
+    # Pick up a replaced CSV in the background; readers keep the old version
+    manager.reload_if_changed()
+    return manager
+
 
-    manager = TrackFeaturesManager(csv_path)
+def start_track_features_warmup(app):
+    """Begin loading the track features in the background at app start"""
+    manager = get_track_features_manager(app, wait=False)
+    if manager.start_background_load():
+        app.logger.info("Started background load of track features")
     return manager
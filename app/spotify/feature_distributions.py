@@ -0,0 +1,88 @@
+"""
+Global distributions of audio features across the whole features dataset.
+
+Each feature is summarized by a fixed grid of quantiles, computed once when
+the dataset is loaded. A value is turned into a percentile by binary search
+over that grid, so comparing a track or a library average against every
+track in the dataset costs O(log n) instead of a scan.
+"""
+
+import numpy as np
+
+# Number of quantile points per feature (0th to 100th percentile, every 0.1%)
+QUANTILE_POINTS = 1001
+
+
+class FeatureDistributions:
+    def __init__(self, quantiles):
+        """
+        Args:
+            quantiles: dict mapping feature name to its sorted quantile grid
+        """
+        self.quantiles = {
+            name: np.asarray(grid, dtype=np.float64) for name, grid in quantiles.items()
+        }
+
+    @classmethod
+    def from_columns(cls, columns, points=QUANTILE_POINTS):
+        """
+        Compute the distributions from feature arrays.
+
+        Args:
+            columns: dict mapping feature name to a 1D array of values; NaNs
+                are ignored
+        """
+        probabilities = np.linspace(0, 1, points)
+        quantiles = {}
+        for name, values in columns.items():
+            values = np.asarray(values, dtype=np.float64)
+            values = values[~np.isnan(values)]
+            if len(values):
+                quantiles[name] = np.quantile(values, probabilities)
+        return cls(quantiles)
+
+    @property
+    def features(self):
+        return list(self.quantiles)
+
+    def percentile(self, feature, value):
+        """
+        Percentage of tracks in the dataset with a lower value (0-100), or
+        None if the feature is unknown or value is missing.
+        """
+        grid = self.quantiles.get(feature)
+        if grid is None or value is None:
+            return None
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        if np.isnan(value):
+            return None
+
+        steps = len(grid) - 1
+        low = int(np.searchsorted(grid, value, side="left"))
+        high = int(np.searchsorted(grid, value, side="right"))
+
+        if low == 0 and high == 0:
+            return 0.0
+        if low == len(grid):
+            return 100.0
+        if low < high:
+            # value sits on a flat stretch of the grid (many identical values):
+            # report the middle of the stretch
+            position = (low + high - 1) / 2
+        else:
+            # Interpolate between the surrounding grid points
+            below, above = grid[low - 1], grid[low]
+            position = low - 1 + (value - below) / (above - below)
+        return float(100 * position / steps)
+
+    def percentiles(self, values):
+        """Percentiles for a dict of feature -> value, skipping unknown features"""
+        result = {}
+        for feature, value in values.items():
+            percentile = self.percentile(feature, value)
+            if percentile is not None:
+                result[feature] = percentile
+        return result
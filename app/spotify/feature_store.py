@@ -0,0 +1,501 @@
+"""
+Memory-mapped audio feature store.
+
+The store is a directory produced by build_feature_store() from the track
+features CSV. It holds:
+
+- ids.npy: track IDs as fixed-width bytes, sorted for binary search
+- features.npy: a float32 matrix with one row per ID and one column per
+  numeric field
+- <column>.bin / <column>.offsets.npy / <column>.missing.npy: UTF-8 string
+  tables addressed by offsets
+- quantiles.npy: per-feature quantile grids for percentile ranking
+- meta.json: column layout and the signature of the source CSV
+
+Everything is opened with numpy memory maps, so every gunicorn worker shares
+the same page-cache pages instead of holding its own DataFrame, and lookups
+do not need pandas. Search and similarity indexes are built in memory on
+first use, as they are for the CSV.
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+import time
+import numpy as np
+from app.spotify.feature_distributions import FeatureDistributions
+from app.spotify.similarity_index import SimilarityIndex
+
+STORE_FORMAT_VERSION = 2
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class FeatureStore:
+    def __init__(self, store_path):
+        self.logger = logging.getLogger(__name__)
+        self.store_path = store_path
+
+        with open(os.path.join(store_path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        if self.meta.get("format_version") != STORE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported feature store version in {store_path}, please rebuild it"
+            )
+
+        self._ids = np.load(os.path.join(store_path, "ids.npy"), mmap_mode="r")
+        self._features = np.load(
+            os.path.join(store_path, "features.npy"), mmap_mode="r"
+        )
+
+        self._strings = {}
+        for name in self.meta["string_columns"]:
+            self._strings[name] = (
+                self._map_bytes(os.path.join(store_path, f"{name}.bin")),
+                np.load(os.path.join(store_path, f"{name}.offsets.npy"), mmap_mode="r"),
+                np.load(os.path.join(store_path, f"{name}.missing.npy"), mmap_mode="r"),
+            )
+
+        # Position of every numeric column inside the feature matrix
+        self._feature_slots = {
+            column["name"]: slot
+            for slot, column in enumerate(self.meta["numeric_columns"])
+        }
+
+        # Stores built before quantiles were added simply have no percentiles
+        quantiles_path = os.path.join(store_path, "quantiles.npy")
+        quantile_features = self.meta.get("quantile_features", [])
+        if os.path.exists(quantiles_path):
+            grids = np.load(quantiles_path)
+            self.distributions = FeatureDistributions(
+                dict(zip(quantile_features, grids))
+            )
+        else:
+            self.distributions = FeatureDistributions({})
+
+        # CSV paths already compared against this store by warn_if_stale
+        self._checked_sources = set()
+
+        # Search and similarity indexes, built on first use like the
+        # TrackFeaturesDataset ones
+        self._search_indexes = {}
+        self._search_lock = threading.Lock()
+        self._similarity_index = None
+        self._similarity_lock = threading.Lock()
+
+        self.logger.info(
+            f"Opened feature store {store_path} with {len(self._ids)} tracks"
+        )
+
+    @staticmethod
+    def _map_bytes(path):
+        # np.memmap refuses empty files, and an all-empty column has no bytes
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self._ids)
+
+    def is_stale(self, csv_path):
+        """True if csv_path (or its delta) is not what this store was built from"""
+        from app.spotify.csv_data_manager import track_features_signature
+
+        if not csv_path or not os.path.exists(csv_path):
+            return False
+        signature = track_features_signature(csv_path)
+        return any(self.meta.get(key) != value for key, value in signature.items())
+
+    def warn_if_stale(self, csv_path):
+        """
+        Log a warning if the store is older than csv_path. Each path is
+        checked once per opened store, so callers can run this per request.
+        """
+        if csv_path in self._checked_sources:
+            return
+        self._checked_sources.add(csv_path)
+
+        try:
+            stale = self.is_stale(csv_path)
+        except OSError:
+            return
+        if stale:
+            self.logger.warning(
+                f"Feature store {self.store_path} is older than {csv_path}; run 'flask build-feature-store' to refresh it"
+            )
+
+    @property
+    def dataset_version(self):
+        from app.spotify.csv_data_manager import signature_version
+
+        return signature_version(self.meta)
+
+    # The store is usable as soon as it is opened; these mirror the
+    # TrackFeaturesManager load API so callers can treat both alike.
+    def is_ready(self):
+        return True
+
+    def wait_until_ready(self, timeout=None):
+        return True
+
+    def start_background_load(self):
+        return None
+
+    def ensure_loaded(self):
+        return True
+
+    def reload(self):
+        """
+        Drop this store from the process cache, so the next
+        get_feature_store() opens the files build_feature_store() swapped in.
+        Callers still holding this store keep reading the old files.
+        """
+        with _stores_lock:
+            key = os.path.abspath(self.store_path)
+            if _stores.get(key) is self:
+                del _stores[key]
+        return True
+
+    def get_load_progress(self):
+        return {
+            "percent": 100,
+            "completed": len(self._ids),
+            "total": len(self._ids),
+            "status": f"Audio features store ready ({len(self._ids)} tracks)",
+            "complete": True,
+            "eta_seconds": 0,
+        }
+
+    def _positions_for_ids(self, track_ids):
+        """Binary search IDs in the sorted ID table, preserving request order"""
+        unique_ids = list(dict.fromkeys(tid for tid in track_ids if tid))
+        if not unique_ids or len(self._ids) == 0:
+            return []
+
+        # Spotify IDs are ASCII and no longer than the ID width; anything else
+        # cannot be in the store, and numpy would truncate overlong IDs into
+        # false matches
+        width = self._ids.dtype.itemsize
+        keys = np.array(
+            [tid for tid in unique_ids if tid.isascii() and len(tid) <= width],
+            dtype=self._ids.dtype,
+        )
+        if len(keys) == 0:
+            return []
+
+        positions = np.searchsorted(self._ids, keys)
+        positions = np.minimum(positions, len(self._ids) - 1)
+        found = self._ids[positions] == keys
+        return positions[found].tolist()
+
+    def _string_value(self, name, position):
+        buffer, offsets, missing = self._strings[name]
+        if missing[position]:
+            return None
+        return str(
+            memoryview(buffer[offsets[position] : offsets[position + 1]]), "utf-8"
+        )
+
+    def _record(self, position):
+        row = self._features[position]
+        result = {}
+
+        for column in self.meta["columns"]:
+            name = column["name"]
+            kind = column["kind"]
+
+            if name == "id":
+                result["id"] = self._ids[position].decode("ascii")
+            elif kind == "string":
+                result[name] = self._string_value(name, position)
+            else:
+                # The shortest repr of the float32 is the value the CSV held
+                value = float(str(row[self._feature_slots[name]]))
+                if kind == "int" and not np.isnan(value):
+                    value = int(value)
+                elif kind == "bool":
+                    value = bool(value)
+                result[name] = value
+
+        result["data_source"] = "csv"
+        return result
+
+    def get_features_by_id(self, track_id):
+        positions = self._positions_for_ids([track_id])
+        if not positions:
+            return None
+        return self._record(positions[0])
+
+    def get_features_batch(self, track_ids):
+        return [
+            self._record(position) for position in self._positions_for_ids(track_ids)
+        ]
+
+    def percentile(self, feature, value):
+        return self.distributions.percentile(feature, value)
+
+    def percentiles(self, values):
+        return self.distributions.percentiles(values)
+
+    def _string_column(self, name):
+        """Every value of a string column, decoded (None where missing)"""
+        buffer, offsets, missing = self._strings[name]
+        # Decode straight from the mapped pages instead of copying the blob
+        data = memoryview(buffer)
+        bounds = offsets.tolist()
+        return [
+            None if is_missing else str(data[start:end], "utf-8")
+            for start, end, is_missing in zip(bounds[:-1], bounds[1:], missing.tolist())
+        ]
+
+    def _search_index(self, column):
+        """Trigram index for a string column, or None if the store lacks it"""
+        if column not in self._strings:
+            return None
+
+        index = self._search_indexes.get(column)
+        if index is None:
+            with self._search_lock:
+                index = self._search_indexes.get(column)
+                if index is None:
+                    import pandas as pd
+                    from app.spotify.search_index import TrigramIndex
+
+                    start_time = time.time()
+                    index = TrigramIndex(
+                        pd.Series(self._string_column(column), dtype=object)
+                    )
+                    self._search_indexes[column] = index
+                    self.logger.info(
+                        f"Built search index for {column} ({len(index.values)} values) in {time.time() - start_time:.2f} seconds"
+                    )
+        return index
+
+    def search_tracks(self, name=None, artist=None, album=None, limit=10):
+        """Case-insensitive substring search, as TrackFeaturesDataset.search_tracks"""
+        from app.spotify.search_index import search_fields
+
+        fields = [
+            (column, text)
+            for column, text in (("name", name), ("artists", artist), ("album", album))
+            if text
+        ]
+        if not fields:
+            positions = range(min(limit, len(self._ids)))
+        else:
+            positions = search_fields(self._search_index, fields, limit).tolist()
+
+        records = [self._record(position) for position in positions]
+        for record in records:
+            del record["data_source"]
+        return records
+
+    def _get_similarity_index(self):
+        index = self._similarity_index
+        if index is None:
+            with self._similarity_lock:
+                index = self._similarity_index
+                if index is None:
+                    from app.spotify.csv_data_manager import CONTINUOUS_FEATURE_COLUMNS
+
+                    start_time = time.time()
+                    slots = [
+                        self._feature_slots[name]
+                        for name in CONTINUOUS_FEATURE_COLUMNS
+                        if name in self._feature_slots
+                    ]
+                    if not slots:
+                        raise ValueError("No audio feature columns in the store")
+
+                    index = SimilarityIndex(
+                        self._features[:, slots], np.arange(len(self._ids))
+                    )
+                    self._similarity_index = index
+                    self.logger.info(
+                        f"Built similarity index over {len(index)} tracks in {time.time() - start_time:.2f} seconds"
+                    )
+        return index
+
+    def find_similar(self, track_id, k=10):
+        """Up to k tracks with the closest audio features to track_id"""
+        return self.find_similar_batch([track_id], k).get(track_id, [])
+
+    def find_similar_batch(self, track_ids, k=10):
+        """Nearest neighbours per seed, as TrackFeaturesDataset.find_similar_batch"""
+        seeds = []
+        for track_id in dict.fromkeys(track_ids):
+            positions = self._positions_for_ids([track_id])
+            if positions:
+                seeds.append((track_id, positions[0]))
+        if not seeds:
+            return {}
+
+        index = self._get_similarity_index()
+        neighbours = index.query_rows([position for _, position in seeds], k)
+
+        results = {}
+        for (track_id, _), found in zip(seeds, neighbours):
+            if found is None:
+                continue
+            positions, distances = found
+            records = [self._record(position) for position in positions.tolist()]
+            for record, distance in zip(records, distances.tolist()):
+                record["distance"] = distance
+            results[track_id] = records
+        return results
+
+    def get_track_ids_in_csv(self):
+        return [track_id.decode("ascii") for track_id in self._ids]
+
+
+def build_feature_store(csv_path, store_path, columns=None):
+    """
+    Build a feature store directory from the track features CSV.
+
+    The store is written next to its final location and swapped in with a
+    rename, so workers that already mapped the previous store keep reading it
+    until they reopen.
+    """
+    import pandas as pd
+    from app.spotify.csv_data_manager import (
+        continuous_feature_columns,
+        read_track_features,
+        track_features_signature,
+    )
+
+    logger = logging.getLogger(__name__)
+    start_time = time.time()
+
+    logger.info(f"Building feature store from {csv_path}")
+    # Taken before reading, like the CSV manager does
+    signature = track_features_signature(csv_path)
+    df = read_track_features(csv_path, columns=columns)
+    df = df[df["id"].notna()]
+
+    # Sort by ID (stable, so the first duplicate wins like in the CSV manager)
+    ids = df["id"].to_numpy(dtype=str).astype("S")
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    keep = np.ones(len(ids), dtype=bool)
+    keep[1:] = ids[1:] != ids[:-1]
+    order = order[keep]
+    ids = ids[keep]
+    df = df.iloc[order]
+
+    tmp_path = f"{store_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    columns = [{"name": "id", "kind": "id"}]
+    numeric_columns = []
+    string_columns = []
+    numeric_arrays = []
+
+    for name in df.columns:
+        if name == "id":
+            continue
+        series = df[name]
+
+        if pd.api.types.is_bool_dtype(series):
+            kind = "bool"
+        elif pd.api.types.is_integer_dtype(series):
+            kind = "int"
+        elif pd.api.types.is_float_dtype(series):
+            kind = "float"
+        else:
+            kind = "string"
+
+        columns.append({"name": name, "kind": kind})
+
+        if kind == "string":
+            _write_string_table(tmp_path, name, series)
+            string_columns.append(name)
+        else:
+            numeric_columns.append({"name": name, "kind": kind})
+            numeric_arrays.append(series.to_numpy(dtype=np.float32, na_value=np.nan))
+
+    features = (
+        np.column_stack(numeric_arrays)
+        if numeric_arrays
+        else np.zeros((len(ids), 0), dtype=np.float32)
+    )
+
+    np.save(os.path.join(tmp_path, "ids.npy"), ids)
+    np.save(
+        os.path.join(tmp_path, "features.npy"),
+        np.ascontiguousarray(features, dtype=np.float32),
+    )
+
+    distributions = FeatureDistributions.from_columns(
+        {
+            feature: df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+            for feature, column in continuous_feature_columns(df).items()
+        }
+    )
+    quantile_features = distributions.features
+    if quantile_features:
+        np.save(
+            os.path.join(tmp_path, "quantiles.npy"),
+            np.vstack([distributions.quantiles[name] for name in quantile_features]),
+        )
+
+    meta = {
+        "format_version": STORE_FORMAT_VERSION,
+        "count": int(len(ids)),
+        "columns": columns,
+        "numeric_columns": numeric_columns,
+        "string_columns": string_columns,
+        "quantile_features": quantile_features,
+        **signature,
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    # Swap the finished store into place
+    old_path = f"{store_path}.{os.getpid()}.old"
+    if os.path.exists(store_path):
+        os.rename(store_path, old_path)
+    os.rename(tmp_path, store_path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+    with _stores_lock:
+        _stores.pop(os.path.abspath(store_path), None)
+
+    logger.info(
+        f"Built feature store {store_path} with {len(ids)} tracks in {time.time() - start_time:.2f} seconds"
+    )
+    return meta
+
+
+def _write_string_table(store_path, name, series):
+    values = series.to_numpy(dtype=object)
+    missing = np.array([not isinstance(value, str) for value in values], dtype=bool)
+    encoded = [
+        b"" if is_missing else value.encode("utf-8")
+        for value, is_missing in zip(values, missing)
+    ]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded], dtype=np.int64)
+
+    with open(os.path.join(store_path, f"{name}.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(store_path, f"{name}.offsets.npy"), offsets)
+    np.save(os.path.join(store_path, f"{name}.missing.npy"), missing)
+
+
+def get_feature_store(store_path):
+    """Return the process-wide FeatureStore for store_path, opening it once"""
+    key = os.path.abspath(store_path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = FeatureStore(store_path)
+            _stores[key] = store
+        return store
@@ -0,0 +1,322 @@
+"""
+Background queue for Spotify data syncs.
+
+With SYNC_IN_BACKGROUND enabled, the sync route only enqueues a job and
+returns; `flask sync-worker` processes claim jobs and run sync_user_data. Jobs
+live in the app database (the SyncJob table) or, when REDIS_URL is set, in
+Redis. Workers save the job's progress as they go, in the same format as
+progress_tracker, so check_progress can serve it from any web process.
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from app.models import SyncJob, User
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Seconds between progress writes while a job runs
+PROGRESS_SAVE_INTERVAL = 1.0
+# A running job without a progress write for this long is treated as dead
+# (its worker was killed) and no longer blocks a new sync of the same data
+STALE_JOB_SECONDS = 600
+# How long a finished job's progress stays readable in Redis
+REDIS_PROGRESS_TTL = 3600
+REDIS_KEY_PREFIX = "spiffy:sync"
+
+
+def sync_operation_id(user_id, data_type):
+    """Operation ID the dashboard polls for a user's sync of data_type"""
+    return f"{data_type}_sync_{user_id}"
+
+
+def queued_progress():
+    return {
+        "percent": 0,
+        "completed": 0,
+        "total": 100,
+        "status": "Waiting for a sync worker",
+        "complete": False,
+    }
+
+
+class JobProgress(dict):
+    """
+    Progress dict that saves itself through a callback: at most once per
+    interval while the job runs, and always when it is marked complete.
+    """
+
+    def __init__(self, save, initial, interval=PROGRESS_SAVE_INTERVAL):
+        super().__init__(initial)
+        self._save = save
+        self._interval = interval
+        self._saved_at = 0.0
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def _changed(self):
+        if self.get("complete") or time.monotonic() - self._saved_at >= self._interval:
+            self.save()
+
+    def save(self):
+        self._saved_at = time.monotonic()
+        try:
+            self._save(dict(self))
+        except Exception as e:
+            # Losing a progress update must not fail the sync itself
+            current_app.logger.warning(f"Could not save sync progress: {str(e)}")
+
+
+class DatabaseSyncQueue:
+    """Jobs stored as SyncJob rows in the app database"""
+
+    name = "database"
+
+    def enqueue(self, user_id, data_type):
+        """Queue a sync unless the same one is already queued or running"""
+        operation_id = sync_operation_id(user_id, data_type)
+        now = datetime.utcnow()
+
+        active = (
+            SyncJob.query.filter(
+                SyncJob.operation_id == operation_id,
+                SyncJob.status.in_([QUEUED, RUNNING]),
+            )
+            .order_by(SyncJob.id.desc())
+            .first()
+        )
+        if active and (
+            active.status == QUEUED
+            or active.updated_at > now - timedelta(seconds=STALE_JOB_SECONDS)
+        ):
+            return operation_id
+        if active:
+            active.status = FAILED
+            active.message = "The sync worker stopped responding"
+            active.finished_at = now
+
+        db.session.add(
+            SyncJob(
+                user_id=user_id,
+                data_type=data_type,
+                operation_id=operation_id,
+                status=QUEUED,
+                progress=json.dumps(queued_progress()),
+                created_at=now,
+                updated_at=now,
+            )
+        )
+        db.session.commit()
+        return operation_id
+
+    def claim(self, timeout):
+        """Take the oldest queued job, or wait up to timeout seconds and return None"""
+        job = SyncJob.query.filter_by(status=QUEUED).order_by(SyncJob.id).first()
+        if job is None:
+            db.session.rollback()
+            time.sleep(timeout)
+            return None
+
+        # Only one worker wins the status change
+        now = datetime.utcnow()
+        claimed = SyncJob.query.filter_by(id=job.id, status=QUEUED).update(
+            {"status": RUNNING, "started_at": now, "updated_at": now},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if not claimed:
+            return None
+
+        return {
+            "id": job.id,
+            "user_id": job.user_id,
+            "data_type": job.data_type,
+            "operation_id": job.operation_id,
+        }
+
+    def _update(self, job, **values):
+        values["updated_at"] = datetime.utcnow()
+        SyncJob.query.filter_by(id=job["id"]).update(values, synchronize_session=False)
+        db.session.commit()
+
+    def save_progress(self, job, progress):
+        self._update(job, progress=json.dumps(progress))
+
+    def finish(self, job, progress, message, failed=False):
+        self._update(
+            job,
+            status=FAILED if failed else DONE,
+            progress=json.dumps(progress),
+            message=message,
+            finished_at=datetime.utcnow(),
+        )
+
+    def get_progress(self, operation_id):
+        job = (
+            SyncJob.query.filter_by(operation_id=operation_id)
+            .order_by(SyncJob.id.desc())
+            .first()
+        )
+        return job.get_progress() if job else None
+
+
+class RedisSyncQueue:
+    """Jobs stored in a Redis list, with progress under a key per operation"""
+
+    name = "redis"
+
+    def __init__(self, url):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.queue_key = f"{REDIS_KEY_PREFIX}:queue"
+
+    def _active_key(self, operation_id):
+        return f"{REDIS_KEY_PREFIX}:active:{operation_id}"
+
+    def _progress_key(self, operation_id):
+        return f"{REDIS_KEY_PREFIX}:progress:{operation_id}"
+
+    def enqueue(self, user_id, data_type):
+        """Queue a sync unless the same one is already queued or running"""
+        operation_id = sync_operation_id(user_id, data_type)
+
+        # The active marker lasts as long as the job waits in the queue; it
+        # only starts to expire once a worker claims the job
+        if not self.redis.set(self._active_key(operation_id), 1, nx=True):
+            return operation_id
+
+        job = {
+            "id": f"{operation_id}:{time.time()}",
+            "user_id": user_id,
+            "data_type": data_type,
+            "operation_id": operation_id,
+        }
+        pipe = self.redis.pipeline()
+        pipe.set(
+            self._progress_key(operation_id),
+            json.dumps(queued_progress()),
+            ex=REDIS_PROGRESS_TTL,
+        )
+        pipe.lpush(self.queue_key, json.dumps(job))
+        pipe.execute()
+        return operation_id
+
+    def claim(self, timeout):
+        """Take the oldest queued job, or wait up to timeout seconds and return None"""
+        item = self.redis.brpop(self.queue_key, timeout=max(int(timeout), 1))
+        if item is None:
+            return None
+
+        job = json.loads(item[1])
+        # From here on the marker expires if the worker dies mid-job;
+        # save_progress keeps pushing the expiry back while it runs
+        self.redis.expire(self._active_key(job["operation_id"]), STALE_JOB_SECONDS)
+        return job
+
+    def save_progress(self, job, progress):
+        pipe = self.redis.pipeline()
+        pipe.set(
+            self._progress_key(job["operation_id"]),
+            json.dumps(progress),
+            ex=REDIS_PROGRESS_TTL,
+        )
+        pipe.expire(self._active_key(job["operation_id"]), STALE_JOB_SECONDS)
+        pipe.execute()
+
+    def finish(self, job, progress, message, failed=False):
+        progress = dict(progress, complete=True)
+        if failed:
+            progress["status"] = message
+        pipe = self.redis.pipeline()
+        pipe.set(
+            self._progress_key(job["operation_id"]),
+            json.dumps(progress),
+            ex=REDIS_PROGRESS_TTL,
+        )
+        pipe.delete(self._active_key(job["operation_id"]))
+        pipe.execute()
+
+    def get_progress(self, operation_id):
+        value = self.redis.get(self._progress_key(operation_id))
+        return json.loads(value) if value else None
+
+
+def get_sync_queue(app=None):
+    """The app's sync queue: Redis when REDIS_URL is configured, else the database"""
+    app = app or current_app._get_current_object()
+    queue = app.extensions.get("sync_queue")
+    if queue is None:
+        redis_url = app.config.get("REDIS_URL")
+        queue = RedisSyncQueue(redis_url) if redis_url else DatabaseSyncQueue()
+        app.extensions["sync_queue"] = queue
+    return queue
+
+
+def run_sync_job(queue, job):
+    """Run one claimed job, recording its progress and outcome in the queue"""
+    from app.spotify.sync import SyncError, sync_user_data
+
+    progress = JobProgress(
+        lambda values: queue.save_progress(job, values),
+        dict(queued_progress(), status="Starting sync operation"),
+    )
+    try:
+        user = db.session.get(User, job["user_id"])
+        if user is None:
+            raise SyncError(f"User {job['user_id']} no longer exists")
+
+        message = sync_user_data(user, job["data_type"], progress)
+    except SyncError as e:
+        current_app.logger.warning(f"Sync job {job['id']} failed: {str(e)}")
+        progress.update({"status": str(e), "complete": True})
+        queue.finish(job, progress, str(e), failed=True)
+        return False
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"Sync job {job['id']} crashed")
+        progress.update({"status": f"Error: {str(e)}", "complete": True})
+        queue.finish(job, progress, str(e), failed=True)
+        return False
+    finally:
+        # Don't carry stale objects into the next job
+        db.session.remove()
+
+    current_app.logger.info(f"Sync job {job['id']} done: {message}")
+    queue.finish(job, progress, message)
+    return True
+
+
+def run_sync_worker(queue, once=False, poll_interval=2.0):
+    """
+    Claim and run jobs until interrupted, or until the queue is empty if once.
+
+    Returns:
+        Number of jobs run
+    """
+    jobs_run = 0
+    while True:
+        job = queue.claim(timeout=0 if once else poll_interval)
+        if job is None:
+            if once:
+                return jobs_run
+            continue
+
+        current_app.logger.info(
+            f"Running sync job {job['id']}: {job['data_type']} for user {job['user_id']}"
+        )
+        run_sync_job(queue, job)
+        jobs_run += 1
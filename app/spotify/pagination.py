@@ -0,0 +1,112 @@
+"""
+Concurrent pagination for Spotify's offset-based list endpoints.
+
+The first page of a list (saved tracks, playlists, ...) reports the total
+number of items, so every remaining offset is known up front. Instead of
+following `next` links one request at a time, the remaining pages are
+fetched by a small thread pool and handed back in offset order.
+
+All requests made through this module share one process-wide semaphore, so
+concurrent syncs together never have more than SPOTIFY_MAX_CONCURRENT_REQUESTS
+calls in flight.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from flask import current_app, has_app_context
+
+# Defaults when there is no app config to read them from
+DEFAULT_PAGE_WORKERS = 4
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+# Page size of the paginated endpoints (Spotify's maximum for most of them)
+PAGE_SIZE = 50
+
+_request_slots = None
+_request_slots_lock = threading.Lock()
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def _slots():
+    """The process-wide semaphore bounding in-flight requests"""
+    global _request_slots
+    if _request_slots is None:
+        with _request_slots_lock:
+            if _request_slots is None:
+                _request_slots = threading.BoundedSemaphore(
+                    _config(
+                        "SPOTIFY_MAX_CONCURRENT_REQUESTS",
+                        DEFAULT_MAX_CONCURRENT_REQUESTS,
+                    )
+                )
+    return _request_slots
+
+
+def _limited(slots, function, *args):
+    with slots:
+        return function(*args)
+
+
+def ordered_map(function, items, workers=None):
+    """
+    Yield function(item) for every item, in order, running up to workers
+    calls at a time.
+
+    Only a bounded window of calls runs ahead of the consumer, and calls that
+    have not started yet are cancelled if the consumer stops early. The first
+    exception raised by a call is re-raised when its result is reached.
+    """
+    workers = workers or _config("SPOTIFY_PAGE_WORKERS", DEFAULT_PAGE_WORKERS)
+    items = iter(items)
+    # Create the shared semaphore here: pool threads have no app config to size it
+    slots = _slots()
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spotify-page")
+    try:
+        pending = deque(
+            pool.submit(_limited, slots, function, item)
+            for item in islice(items, workers * 2)
+        )
+        while pending:
+            result = pending.popleft().result()
+            for item in islice(items, 1):
+                pending.append(pool.submit(_limited, slots, function, item))
+            yield result
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_pages(fetch, page_size=PAGE_SIZE, max_items=None, workers=None):
+    """
+    Yield every page of an offset-paginated endpoint, in order.
+
+    Args:
+        fetch: callable taking (limit, offset) and returning a Spotify paging
+            object (a dict with items, total and next)
+        page_size: items per request
+        max_items: stop after the page containing this many items
+        workers: concurrent requests for this listing (defaults to the
+            SPOTIFY_PAGE_WORKERS config)
+    """
+    first = _limited(_slots(), fetch, page_size, 0)
+    yield first
+
+    if not first.get("next"):
+        return
+
+    total = first.get("total") or 0
+    if max_items is not None:
+        total = min(total, max_items)
+
+    yield from ordered_map(
+        lambda offset: fetch(page_size, offset),
+        range(page_size, total, page_size),
+        workers=workers,
+    )
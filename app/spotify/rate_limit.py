@@ -0,0 +1,267 @@
+"""
+Central rate limiting for Spotify Web API calls.
+
+Every request made through RateLimitedSpotify first takes a token from a
+bucket shared by the whole process, or by every process when REDIS_URL is
+configured. The bucket adapts its rate: each request nudges it up, and a 429
+halves it and pauses all callers for the Retry-After the API asked for. Syncs
+therefore run as fast as the quota allows instead of sleeping blindly, and
+back off together when they overshoot.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+import spotipy
+from flask import current_app, has_app_context
+from spotipy.exceptions import SpotifyException
+
+logger = logging.getLogger(__name__)
+
+# Requests per second the bucket starts at, and the bounds it adapts within
+DEFAULT_RATE = 10.0
+DEFAULT_MIN_RATE = 1.0
+DEFAULT_MAX_RATE = 30.0
+# Tokens that can be spent at once after an idle period
+DEFAULT_BURST = 10
+# Rate added per granted request, and the factor applied on a 429
+RATE_INCREASE = 0.05
+RATE_DECREASE = 0.5
+# Retry-After assumed when a 429 doesn't carry one
+DEFAULT_RETRY_AFTER = 1.0
+# A 429 asking to wait longer than this is raised instead of waited out
+MAX_RETRY_AFTER = 120.0
+# Times a request is retried after a 429
+MAX_RATE_LIMIT_RETRIES = 5
+# Statuses spotipy's own HTTP adapter retries. 429 is left out so it reaches
+# the limiter instead of being slept through inside urllib3.
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+REDIS_KEY = "spiffy:spotify:rate_limit"
+
+
+class TokenBucket:
+    """Token bucket shared by the threads of this process"""
+
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        min_rate=DEFAULT_MIN_RATE,
+        max_rate=DEFAULT_MAX_RATE,
+    ):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self):
+        """Take a token and return 0, or return how long to wait for one"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            wait = self._wait_time()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self, retry_after):
+        """Pause every caller for retry_after seconds and lower the rate"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+            self._tokens = 0.0
+
+
+class RedisTokenBucket:
+    """Token bucket kept in Redis so every process shares one quota"""
+
+    # KEYS[1]: bucket hash. ARGV: rate, burst, min rate, max rate, increase.
+    # Returns 0 when a token was taken, else the seconds to wait (as a string).
+    ACQUIRE_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated', 'rate', 'paused_until')
+    local burst = tonumber(ARGV[2])
+    local rate = tonumber(state[3]) or tonumber(ARGV[1])
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    local paused_until = tonumber(state[4]) or 0
+    if now < paused_until then
+        return tostring(paused_until - now)
+    end
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        rate = math.min(tonumber(ARGV[4]), rate + tonumber(ARGV[5]))
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now, 'rate', rate)
+    redis.call('EXPIRE', KEYS[1], 3600)
+    return tostring(wait)
+    """
+
+    # KEYS[1]: bucket hash. ARGV: retry after, initial rate, min rate, factor.
+    PENALIZE_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'rate', 'paused_until')
+    local rate = tonumber(state[1]) or tonumber(ARGV[2])
+    local paused_until = math.max(tonumber(state[2]) or 0, now + tonumber(ARGV[1]))
+    rate = math.max(tonumber(ARGV[3]), rate * tonumber(ARGV[4]))
+    redis.call('HSET', KEYS[1], 'rate', rate, 'paused_until', paused_until, 'tokens', 0, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], 3600)
+    return 1
+    """
+
+    def __init__(
+        self,
+        url,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        min_rate=DEFAULT_MIN_RATE,
+        max_rate=DEFAULT_MAX_RATE,
+        key=REDIS_KEY,
+    ):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self._acquire = self.redis.register_script(self.ACQUIRE_SCRIPT)
+        self._penalize = self.redis.register_script(self.PENALIZE_SCRIPT)
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            wait = float(
+                self._acquire(
+                    keys=[self.key],
+                    args=[
+                        self.rate,
+                        self.burst,
+                        self.min_rate,
+                        self.max_rate,
+                        RATE_INCREASE,
+                    ],
+                )
+            )
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self, retry_after):
+        """Pause every caller for retry_after seconds and lower the rate"""
+        self._penalize(
+            keys=[self.key],
+            args=[retry_after, self.rate, self.min_rate, RATE_DECREASE],
+        )
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def _config(key, default):
+    if has_app_context():
+        return current_app.config.get(key, default)
+    return default
+
+
+def get_rate_limiter():
+    """The process-wide limiter, backed by Redis when REDIS_URL is configured"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                settings = dict(
+                    rate=_config("SPOTIFY_RATE_LIMIT", DEFAULT_RATE),
+                    burst=_config("SPOTIFY_RATE_LIMIT_BURST", DEFAULT_BURST),
+                    min_rate=_config("SPOTIFY_RATE_LIMIT_MIN", DEFAULT_MIN_RATE),
+                    max_rate=_config("SPOTIFY_RATE_LIMIT_MAX", DEFAULT_MAX_RATE),
+                )
+                redis_url = _config("REDIS_URL", None)
+                if redis_url:
+                    _rate_limiter = RedisTokenBucket(redis_url, **settings)
+                else:
+                    _rate_limiter = TokenBucket(**settings)
+    return _rate_limiter
+
+
+def retry_after_seconds(headers):
+    """Seconds from a Retry-After header, or the default if absent"""
+    try:
+        return max(float((headers or {}).get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class RateLimitedSpotify(spotipy.Spotify):
+    """
+    spotipy client whose every API call goes through the shared rate
+    limiter, retrying 429 responses after their Retry-After.
+    """
+
+    def __init__(
+        self, *args, rate_limiter=None, max_retries=MAX_RATE_LIMIT_RETRIES, **kwargs
+    ):
+        kwargs.setdefault("status_forcelist", RETRY_STATUS_CODES)
+        # A session passed in is shared with other clients and must outlive us
+        self._owns_session = not isinstance(
+            kwargs.get("requests_session", True), requests.Session
+        )
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_rate_limit_retries = max_retries
+
+    def __del__(self):
+        if getattr(self, "_owns_session", True):
+            super().__del__()
+
+    def _internal_call(self, method, url, payload, params):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                # spotipy edits params in place, so every attempt gets a copy
+                return super()._internal_call(method, url, payload, dict(params))
+            except SpotifyException as e:
+                if e.http_status != 429:
+                    raise
+
+                retry_after = retry_after_seconds(e.headers)
+                self.rate_limiter.penalize(retry_after)
+                attempt += 1
+                if attempt > self.max_rate_limit_retries or (
+                    retry_after > MAX_RETRY_AFTER
+                ):
+                    raise
+                logger.info(
+                    f"Spotify rate limit hit, retrying {method} {url} in "
+                    f"{retry_after:.1f}s (attempt {attempt}/{self.max_rate_limit_retries})"
+                )
@@ -0,0 +1,252 @@
+"""
+Trigram index for case-insensitive substring search over DataFrame columns.
+
+Each distinct (lowercased) value of a column is split into character
+trigrams. Postings map every trigram to the sorted list of distinct values
+containing it, and a second table maps each distinct value back to the rows
+that hold it. A query intersects the postings of its trigrams, verifies the
+few surviving candidates with a plain substring test and ranks them, so it
+never scans the whole column.
+
+Queries of one or two characters are too short for trigrams. They match
+value prefixes only, found by binary search over the sorted distinct values.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+# Queries shorter than this match value prefixes instead of substrings
+MIN_SUBSTRING_QUERY = 3
+# Sorts after every character, closing the range of values with a prefix
+MAX_CHAR = chr(0x10FFFF)
+
+# Ranks for a matched value, lower is better
+RANK_EXACT = 0
+RANK_PREFIX = 1
+RANK_WORD_PREFIX = 2
+RANK_SUBSTRING = 3
+
+
+class TrigramIndex:
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series, use_na_sentinel=True)
+        self.values = [str(value).lower() for value in uniques]
+        self._lengths = np.fromiter(
+            (len(value) for value in self.values),
+            dtype=np.int64,
+            count=len(self.values),
+        )
+
+        self._build_postings()
+        self._build_rows(codes)
+
+        # Distinct-value ids in value order, for prefix lookups
+        self._sorted_ids = np.array(
+            sorted(range(len(self.values)), key=self.values.__getitem__),
+            dtype=np.int64,
+        )
+        self._sorted_values = [self.values[i] for i in self._sorted_ids.tolist()]
+
+    def _build_postings(self):
+        values = self.values
+        count = len(values)
+        lengths = self._lengths
+
+        codepoints = np.frombuffer("".join(values).encode("utf-32-le"), dtype=np.uint32)
+
+        # Map characters to dense ids so a trigram fits in a single integer
+        self._chars, dense = np.unique(codepoints, return_inverse=True)
+        self._base = max(len(self._chars), 1)
+        dense = dense.astype(np.int64)
+
+        # A trigram starts at every position at least two characters before
+        # the end of its value
+        starts = np.zeros(count, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        value_ids = np.repeat(np.arange(count, dtype=np.int64), lengths)
+        offsets = np.arange(len(codepoints), dtype=np.int64) - np.repeat(
+            starts, lengths
+        )
+        positions = np.flatnonzero(offsets <= np.repeat(lengths, lengths) - 3)
+
+        keys = (
+            dense[positions] * self._base * self._base
+            + dense[positions + 1] * self._base
+            + dense[positions + 2]
+        )
+
+        # Deduplicate (trigram, value) pairs and sort them by trigram. When the
+        # pair fits in one int64 a single sort does it, otherwise use lexsort.
+        if self._base**3 * max(count, 1) < 2**62:
+            pairs = np.unique(keys * count + value_ids[positions])
+            keys, ids = np.divmod(pairs, count) if count else (pairs, pairs)
+        else:
+            order = np.lexsort((value_ids[positions], keys))
+            keys, ids = keys[order], value_ids[positions][order]
+            keep = np.ones(len(keys), dtype=bool)
+            keep[1:] = (keys[1:] != keys[:-1]) | (ids[1:] != ids[:-1])
+            keys, ids = keys[keep], ids[keep]
+
+        self._trigrams, first = np.unique(keys, return_index=True)
+        self._posting_offsets = np.append(first, len(keys)).astype(np.int64)
+        self._postings = ids.astype(np.int32)
+
+    def _build_rows(self, codes):
+        # Rows grouped by value: rows of value v are
+        # _rows[_row_offsets[v]:_row_offsets[v + 1]]
+        order = np.argsort(codes, kind="stable")
+        order = order[codes[order] >= 0]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.values))
+        self._rows = order.astype(np.int64)
+        self._row_offsets = np.zeros(len(self.values) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self._row_offsets[1:])
+
+    def _trigram_keys(self, text):
+        codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        dense = np.searchsorted(self._chars, codepoints)
+        if len(self._chars) == 0 or np.any(
+            self._chars[np.minimum(dense, len(self._chars) - 1)] != codepoints
+        ):
+            return None
+        dense = dense.astype(np.int64)
+        return np.unique(
+            dense[:-2] * self._base * self._base + dense[1:-1] * self._base + dense[2:]
+        )
+
+    def _prefixed(self, text):
+        """Distinct-value ids starting with text"""
+        start = bisect_left(self._sorted_values, text)
+        end = bisect_left(self._sorted_values, text + MAX_CHAR, lo=start)
+        return self._sorted_ids[start:end]
+
+    def _candidates(self, text):
+        """Distinct-value ids that may contain text"""
+        keys = self._trigram_keys(text)
+        if keys is None:
+            return np.zeros(0, dtype=np.int32)
+
+        slots = np.searchsorted(self._trigrams, keys)
+        slots = np.minimum(slots, max(len(self._trigrams) - 1, 0))
+        if len(self._trigrams) == 0 or np.any(self._trigrams[slots] != keys):
+            return np.zeros(0, dtype=np.int32)
+
+        postings = [
+            self._postings[
+                self._posting_offsets[slot] : self._posting_offsets[slot + 1]
+            ]
+            for slot in slots
+        ]
+        postings.sort(key=len)
+
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        return candidates
+
+    def match_values(self, text):
+        """
+        Distinct-value ids containing text (case-insensitive) and their ranks.
+        Texts shorter than MIN_SUBSTRING_QUERY only match at the start.
+        """
+        text = text.lower()
+        values = self.values
+
+        if len(text) < MIN_SUBSTRING_QUERY:
+            candidates = self._prefixed(text)
+            positions = np.zeros(len(candidates), dtype=np.int64)
+        else:
+            candidates = self._candidates(text)
+            positions = np.array(
+                [values[value_id].find(text) for value_id in candidates.tolist()],
+                dtype=np.int64,
+            )
+            found = positions >= 0
+            candidates = candidates[found].astype(np.int64)
+            positions = positions[found]
+
+        ranks = np.full(len(candidates), RANK_SUBSTRING, dtype=np.int64)
+        inner = np.flatnonzero(positions > 0)
+        word_start = np.array(
+            [
+                not values[value_id][position - 1].isalnum()
+                for value_id, position in zip(
+                    candidates[inner].tolist(), positions[inner].tolist()
+                )
+            ],
+            dtype=bool,
+        )
+        ranks[inner[word_start]] = RANK_WORD_PREFIX
+        ranks[positions == 0] = RANK_PREFIX
+        ranks[(positions == 0) & (self._lengths[candidates] == len(text))] = RANK_EXACT
+
+        return candidates, ranks
+
+    def search(self, text, limit=None):
+        """
+        Rows whose value contains text, with a score per row.
+
+        Lower scores are better matches: the rank of the match, then shorter
+        values before longer ones. With a limit, only the best values that
+        together cover at least limit rows are expanded.
+        """
+        value_ids, ranks = self.match_values(text)
+        if len(value_ids) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        # Length only breaks ties within a rank
+        scores = ranks + self._lengths[value_ids] / (self._lengths.max() + 1)
+        starts = self._row_offsets[value_ids]
+        counts = self._row_offsets[value_ids + 1] - starts
+
+        if limit is not None:
+            order = np.argsort(scores, kind="stable")
+            needed = np.searchsorted(np.cumsum(counts[order]), limit) + 1
+            order = order[:needed]
+            scores, starts, counts = scores[order], starts[order], counts[order]
+
+        # Gather every value's slice of _rows in one go
+        total = int(counts.sum())
+        shifts = starts - (np.cumsum(counts) - counts)
+        rows = self._rows[np.repeat(shifts, counts) + np.arange(total)]
+        return rows, np.repeat(scores, counts)
+
+
+def search_fields(index_for, fields, limit=10):
+    """
+    Rows matching every (column, text) field, best combined score first.
+
+    Scores are summed across the fields. index_for(column) returns the
+    column's TrigramIndex, or None when the column is not loaded, in which
+    case nothing matches.
+
+    Returns:
+        Up to limit row positions
+    """
+    rows = None
+    scores = None
+    # A single field can stop expanding rows once limit matches are found
+    field_limit = limit if len(fields) == 1 else None
+
+    for column, text in fields:
+        index = index_for(column)
+        if index is None:
+            return np.zeros(0, dtype=np.int64)
+
+        column_rows, column_scores = index.search(text, limit=field_limit)
+        if rows is None:
+            rows, scores = column_rows, column_scores
+        else:
+            rows, left, right = np.intersect1d(
+                rows, column_rows, assume_unique=True, return_indices=True
+            )
+            scores = scores[left] + column_scores[right]
+
+        if len(rows) == 0:
+            return rows
+
+    order = np.lexsort((rows, scores))[:limit]
+    return rows[order]
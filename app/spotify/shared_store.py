@@ -0,0 +1,345 @@
+"""
+Spotify catalogue data shared by every user.
+
+Artists and tracks are the same objects for every user, so instead of each
+per-user database holding its own copy they are stored once in a shared
+SQLite database (SHARED_DB_PATH, next to the per-user databases by default),
+keyed by Spotify ID with the time they were fetched. Per-user tables keep only
+the IDs they reference and the fields that belong to the user (when a track
+was saved or played, the time range of a top track). The shared database is
+attached to a user's connection as the `shared` schema so syncs can write to
+it and readers can join against it.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.spotify.user_db import add_column, batch_timestamp, get_db_info, set_db_info
+
+# Seconds a shared artist is served before the API is asked again
+DEFAULT_ARTIST_TTL = 7 * 24 * 3600
+SHARED_SCHEMA = "shared"
+# Per-schema pragmas matching the ones connect_user_db applies to main
+SHARED_DB_PRAGMAS = (("journal_mode", "WAL"), ("synchronous", "NORMAL"))
+# SQLite's default limit on host parameters in one statement is 999
+MAX_QUERY_PARAMS = 500
+# Per-user track tables, and the field each one adds to the shared track
+TRACK_TABLES = {
+    "saved_tracks": "saved_at",
+    "top_tracks": "time_range",
+    "recently_played": "played_at",
+}
+# Keys left out of shared tracks: the per-user fields, and the market lists
+# that make up most of a track's JSON and are never read
+UNSHARED_TRACK_KEYS = ("available_markets", *TRACK_TABLES.values())
+# Typed copies of the track fields the randomizer reads, kept on the per-user
+# rows so loading a track pool needs no JSON
+HOT_TRACK_COLUMNS = (
+    ("uri", "TEXT"),
+    ("artist", "TEXT"),
+    ("artist_id", "TEXT"),
+    ("album", "TEXT"),
+    ("duration_ms", "INTEGER"),
+    ("explicit", "INTEGER"),
+    ("popularity", "INTEGER"),
+    ("release_year", "INTEGER"),
+)
+HOT_TRACK_INDEXES = ("artist_id", "release_year", "popularity")
+# db_info value marking a table whose hot columns have been backfilled
+HOT_COLUMNS_VERSION = "1"
+
+
+def shared_db_path():
+    return current_app.config.get("SHARED_DB_PATH") or os.path.join(
+        current_app.config["USER_DB_PATH"], "shared.db"
+    )
+
+
+def attach_shared_db(cursor):
+    """Attach the shared database to a user connection as `shared`"""
+    cursor.execute("PRAGMA database_list")
+    if any(row[1] == SHARED_SCHEMA for row in cursor.fetchall()):
+        return
+
+    cursor.execute(f"ATTACH DATABASE ? AS {SHARED_SCHEMA}", (shared_db_path(),))
+    for name, value in SHARED_DB_PRAGMAS:
+        cursor.execute(f"PRAGMA {SHARED_SCHEMA}.{name}={value}")
+    cursor.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS {SHARED_SCHEMA}.artists (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        data TEXT,
+        fetched_at TIMESTAMP
+    )
+    """
+    )
+    cursor.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS {SHARED_SCHEMA}.tracks (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        data TEXT,
+        content_hash TEXT,
+        fetched_at TIMESTAMP
+    )
+    """
+    )
+
+
+def fresh_artist_ids(cursor, artist_ids, ttl=None):
+    """
+    The subset of artist_ids stored in the shared database and fetched less
+    than ttl seconds ago (SHARED_ARTIST_TTL by default).
+    """
+    if ttl is None:
+        ttl = current_app.config.get("SHARED_ARTIST_TTL", DEFAULT_ARTIST_TTL)
+    cutoff = (datetime.utcnow() - timedelta(seconds=ttl)).isoformat()
+
+    artist_ids = list(artist_ids)
+    fresh = set()
+    for i in range(0, len(artist_ids), MAX_QUERY_PARAMS):
+        chunk = artist_ids[i : i + MAX_QUERY_PARAMS]
+        cursor.execute(
+            f"SELECT id FROM {SHARED_SCHEMA}.artists "
+            f"WHERE fetched_at >= ? AND id IN ({', '.join('?' * len(chunk))})",
+            (cutoff, *chunk),
+        )
+        fresh.update(row[0] for row in cursor.fetchall())
+    return fresh
+
+
+def write_artist_refs(cursor, table, artist_ids, fetched_at):
+    """
+    Point a user's artists table at the shared artists: one row per ID with
+    the name for display and no private copy of the data.
+
+    Returns:
+        Number of artists referenced
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS artist_ids (id TEXT PRIMARY KEY)")
+    cursor.execute("DELETE FROM artist_ids")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO artist_ids (id) VALUES (?)",
+        [(artist_id,) for artist_id in artist_ids],
+    )
+    cursor.execute(
+        f"""
+        INSERT OR REPLACE INTO main.{table} (id, name, data, fetched_at)
+        SELECT a.id, a.name, NULL, ?
+        FROM {SHARED_SCHEMA}.artists a JOIN artist_ids USING (id)
+        """,
+        (fetched_at,),
+    )
+    count = cursor.rowcount
+    cursor.execute("DROP TABLE artist_ids")
+    return count
+
+
+def _shared_track(track):
+    shared = {k: v for k, v in track.items() if k not in UNSHARED_TRACK_KEYS}
+    if isinstance(shared.get("album"), dict):
+        shared["album"] = {
+            k: v for k, v in shared["album"].items() if k != "available_markets"
+        }
+    return shared
+
+
+def _hot_track_values(track):
+    """Values for HOT_TRACK_COLUMNS, in order"""
+    artist = (track.get("artists") or [{}])[0]
+    album = track.get("album") or {}
+    release_year = str(album.get("release_date") or "").split("-")[0]
+    return (
+        track.get("uri"),
+        artist.get("name"),
+        artist.get("id"),
+        album.get("name"),
+        track.get("duration_ms"),
+        int(bool(track["explicit"])) if "explicit" in track else None,
+        track.get("popularity"),
+        int(release_year) if release_year.isdigit() else None,
+    )
+
+
+def write_shared_tracks(cursor, tracks, fetched_at=None):
+    """
+    Upsert tracks into the shared store. A track whose content hash matches
+    the stored one is left alone, so re-syncing unchanged tracks writes
+    nothing.
+    """
+    fetched_at = fetched_at or batch_timestamp()
+    rows = []
+    for track in tracks:
+        if not track.get("id"):
+            continue
+        data = json.dumps(_shared_track(track), sort_keys=True)
+        content_hash = hashlib.sha1(data.encode()).hexdigest()
+        rows.append(
+            (track["id"], track.get("name", "Unknown"), data, content_hash, fetched_at)
+        )
+
+    cursor.executemany(
+        f"""
+        INSERT INTO {SHARED_SCHEMA}.tracks (id, name, data, content_hash, fetched_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            name = excluded.name,
+            data = excluded.data,
+            content_hash = excluded.content_hash,
+            fetched_at = excluded.fetched_at
+        WHERE content_hash IS NOT excluded.content_hash
+        """,
+        rows,
+    )
+
+
+def write_tracks(cursor, table, items, fetched_at=None, replace=True):
+    """
+    Write (row id, track) pairs: the track to the shared store and a thin row
+    (id, track_id, name, per-user field and the hot columns) to the user's
+    track table.
+
+    Tracks without a Spotify ID (local files) can't be shared and keep their
+    JSON in the user's row.
+
+    Args:
+        replace: overwrite rows with the same id; when False existing rows
+            are kept (for append-only tables)
+
+    Returns:
+        Number of rows written to the user's table
+    """
+    fetched_at = fetched_at or batch_timestamp()
+    items = list(items)
+    if not items:
+        return 0
+
+    write_shared_tracks(cursor, (track for _, track in items), fetched_at)
+
+    columns = [
+        "id",
+        "track_id",
+        "name",
+        "data",
+        "fetched_at",
+        TRACK_TABLES[table],
+        *(column for column, _ in HOT_TRACK_COLUMNS),
+    ]
+    cursor.executemany(
+        f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO main.{table} "
+        f"({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [
+            (
+                row_id,
+                track.get("id"),
+                track.get("name", "Unknown"),
+                None if track.get("id") else json.dumps(track),
+                fetched_at,
+                track.get(TRACK_TABLES[table]),
+                *_hot_track_values(track),
+            )
+            for row_id, track in items
+        ],
+    )
+    return cursor.rowcount
+
+
+def prepare_track_table(cursor, table):
+    """
+    Bring a user's track table to the thin layout: add the track_id and
+    per-user field columns, and move the JSON of rows synced before the
+    shared store existed into it.
+    """
+    attach_shared_db(cursor)
+    field = TRACK_TABLES[table]
+
+    # Rows synced before the columns existed only have the values in their JSON
+    if add_column(cursor, table, field, "TEXT"):
+        cursor.execute(
+            f"UPDATE {table} SET {field} = json_extract(data, '$.{field}') "
+            f"WHERE {field} IS NULL"
+        )
+    if add_column(cursor, table, "track_id", "TEXT"):
+        cursor.execute(f"UPDATE {table} SET track_id = json_extract(data, '$.id')")
+
+    cursor.execute(
+        f"SELECT id, data FROM {table} WHERE data IS NOT NULL AND track_id IS NOT NULL"
+    )
+    rows = cursor.fetchall()
+    if rows:
+        write_shared_tracks(cursor, (json.loads(data) for _, data in rows))
+        cursor.executemany(
+            f"UPDATE {table} SET data = NULL WHERE id = ?",
+            [(row_id,) for row_id, _ in rows],
+        )
+        current_app.logger.info(
+            f"Moved {len(rows)} {table} rows to the shared track store"
+        )
+    cursor.connection.commit()
+
+    prepare_hot_track_columns(cursor, table)
+
+
+def prepare_hot_track_columns(cursor, table):
+    """
+    Add the typed hot columns to a user's track table and fill them in for
+    rows written before they existed. The backfill runs once per table, the
+    first time the table is synced or read after the upgrade; later calls
+    only check a db_info flag.
+    """
+    marker = f"{table}_hot_columns"
+    if get_db_info(cursor, marker) == HOT_COLUMNS_VERSION:
+        return
+
+    for column, column_type in HOT_TRACK_COLUMNS:
+        add_column(cursor, table, column, column_type)
+
+    cursor.execute(
+        f"SELECT id, data FROM ({track_rows_query(cursor, table)}) "
+        "WHERE uri IS NULL AND data IS NOT NULL"
+    )
+    rows = []
+    for row_id, data in cursor.fetchall():
+        try:
+            rows.append((*_hot_track_values(json.loads(data)), row_id))
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            continue
+    assignments = ", ".join(f"{column} = ?" for column, _ in HOT_TRACK_COLUMNS)
+    cursor.executemany(f"UPDATE {table} SET {assignments} WHERE id = ?", rows)
+    if rows:
+        current_app.logger.info(f"Backfilled typed columns for {len(rows)} {table}")
+
+    for column in HOT_TRACK_INDEXES:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})"
+        )
+    set_db_info(cursor, marker, HOT_COLUMNS_VERSION)
+    cursor.connection.commit()
+
+
+def track_rows_query(cursor, table):
+    """
+    SQL selecting a user's track table with every row's full track JSON in
+    its data column, joined back together from the shared store.
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in cursor.fetchall()]
+    if "track_id" not in columns:
+        # Not synced since the shared store was introduced
+        return f"SELECT * FROM {table}"
+
+    attach_shared_db(cursor)
+    field = TRACK_TABLES[table]
+    selected = ", ".join(f"t.{column}" for column in columns if column != "data")
+    return f"""
+        SELECT {selected},
+               COALESCE(t.data, json_patch(s.data, json_object('{field}', t.{field})))
+                   AS data
+        FROM {table} t
+        LEFT JOIN {SHARED_SCHEMA}.tracks s ON s.id = t.track_id
+    """
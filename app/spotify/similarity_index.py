@@ -0,0 +1,126 @@
+"""
+Approximate nearest-neighbour search over audio features.
+
+Features are z-scored into a float32 matrix so every dimension weighs the
+same. Random-projection LSH (one sign bit per hyperplane) hashes each row
+into several tables; a query looks up its own bucket plus the buckets one
+bit away in every table and ranks only those candidates by exact Euclidean
+distance. Each table is a sorted signature array, so a bucket lookup is a
+binary search and the index stays a handful of numpy arrays.
+"""
+
+import numpy as np
+
+# Hash tables and hyperplanes per table. More tables raise recall, more
+# hyperplanes make buckets smaller.
+LSH_TABLES = 8
+LSH_BITS = 16
+LSH_SEED = 7
+# Candidates to collect before giving up on LSH and scanning everything
+MIN_CANDIDATES_FACTOR = 4
+
+
+class SimilarityIndex:
+    def __init__(self, features, rows, tables=LSH_TABLES, bits=LSH_BITS):
+        """
+        Args:
+            features: 2D array with one row per track and one column per feature
+            rows: the DataFrame row position of every features row
+        """
+        features = np.asarray(features, dtype=np.float32)
+        self.rows = np.asarray(rows, dtype=np.int64)
+
+        # Missing values become the column mean, i.e. 0 after scaling
+        self._mean = np.nanmean(features, axis=0)
+        std = np.nanstd(features, axis=0)
+        self._std = np.where(std > 0, std, 1).astype(np.float32)
+        matrix = (features - self._mean) / self._std
+        self.matrix = np.nan_to_num(matrix, nan=0.0).astype(np.float32)
+
+        rng = np.random.default_rng(LSH_SEED)
+        self._planes = rng.standard_normal((tables, self.matrix.shape[1], bits)).astype(
+            np.float32
+        )
+        self._weights = (1 << np.arange(bits, dtype=np.int64)).astype(np.int64)
+
+        signatures = self._signatures(self.matrix)
+        self._order = np.argsort(signatures, axis=1, kind="stable").astype(np.int32)
+        self._sorted = np.take_along_axis(signatures, self._order, axis=1)
+
+        # Position of every DataFrame row inside the matrix, -1 if absent
+        self._slots = np.full(
+            int(self.rows.max()) + 1 if len(self.rows) else 0, -1, dtype=np.int32
+        )
+        self._slots[self.rows] = np.arange(len(self.rows), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _signatures(self, matrix):
+        """LSH signature of every matrix row in every table: (tables, n)"""
+        signatures = np.empty((len(self._planes), len(matrix)), dtype=np.int64)
+        for table, planes in enumerate(self._planes):
+            signatures[table] = (matrix @ planes > 0) @ self._weights
+        return signatures
+
+    def _candidates(self, signatures):
+        """Matrix slots sharing a bucket, or a bucket one bit away, in any table"""
+        found = []
+        for table, signature in enumerate(signatures):
+            probes = np.concatenate(([signature], signature ^ self._weights))
+            starts = np.searchsorted(self._sorted[table], probes, side="left")
+            ends = np.searchsorted(self._sorted[table], probes, side="right")
+            found.extend(
+                self._order[table, start:end]
+                for start, end in zip(starts.tolist(), ends.tolist())
+                if end > start
+            )
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def _nearest(self, vector, candidates, k, exclude):
+        if len(candidates) < k * MIN_CANDIDATES_FACTOR:
+            # Sparse neighbourhood: an exact scan is the only way to fill k
+            candidates = np.arange(len(self.matrix))
+
+        distances = np.sqrt(
+            np.square(self.matrix[candidates] - vector).sum(axis=1, dtype=np.float32)
+        )
+        if exclude is not None:
+            distances[candidates == exclude] = np.inf
+
+        k = min(k, len(candidates))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best], kind="stable")]
+        best = best[np.isfinite(distances[best])]
+        return self.rows[candidates[best]], distances[best]
+
+    def query_rows(self, rows, k=10):
+        """
+        Nearest neighbours of tracks already in the index.
+
+        Args:
+            rows: DataFrame row positions of the seed tracks
+            k: neighbours per seed, the seed itself excluded
+
+        Returns:
+            One (rows, distances) pair per seed, or None for unknown seeds
+        """
+        slots = [
+            int(self._slots[row]) if 0 <= row < len(self._slots) else -1 for row in rows
+        ]
+        slots = [slot if slot >= 0 else None for slot in slots]
+        known = [slot for slot in slots if slot is not None]
+        if not known or k <= 0:
+            return [None for _ in slots]
+
+        # Hash every seed at once, then probe per seed
+        signatures = self._signatures(self.matrix[known])
+        results = iter(
+            self._nearest(
+                self.matrix[slot], self._candidates(signatures[:, i]), k, slot
+            )
+            for i, slot in enumerate(known)
+        )
+        return [next(results) if slot is not None else None for slot in slots]
@@ -0,0 +1,896 @@
+"""
+Synchronisation of a user's Spotify data into their SQLite database.
+
+This is the body of the sync route, free of any request context so it can
+run either inside a request or in a `flask sync-worker` process. Progress is
+reported by updating a dict with the keys check_progress serves (percent,
+completed, total, status, complete).
+"""
+
+import json
+import sqlite3
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.models import SpotifyDataType, UserDataSync
+from app.spotify.pagination import fetch_pages, ordered_map
+from app.spotify.shared_store import (
+    SHARED_SCHEMA,
+    attach_shared_db,
+    fresh_artist_ids,
+    prepare_track_table,
+    track_rows_query,
+    write_artist_refs,
+    write_tracks,
+)
+from app.spotify.user_db import (
+    batch_timestamp,
+    connect_user_db,
+    get_db_info,
+    set_db_info,
+    write_items,
+    write_track_data,
+)
+
+# Page size for the paginated endpoints
+BATCH_SIZE = 50
+# Upper bound on items fetched from a single endpoint
+MAX_ITEMS = 66_666
+
+
+class SyncError(Exception):
+    """A sync that could not run or failed; the message is shown to the user"""
+
+
+def _create_items_table(cursor, data_type):
+    cursor.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS {data_type} (
+        id TEXT PRIMARY KEY,
+        name TEXT,
+        data TEXT,
+        fetched_at TIMESTAMP
+    )
+    """
+    )
+
+
+def _update_sync_status(user, data_type_obj, record_count):
+    sync = UserDataSync.query.filter_by(
+        user_id=user.id, data_type_id=data_type_obj.id
+    ).first()
+
+    if not sync:
+        sync = UserDataSync(user_id=user.id, data_type_id=data_type_obj.id)
+        db.session.add(sync)
+
+    sync.last_sync = datetime.utcnow()
+    sync.record_count = record_count
+    db.session.commit()
+
+
+def _sync_top_items(sp, cursor, data_type, progress):
+    """top_tracks / top_artists: up to 50 items for each of the 3 time ranges"""
+    kind = "tracks" if data_type == "top_tracks" else "artists"
+    fetch = (
+        sp.current_user_top_tracks
+        if data_type == "top_tracks"
+        else sp.current_user_top_artists
+    )
+    _create_items_table(cursor, data_type)
+    if data_type == "top_tracks":
+        prepare_track_table(cursor, data_type)
+
+    progress["total"] = 3 * BATCH_SIZE
+    progress["status"] = f"Syncing top {kind}"
+    items_processed = 0
+
+    # The three time ranges are independent requests: fetch them together
+    time_ranges = ["short_term", "medium_term", "long_term"]
+    pages = ordered_map(
+        lambda time_range: fetch(limit=BATCH_SIZE, time_range=time_range),
+        time_ranges,
+    )
+
+    for time_range, results in zip(time_ranges, pages):
+        progress["status"] = f"Syncing {time_range} top {kind}"
+
+        # Add time range to each item for reference
+        for item in results["items"]:
+            item["time_range"] = time_range
+        items = [(item["id"], item) for item in results["items"]]
+        if data_type == "top_tracks":
+            items_processed += write_tracks(cursor, data_type, items)
+        else:
+            items_processed += write_items(cursor, data_type, items)
+
+        # Commit after each batch
+        cursor.connection.commit()
+
+        progress.update(
+            {
+                "percent": min(int((items_processed / progress["total"]) * 100), 100),
+                "completed": items_processed,
+                "status": f"Processing {time_range} {kind} ({items_processed}/{progress['total']})",
+            }
+        )
+
+    return items_processed, None
+
+
+def _prepare_saved_tracks_table(cursor, data_type):
+    _create_items_table(cursor, data_type)
+    prepare_track_table(cursor, data_type)
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{data_type}_saved_at ON {data_type} (saved_at)"
+    )
+    cursor.connection.commit()
+
+
+def _saved_track_items(results):
+    tracks = []
+    for saved_item in results["items"]:
+        track = saved_item["track"]
+        # Add the saved_at date from the parent item to the track
+        track["saved_at"] = saved_item["added_at"]
+        tracks.append((track["id"], track))
+    return tracks
+
+
+def _sync_new_saved_tracks(sp, cursor, data_type, progress, known):
+    """
+    Write the tracks saved since the last sync. The API lists saved tracks
+    newest first, so paging stops at the first (id, saved_at) pair that is
+    already stored.
+
+    Returns:
+        (tracks written, total saved tracks reported by the API)
+    """
+    progress["status"] = "Checking for newly saved tracks"
+    written = 0
+    offset = 0
+
+    while offset < MAX_ITEMS:
+        results = sp.current_user_saved_tracks(limit=BATCH_SIZE, offset=offset)
+        total = results["total"]
+
+        tracks = []
+        reached_known = False
+        for track_id, track in _saved_track_items(results):
+            if known.get(track_id) == track["saved_at"]:
+                reached_known = True
+                break
+            tracks.append((track_id, track))
+
+        written += write_tracks(cursor, data_type, tracks)
+        cursor.connection.commit()
+
+        expected = max(total - len(known), written, 1)
+        progress.update(
+            {
+                "total": expected,
+                "percent": min(int((written / expected) * 100), 100),
+                "completed": written,
+                "status": f"Found {written} newly saved tracks",
+            }
+        )
+
+        if reached_known or not results["next"]:
+            break
+        offset += BATCH_SIZE
+
+    return written, total
+
+
+def _sync_all_saved_tracks(sp, cursor, data_type, progress):
+    """Write every saved track and drop stored tracks that are no longer saved"""
+    pages = fetch_pages(
+        lambda limit, offset: sp.current_user_saved_tracks(limit=limit, offset=offset),
+        max_items=MAX_ITEMS,
+    )
+    results = next(pages)
+
+    total_tracks = min(results["total"], MAX_ITEMS)
+    progress["total"] = total_tracks
+    progress["status"] = f"Syncing saved tracks ({total_tracks} total)"
+
+    items_processed = 0
+    seen_ids = []
+    complete = False
+
+    while results and items_processed < MAX_ITEMS:
+        tracks = _saved_track_items(results)
+        seen_ids.extend(track_id for track_id, _ in tracks)
+        items_processed += write_tracks(cursor, data_type, tracks)
+
+        # Commit after each batch
+        cursor.connection.commit()
+
+        progress.update(
+            {
+                "percent": min(int((items_processed / total_tracks) * 100), 100),
+                "completed": items_processed,
+                "status": f"Processing track {items_processed} of {total_tracks}",
+            }
+        )
+
+        if results["next"] and items_processed < MAX_ITEMS:
+            progress["status"] = (
+                f"Fetching next batch of tracks ({items_processed}/{total_tracks})"
+            )
+            results = next(pages, None)
+        else:
+            complete = not results["next"]
+            break
+
+    if complete:
+        # Everything saved was listed: anything else was removed from the library
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS seen_ids (id TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM seen_ids")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO seen_ids (id) VALUES (?)",
+            [(track_id,) for track_id in seen_ids],
+        )
+        cursor.execute(
+            f"DELETE FROM {data_type} WHERE id NOT IN (SELECT id FROM seen_ids)"
+        )
+        if cursor.rowcount:
+            current_app.logger.info(
+                f"Removed {cursor.rowcount} tracks no longer in the saved library"
+            )
+        cursor.execute("DROP TABLE seen_ids")
+        cursor.connection.commit()
+
+    return items_processed
+
+
+def _sync_saved_tracks(sp, cursor, data_type, progress):
+    _prepare_saved_tracks_table(cursor, data_type)
+
+    cursor.execute(f"SELECT id, saved_at FROM {data_type}")
+    known = dict(cursor.fetchall())
+
+    if known:
+        written, total = _sync_new_saved_tracks(sp, cursor, data_type, progress, known)
+
+        # New tracks are all caught; removals only show up as a count that no
+        # longer matches, which needs a full pass to find
+        cursor.execute(f"SELECT COUNT(*) FROM {data_type}")
+        stored = cursor.fetchone()[0]
+        if stored == total or total > MAX_ITEMS:
+            progress.update(
+                {
+                    "percent": 100,
+                    "completed": written,
+                    "total": written,
+                    "status": f"Sync complete - {written} new saved tracks",
+                    "complete": True,
+                }
+            )
+            return (
+                stored,
+                f"Synced {written} new saved tracks ({stored} saved tracks in total)",
+            )
+
+        current_app.logger.info(
+            f"{stored} saved tracks stored but the library has {total}: "
+            "running a full sync"
+        )
+
+    return _sync_all_saved_tracks(sp, cursor, data_type, progress), None
+
+
+def _sync_playlists(sp, cursor, data_type, progress):
+    _create_items_table(cursor, data_type)
+
+    pages = fetch_pages(
+        lambda limit, offset: sp.current_user_playlists(limit=limit, offset=offset),
+        max_items=MAX_ITEMS,
+    )
+    results = next(pages)
+
+    total_playlists = min(results["total"], MAX_ITEMS)
+    progress["total"] = total_playlists
+    progress["status"] = f"Syncing playlists ({total_playlists} total)"
+
+    items_processed = 0
+
+    while results and items_processed < MAX_ITEMS:
+        items_processed += write_items(
+            cursor, data_type, [(item["id"], item) for item in results["items"]]
+        )
+
+        # Commit after each batch
+        cursor.connection.commit()
+
+        progress.update(
+            {
+                "percent": min(int((items_processed / total_playlists) * 100), 100),
+                "completed": items_processed,
+                "status": f"Processing playlist {items_processed} of {total_playlists}",
+            }
+        )
+
+        if results["next"] and items_processed < MAX_ITEMS:
+            progress["status"] = (
+                f"Fetching next batch of playlists ({items_processed}/{total_playlists})"
+            )
+            results = next(pages, None)
+        else:
+            break
+
+    return items_processed, None
+
+
+# db_info key holding the recently played high-water mark (Unix ms)
+RECENTLY_PLAYED_CURSOR_KEY = "recently_played_after"
+
+
+def _prepare_recently_played_table(cursor, data_type):
+    _create_items_table(cursor, data_type)
+    prepare_track_table(cursor, data_type)
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS idx_{data_type}_played_at ON {data_type} (played_at)"
+    )
+    cursor.connection.commit()
+
+
+def _played_at_ms(played_at):
+    return int(datetime.fromisoformat(played_at).timestamp() * 1000)
+
+
+def _play_items(results):
+    plays = []
+    for item in results["items"]:
+        track = item["track"]
+        # Add the played_at time to the track data
+        track["played_at"] = item["played_at"]
+
+        # Composite ID since the same track can be played multiple times
+        # Format: track_id-timestamp
+        timestamp = item["played_at"].replace(":", "").replace(".", "").replace("Z", "")
+        plays.append((f"{track['id']}-{timestamp}", track))
+    return plays
+
+
+def _sync_recently_played(sp, cursor, data_type, progress):
+    """
+    Append plays to the recently played history. After the first sync only
+    plays newer than the stored high-water mark are requested, using the
+    API's `after` cursor, so the history keeps growing past the 50 plays the
+    API remembers without rewriting rows.
+    """
+    _prepare_recently_played_table(cursor, data_type)
+
+    after = get_db_info(cursor, RECENTLY_PLAYED_CURSOR_KEY)
+    if after is None:
+        # First sync, or one from before the cursor was stored
+        cursor.execute(f"SELECT MAX(played_at) FROM {data_type}")
+        latest = cursor.fetchone()[0]
+        after = _played_at_ms(latest) if latest else None
+    else:
+        after = int(after)
+
+    progress["total"] = BATCH_SIZE
+    progress["status"] = "Syncing recently played tracks"
+
+    items_processed = 0
+    new_plays = 0
+    while items_processed < MAX_ITEMS:
+        if after is None:
+            results = sp.current_user_recently_played(limit=BATCH_SIZE)
+        else:
+            results = sp.current_user_recently_played(limit=BATCH_SIZE, after=after)
+
+        plays = _play_items(results)
+        items_processed += len(plays)
+        new_plays += write_tracks(cursor, data_type, plays, replace=False)
+
+        newest = max((track["played_at"] for _, track in plays), default=None)
+        if newest is not None:
+            after = max(after or 0, _played_at_ms(newest))
+            set_db_info(cursor, RECENTLY_PLAYED_CURSOR_KEY, after)
+
+        # Commit after each batch
+        cursor.connection.commit()
+
+        # Adjust the estimate if we get more than expected
+        if items_processed >= progress["total"]:
+            progress["total"] = items_processed + BATCH_SIZE
+
+        progress.update(
+            {
+                "percent": min(int((items_processed / progress["total"]) * 100), 100),
+                "completed": items_processed,
+                "status": f"Processing track {items_processed} ({new_plays} new)",
+            }
+        )
+
+        # A full page means more plays may be waiting after the new cursor
+        if len(plays) < BATCH_SIZE or newest is None:
+            break
+
+    cursor.execute(f"SELECT COUNT(*) FROM {data_type}")
+    history = cursor.fetchone()[0]
+
+    progress.update(
+        {
+            "percent": 100,
+            "completed": items_processed,
+            "total": items_processed,
+            "status": f"Sync complete - {new_plays} new plays",
+            "complete": True,
+        }
+    )
+    return (
+        history,
+        f"Synced {new_plays} new recently played tracks ({history} plays in your history)",
+    )
+
+
+def _sync_audio_features_from_csv(user, cursor, data_type, progress):
+    from app.spotify.csv_data_manager import get_track_features_manager
+
+    cursor.execute(
+        f"""
+    CREATE TABLE IF NOT EXISTS {data_type} (
+        id TEXT PRIMARY KEY,
+        track_id TEXT,
+        data TEXT,
+        fetched_at TIMESTAMP,
+        data_source TEXT
+    )
+    """
+    )
+
+    # Check if data_source column exists, if not add it
+    try:
+        cursor.execute(f"SELECT data_source FROM {data_type} LIMIT 1")
+    except sqlite3.OperationalError:
+        current_app.logger.info(f"Adding data_source column to {data_type} table")
+        cursor.execute(f"ALTER TABLE {data_type} ADD COLUMN data_source TEXT")
+        cursor.connection.commit()
+
+    progress.update(
+        {
+            "percent": 5,
+            "status": "Loading audio features database... This may take a few seconds",
+        }
+    )
+
+    # First, get saved tracks from the user's database
+    cursor.execute("SELECT id, name, data FROM saved_tracks")
+    saved_tracks = cursor.fetchall()
+
+    if not saved_tracks:
+        raise SyncError("No saved tracks found. Please sync your saved tracks first.")
+
+    progress.update(
+        {
+            "percent": 10,
+            "status": "Loading audio features database... This may take several seconds",
+        }
+    )
+
+    # Get existing audio feature track IDs to avoid resyncing
+    cursor.execute(f"SELECT track_id FROM {data_type}")
+    existing_track_ids = {row[0] for row in cursor.fetchall()}
+
+    progress.update(
+        {"percent": 15, "status": "Initializing audio features database..."}
+    )
+
+    # Load the track features, or join a load that is already running (e.g.
+    # the warm-up started at boot), reporting its progress
+    track_manager = get_track_features_manager(wait=False)
+    track_manager.start_background_load()
+    while not track_manager.wait_until_ready(timeout=0.5):
+        load_progress = track_manager.get_load_progress()
+        if load_progress["complete"]:
+            break
+        progress.update(
+            {
+                "percent": 15 + load_progress["percent"] * 15 // 100,
+                "status": load_progress["status"],
+            }
+        )
+
+    if not track_manager.is_ready():
+        raise RuntimeError(track_manager.get_load_progress()["status"])
+
+    progress.update(
+        {
+            "percent": 30,
+            "status": "Audio features database loaded, processing tracks...",
+        }
+    )
+
+    batch_size = 100
+    track_names = {track[0]: track[1] for track in saved_tracks}
+    track_ids_to_process = [
+        track[0] for track in saved_tracks if track[0] not in existing_track_ids
+    ]
+
+    if not track_ids_to_process:
+        cursor.execute(f"SELECT COUNT(*) FROM {data_type}")
+        total_features_count = cursor.fetchone()[0]
+
+        progress.update(
+            {
+                "percent": 100,
+                "completed": 0,
+                "total": 0,
+                "status": f"All tracks already have audio features ({total_features_count} total features)",
+                "complete": True,
+            }
+        )
+        return (
+            total_features_count,
+            f"All saved tracks already have audio features data. Database contains {total_features_count} audio features.",
+        )
+
+    progress["total"] = len(track_ids_to_process)
+    progress["status"] = (
+        f"Fetching audio features for {len(track_ids_to_process)} tracks from CSV"
+    )
+
+    current_app.logger.info(
+        f"Fetching audio features for {len(track_ids_to_process)} tracks from CSV"
+    )
+    total_batches = (len(track_ids_to_process) + batch_size - 1) // batch_size
+
+    tracks_processed = 0
+    for i in range(0, len(track_ids_to_process), batch_size):
+        batch = track_ids_to_process[i : i + batch_size]
+        current_batch = i // batch_size + 1
+
+        progress["status"] = (
+            f"Processing batch {current_batch}/{total_batches} from CSV"
+        )
+
+        features_batch = track_manager.get_features_batch(batch)
+        batch_record_count = write_track_data(
+            cursor,
+            data_type,
+            [(feature["id"], feature) for feature in features_batch if feature],
+            data_source="csv",
+        )
+
+        tracks_processed += len(batch)
+
+        progress.update(
+            {
+                "percent": min(
+                    int((tracks_processed / len(track_ids_to_process)) * 100), 100
+                ),
+                "completed": tracks_processed,
+                "status": f"Processed batch {current_batch}/{total_batches}: Found {batch_record_count} features",
+            }
+        )
+        current_app.logger.info(
+            f"Processed batch {current_batch}/{total_batches}: Found {batch_record_count} features"
+        )
+
+        # Commit after each batch
+        cursor.connection.commit()
+
+        # For tracks that weren't found in the CSV, log them
+        found_ids = {f.get("id") for f in features_batch}
+        missing_tracks = [tid for tid in batch if tid not in found_ids]
+
+        if missing_tracks:
+            missing_track_names = [track_names.get(tid, tid) for tid in missing_tracks]
+            current_app.logger.warning(
+                f"Couldn't find audio features for {len(missing_tracks)} tracks in CSV: {', '.join(missing_track_names[:5])}"
+                + (
+                    f" and {len(missing_track_names) - 5} more"
+                    if len(missing_track_names) > 5
+                    else ""
+                )
+            )
+
+    # Report the total count of audio features, not just new records
+    cursor.execute(f"SELECT COUNT(*) FROM {data_type}")
+    total_features_count = cursor.fetchone()[0]
+
+    progress.update(
+        {
+            "percent": 100,
+            "completed": len(track_ids_to_process),
+            "total": len(track_ids_to_process),
+            "status": f"Sync complete - {total_features_count} total audio features in database",
+            "complete": True,
+        }
+    )
+    return (
+        total_features_count,
+        f"Successfully synced audio features. Database contains {total_features_count} audio features.",
+    )
+
+
+def _sync_audio_data_from_api(user, sp, cursor, data_type, progress):
+    """audio_features / audio_analysis fetched from the Spotify API"""
+    from app.spotify.utils import (
+        check_saved_tracks_dependency,
+        setup_audio_data_table,
+        get_tracks_to_process,
+        process_audio_data_batch,
+    )
+
+    success, message = check_saved_tracks_dependency(user)
+    if not success:
+        raise SyncError(message)
+
+    setup_audio_data_table(cursor, data_type)
+
+    if data_type == "audio_analysis":
+        # Audio analysis is heavy: limit the tracks and fetch them one by one
+        max_tracks, batch_size, single_track = 500, 10, True
+    else:
+        max_tracks, batch_size, single_track = None, 20, False
+
+    tracks_to_process, message, total_tracks = get_tracks_to_process(
+        cursor, data_type, max_tracks=max_tracks
+    )
+    if not tracks_to_process:
+        raise SyncError(message)
+
+    kind = data_type.replace("_", " ")
+    progress["total"] = len(tracks_to_process)
+    progress["status"] = f"Processing {kind} for {len(tracks_to_process)} tracks"
+
+    total_batches = (len(tracks_to_process) + batch_size - 1) // batch_size
+    current_app.logger.info(
+        f"Processing {kind} for {len(tracks_to_process)} new tracks "
+        f"out of {total_tracks} total tracks in {total_batches} batches"
+    )
+
+    record_count = 0
+    tracks_processed = 0
+    warning = None
+    for i in range(0, len(tracks_to_process), batch_size):
+        batch = tracks_to_process[i : i + batch_size]
+        current_batch = i // batch_size + 1
+
+        progress["status"] = f"Processing batch {current_batch} of {total_batches}"
+
+        batch_count = process_audio_data_batch(
+            sp,
+            cursor,
+            data_type,
+            batch,
+            (current_batch, total_batches),
+            single_track=single_track,
+        )
+
+        # If batch processing returned -1, stop processing entirely
+        if batch_count == -1:
+            progress["status"] = f"Error in batch {current_batch}"
+            warning = (
+                f"Stopped processing {data_type} after errors in batch {current_batch}."
+            )
+            break
+
+        tracks_processed += len(batch)
+        record_count += batch_count
+
+        progress.update(
+            {
+                "percent": min(
+                    int((tracks_processed / len(tracks_to_process)) * 100), 100
+                ),
+                "completed": tracks_processed,
+            }
+        )
+
+    message = f"Successfully synced {record_count} {data_type} items"
+    return record_count, f"{warning} {message}" if warning else message
+
+
+def _sync_artists(user, sp, cursor, data_type, progress):
+    _create_items_table(cursor, data_type)
+
+    # We need at least one of these data sources to collect artists from
+    dependencies_met = False
+    for source in ["saved_tracks", "top_tracks", "playlists"]:
+        source_type = SpotifyDataType.query.filter_by(name=source).first()
+        if not source_type:
+            continue
+
+        sync = UserDataSync.query.filter_by(
+            user_id=user.id, data_type_id=source_type.id
+        ).first()
+
+        if sync and sync.last_sync:
+            dependencies_met = True
+            break
+
+    if not dependencies_met:
+        raise SyncError(
+            "Please sync at least one of: saved tracks, top tracks, or playlists first."
+        )
+
+    artist_ids = set()
+    progress["status"] = "Collecting artist IDs from your saved data"
+
+    for source in ["saved_tracks", "top_tracks"]:
+        try:
+            cursor.execute(
+                f"SELECT data FROM ({track_rows_query(cursor, source)}) "
+                "WHERE data IS NOT NULL"
+            )
+            for row in cursor.fetchall():
+                track_data = json.loads(row[0])
+                for artist in track_data.get("artists", []):
+                    artist_ids.add(artist["id"])
+        except (sqlite3.OperationalError, KeyError, json.JSONDecodeError) as e:
+            current_app.logger.info(
+                f"Could not extract artists from {source}: {str(e)}"
+            )
+
+    total_artists = len(artist_ids)
+    if total_artists == 0:
+        raise SyncError("No artists found in your saved tracks or top tracks.")
+
+    # Only artists missing from the shared store, or stale there, are fetched
+    attach_shared_db(cursor)
+    cached_ids = fresh_artist_ids(cursor, artist_ids)
+    artist_id_list = [a for a in artist_ids if a not in cached_ids]
+    items_processed = len(cached_ids)
+
+    progress["total"] = total_artists
+    progress["completed"] = items_processed
+    progress["status"] = (
+        f"Syncing data for {len(artist_id_list)} artists "
+        f"({len(cached_ids)} already up to date)"
+    )
+
+    # Process artists in batches of 50 (Spotify API limit for artists endpoint)
+    batch_size = 50
+
+    def fetch_artists(batch):
+        try:
+            # Format the IDs parameter exactly as required by the API
+            return sp._get("artists", ids=",".join(batch)), None
+        except Exception as e:
+            return None, e
+
+    batches = [
+        artist_id_list[i : i + batch_size]
+        for i in range(0, len(artist_id_list), batch_size)
+    ]
+    responses = ordered_map(fetch_artists, batches)
+
+    for batch, (artists_response, error) in zip(batches, responses):
+        if error is not None:
+            current_app.logger.error(f"Error processing artists batch: {str(error)}")
+            continue
+
+        artists = [a for a in artists_response.get("artists", []) if a]
+        write_items(
+            cursor,
+            f"{SHARED_SCHEMA}.artists",
+            [(artist["id"], artist) for artist in artists],
+        )
+        items_processed += len(batch)
+
+        # Commit after each batch
+        cursor.connection.commit()
+
+        progress.update(
+            {
+                "percent": min(int((items_processed / total_artists) * 100), 100),
+                "completed": items_processed,
+                "status": f"Processing artist {items_processed} of {total_artists}",
+            }
+        )
+
+    # The user's table only references the shared artists
+    record_count = write_artist_refs(cursor, data_type, artist_ids, batch_timestamp())
+    cursor.connection.commit()
+
+    return record_count, None
+
+
+def sync_user_data(user, data_type, progress, sp=None):
+    """
+    Fetch one type of Spotify data for a user into their SQLite database.
+
+    Needs an application context but no request, so it runs the same from
+    the sync route and from the sync worker.
+
+    Args:
+        user: User to sync
+        data_type: name of the SpotifyDataType to sync
+        progress: dict updated in place with percent, completed, total,
+            status and complete as the sync goes
+        sp: authenticated Spotify client (created from the user's tokens
+            when omitted)
+
+    Returns:
+        A message summarising the sync
+
+    Raises:
+        SyncError: the sync could not run or failed; progress is marked
+            complete with the error as its status
+    """
+    try:
+        data_type_obj = SpotifyDataType.query.filter_by(name=data_type).first()
+        if not data_type_obj:
+            raise SyncError(f"Unknown data type: {data_type}")
+
+        if sp is None:
+            from app.spotify.utils import get_spotify_client
+
+            sp = get_spotify_client(user)
+        if not sp:
+            raise SyncError("Spotify connection required. Please connect your account.")
+
+        current_app.logger.info(f"Using database at {user.db_path} for user {user.id}")
+
+        conn = connect_user_db(user.db_path)
+        try:
+            cursor = conn.cursor()
+
+            if data_type in ("top_tracks", "top_artists"):
+                record_count, message = _sync_top_items(sp, cursor, data_type, progress)
+            elif data_type == "saved_tracks":
+                record_count, message = _sync_saved_tracks(
+                    sp, cursor, data_type, progress
+                )
+            elif data_type == "playlists":
+                record_count, message = _sync_playlists(sp, cursor, data_type, progress)
+            elif data_type == "recently_played":
+                record_count, message = _sync_recently_played(
+                    sp, cursor, data_type, progress
+                )
+            elif data_type == "audio_features" and current_app.config.get(
+                "USE_CSV_FOR_AUDIO_FEATURES", True
+            ):
+                record_count, message = _sync_audio_features_from_csv(
+                    user, cursor, data_type, progress
+                )
+            elif data_type in ("audio_features", "audio_analysis"):
+                record_count, message = _sync_audio_data_from_api(
+                    user, sp, cursor, data_type, progress
+                )
+            elif data_type == "artists":
+                record_count, message = _sync_artists(
+                    user, sp, cursor, data_type, progress
+                )
+            else:
+                raise SyncError(f"Unknown data type: {data_type}")
+        finally:
+            conn.close()
+
+        # Update sync status in the main database
+        _update_sync_status(user, data_type_obj, record_count)
+
+        if not progress.get("complete"):
+            progress.update(
+                {
+                    "percent": 100,
+                    "completed": progress.get("total", record_count),
+                    "status": "Sync complete",
+                    "complete": True,
+                }
+            )
+
+        return message or f"Successfully synced {record_count} {data_type} items"
+
+    except SyncError as e:
+        progress.update({"status": str(e), "complete": True})
+        raise
+
+    except Exception as e:
+        db.session.rollback()
+        progress.update({"status": f"Error: {str(e)}", "complete": True})
+
+        current_app.logger.error(f"Error syncing {data_type}: {str(e)}")
+        if data_type == "audio_features" and "no such table: saved_tracks" in str(e):
+            error_message = "You must sync your Saved Tracks first."
+        else:
+            error_message = str(e)
+        raise SyncError(f"Error syncing data: {error_message}") from e
@@ -0,0 +1,158 @@
+"""
+spotipy token cache kept in the app database.
+
+Replaces the per-user and per-login cache files spotipy would otherwise write
+to app/spotify_caches. Reads go through a per-process dict whose entries
+live for MEMORY_TTL seconds, far below a token's hour-long lifetime, so
+repeated reads are memory hits while a token refreshed by another worker is
+seen within seconds. Misses are not kept. Entries for logins that never
+finished (temp_<id>) are swept once they are older than
+SPOTIFY_TEMP_TOKEN_TTL. The table is created by the app's migrations.
+"""
+
+import json
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, session
+from spotipy.cache_handler import CacheHandler
+
+from app import db
+from app.models import SpotifyTokenCache
+
+# Seconds a temp entry from an unfinished login is kept
+DEFAULT_TEMP_TOKEN_TTL = 3600
+# How often creating a temp handler sweeps expired temp entries
+SWEEP_INTERVAL = 300
+TEMP_KEY_PREFIX = "temp_"
+# Seconds a token read from the database is served from memory
+MEMORY_TTL = 30
+
+_tokens = {}  # cache_key -> (token_info, monotonic time it was stored)
+_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def _remember(cache_key, token_info):
+    with _lock:
+        _tokens[cache_key] = (token_info, time.monotonic())
+
+
+def _forget(cache_keys):
+    with _lock:
+        for cache_key in cache_keys:
+            _tokens.pop(cache_key, None)
+
+
+class DatabaseCacheHandler(CacheHandler):
+    """CacheHandler storing token_info under cache_key in SpotifyTokenCache"""
+
+    def __init__(self, cache_key):
+        self.cache_key = cache_key
+
+    def get_cached_token(self):
+        with _lock:
+            entry = _tokens.get(self.cache_key)
+        if entry and time.monotonic() - entry[1] < MEMORY_TTL:
+            return entry[0]
+
+        table = SpotifyTokenCache.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                table.select().where(table.c.cache_key == self.cache_key)
+            ).first()
+
+        token_info = None
+        if row and row.token_info:
+            try:
+                token_info = json.loads(row.token_info)
+            except json.JSONDecodeError:
+                current_app.logger.warning(
+                    f"Discarding unreadable Spotify token cache {self.cache_key}"
+                )
+
+        # A miss is not remembered, so a token saved elsewhere is found next time
+        if token_info is None:
+            _forget([self.cache_key])
+        else:
+            _remember(self.cache_key, token_info)
+        return token_info
+
+    def save_token_to_cache(self, token_info):
+        table = SpotifyTokenCache.__table__
+        values = dict(token_info=json.dumps(token_info), updated_at=datetime.utcnow())
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                table.update()
+                .where(table.c.cache_key == self.cache_key)
+                .values(**values)
+            ).rowcount
+            if not updated:
+                conn.execute(table.insert().values(cache_key=self.cache_key, **values))
+        _remember(self.cache_key, token_info)
+
+
+def delete_cached_token(cache_key):
+    """Drop a cache entry, e.g. the temp entry of a login that completed"""
+    table = SpotifyTokenCache.__table__
+    with db.engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.cache_key == cache_key))
+    _forget([cache_key])
+
+
+def sweep_temp_tokens(max_age=None):
+    """
+    Delete temp entries older than max_age seconds (SPOTIFY_TEMP_TOKEN_TTL by
+    default).
+
+    Returns:
+        Number of entries deleted
+    """
+    global _last_sweep
+    _last_sweep = time.monotonic()
+    if max_age is None:
+        max_age = current_app.config.get(
+            "SPOTIFY_TEMP_TOKEN_TTL", DEFAULT_TEMP_TOKEN_TTL
+        )
+
+    table = SpotifyTokenCache.__table__
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    with db.engine.begin() as conn:
+        expired = [
+            row.cache_key
+            for row in conn.execute(
+                table.select().where(
+                    table.c.cache_key.like(f"{TEMP_KEY_PREFIX}%"),
+                    table.c.updated_at < cutoff,
+                )
+            )
+        ]
+        if expired:
+            conn.execute(table.delete().where(table.c.cache_key.in_(expired)))
+    _forget(expired)
+    return len(expired)
+
+
+def get_cache_handler(user_id=None):
+    """
+    The cache handler for a user, or for the login in progress in this
+    browser session when there is no user yet.
+    """
+    if user_id:
+        return DatabaseCacheHandler(f"user_{user_id}")
+
+    cache_id = session.get("spotify_cache_id")
+    if not cache_id:
+        cache_id = secrets.token_urlsafe(8)
+        session["spotify_cache_id"] = cache_id
+
+    if time.monotonic() - _last_sweep > SWEEP_INTERVAL:
+        try:
+            sweep_temp_tokens()
+        except Exception as e:
+            # A failed sweep is retried later and must not block the login
+            current_app.logger.warning(f"Spotify token cache sweep failed: {str(e)}")
+
+    return DatabaseCacheHandler(f"{TEMP_KEY_PREFIX}{cache_id}")
@@ -0,0 +1,91 @@
+"""
+Spotify access token refresh.
+
+A user's token is refreshed on first use once it is within
+SPOTIFY_TOKEN_REFRESH_MARGIN seconds of token_expires_at, so it never
+expires in the middle of a request or sync and a still-valid token is never
+refreshed. Refreshes are single-flight per user: concurrent requests for the
+same user wait for the one refresh in progress and reuse its result instead
+of each making their own OAuth round trip.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+
+from app import db
+from app.models import User
+
+# Seconds before token_expires_at at which a token is refreshed
+DEFAULT_REFRESH_MARGIN = 300
+
+_refresh_locks = {}
+_refresh_locks_lock = threading.Lock()
+
+
+def _refresh_margin():
+    if has_app_context():
+        return current_app.config.get(
+            "SPOTIFY_TOKEN_REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN
+        )
+    return DEFAULT_REFRESH_MARGIN
+
+
+def _refresh_lock(user_id):
+    with _refresh_locks_lock:
+        return _refresh_locks.setdefault(user_id, threading.Lock())
+
+
+def token_needs_refresh(access_token, expires_at):
+    """True if the token is missing or expires within the refresh margin"""
+    if not access_token or not expires_at:
+        return True
+    margin = timedelta(seconds=_refresh_margin())
+    return datetime.utcnow() + margin >= expires_at
+
+
+def get_access_token(user):
+    """
+    The user's access token, refreshed first if it is about to expire.
+
+    Returns:
+        The access token, or None if it needs refreshing and the user has no
+        refresh token
+
+    Raises:
+        spotipy.oauth2.SpotifyOauthError if the refresh is rejected
+    """
+    if not token_needs_refresh(user.spotify_token, user.token_expires_at):
+        return user.spotify_token
+
+    with _refresh_lock(user.id):
+        # Another request (or process) may have refreshed while we waited
+        access_token, refresh_token, expires_at = (
+            db.session.query(
+                User.spotify_token, User.spotify_refresh_token, User.token_expires_at
+            )
+            .filter_by(id=user.id)
+            .one()
+        )
+        if not token_needs_refresh(access_token, expires_at):
+            user.spotify_token = access_token
+            user.spotify_refresh_token = refresh_token
+            user.token_expires_at = expires_at
+            return access_token
+
+        refresh_token = refresh_token or user.spotify_refresh_token
+        if not refresh_token:
+            return None
+
+        from app.spotify.routes import get_spotify_oauth
+
+        token_info = get_spotify_oauth(user.id).refresh_access_token(refresh_token)
+        user.set_spotify_tokens(
+            token_info["access_token"],
+            token_info.get("refresh_token", refresh_token),
+            token_info["expires_in"],
+        )
+        db.session.commit()
+        current_app.logger.info(f"Refreshed Spotify token for user {user.id}")
+        return token_info["access_token"]
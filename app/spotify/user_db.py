@@ -0,0 +1,139 @@
+"""
+Connections and bulk writes for the per-user SQLite databases.
+
+Syncs write thousands of rows at a time, so connections are opened in WAL
+mode with synchronous=NORMAL (a commit no longer waits for an fsync of the
+whole database, and readers such as the visualize page aren't blocked while a
+sync writes), a larger page cache and memory-mapped reads. Rows are written
+a page at a time with executemany and share one fetched_at timestamp per
+batch.
+"""
+
+import json
+import sqlite3
+from datetime import datetime
+
+# Pragmas applied to every connection. cache_size is negative KiB.
+USER_DB_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -32000),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("temp_store", "MEMORY"),
+)
+# Seconds to wait for another connection's write lock
+BUSY_TIMEOUT = 30
+
+
+def connect_user_db(db_path):
+    """Open a user database with the sync-friendly pragmas applied"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
+    for name, value in USER_DB_PRAGMAS:
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def get_db_info(cursor, key, default=None):
+    """Value stored under key in the db_info table"""
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS db_info (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    cursor.execute("SELECT value FROM db_info WHERE key = ?", (key,))
+    row = cursor.fetchone()
+    return row[0] if row else default
+
+
+def set_db_info(cursor, key, value):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS db_info (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    cursor.execute(
+        "INSERT OR REPLACE INTO db_info (key, value) VALUES (?, ?)", (key, str(value))
+    )
+
+
+def batch_timestamp():
+    return datetime.utcnow().isoformat()
+
+
+def add_column(cursor, table, column, column_type):
+    """
+    Add a column to an existing table if it is missing.
+
+    Returns:
+        True if the column was added
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    if any(row[1] == column for row in cursor.fetchall()):
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    return True
+
+
+def write_items(cursor, table, items, fetched_at=None, extra_columns=(), replace=True):
+    """
+    Insert or replace (id, item) pairs into an (id, name, data, fetched_at)
+    table in one executemany.
+
+    Args:
+        extra_columns: item keys that are also stored in the column of the
+            same name
+        replace: overwrite rows with the same id; when False existing rows
+            are kept (for append-only tables)
+
+    Returns:
+        Number of rows written
+    """
+    fetched_at = fetched_at or batch_timestamp()
+    columns = ["id", "name", "data", "fetched_at", *extra_columns]
+    rows = [
+        (
+            item_id,
+            item.get("name", "Unknown"),
+            json.dumps(item),
+            fetched_at,
+            *(item.get(column) for column in extra_columns),
+        )
+        for item_id, item in items
+    ]
+    if not rows:
+        return 0
+    cursor.executemany(
+        f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO {table} "
+        f"({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        rows,
+    )
+    return cursor.rowcount
+
+
+def write_track_data(cursor, table, rows, data_source=None, fetched_at=None):
+    """
+    Insert or replace (track_id, data) pairs into a per-track table such as
+    audio_features, keyed by the track ID.
+
+    Args:
+        data_source: value for the data_source column; the column is left
+            out when None (older tables don't have it)
+
+    Returns:
+        Number of rows written
+    """
+    fetched_at = fetched_at or batch_timestamp()
+    rows = list(rows)
+    if data_source is None:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {table} (id, track_id, data, fetched_at) VALUES (?, ?, ?, ?)",
+            [
+                (track_id, track_id, json.dumps(data), fetched_at)
+                for track_id, data in rows
+            ],
+        )
+    else:
+        cursor.executemany(
+            f"INSERT OR REPLACE INTO {table} (id, track_id, data, fetched_at, data_source) VALUES (?, ?, ?, ?, ?)",
+            [
+                (track_id, track_id, json.dumps(data), fetched_at, data_source)
+                for track_id, data in rows
+            ],
+        )
+    return len(rows)
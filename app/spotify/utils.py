@@ -1,59 +1,43 @@
 # app/spotify/utils.py
 from flask import current_app
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 from app.models import User
-from app.spotify.routes import get_spotify_oauth
+from app.spotify.clients import get_user_client
+from app.spotify.tokens import get_access_token
 
 
 def get_spotify_client(user):
-    from app import db
-
     """Get an authenticated Spotify client for a user"""
     if not user:
         return None
 
-    # Get a user-specific OAuth with the correct cache path
-    sp_oauth = get_spotify_oauth(user.id)
-
-    if not user.spotify_token or not user.token_expires_at or user.is_token_expired():
-        # If token is expired or missing, we need to refresh
-        if user.spotify_refresh_token:
-            # Refresh the token
-            token_info = sp_oauth.refresh_access_token(user.spotify_refresh_token)
-            user.set_spotify_tokens(
-                token_info["access_token"],
-                token_info.get("refresh_token", user.spotify_refresh_token),
-                token_info["expires_in"],
-            )
-            db.session.commit()
-        else:
-            # No refresh token, can't proceed
-            current_app.logger.error(f"No refresh token for user {user.id}")
-            return None
+    # Refreshes the token first if it is about to expire
+    access_token = get_access_token(user)
+    if not access_token:
+        # No refresh token, can't proceed
+        current_app.logger.error(f"No refresh token for user {user.id}")
+        return None
 
-    # Create and return Spotify client with the access token
-    return spotipy.Spotify(auth=user.spotify_token)
+    # Reuse the user's pooled client while the access token is unchanged
+    return get_user_client(user.id, access_token)
 
 
-def check_saved_tracks_dependency(current_user, data_type_name="saved_tracks"):
-    from flask import flash, redirect, url_for
+def check_saved_tracks_dependency(user, data_type_name="saved_tracks"):
+    """Returns (True, None) if the user has synced data_type_name, else (False, message)"""
     from app.models import SpotifyDataType, UserDataSync
 
     saved_tracks_type = SpotifyDataType.query.filter_by(name=data_type_name).first()
     if not saved_tracks_type:
-        flash(
-            f"{data_type_name.replace('_', ' ').title()} data type not found. Please contact an administrator."
+        return (
+            False,
+            f"{data_type_name.replace('_', ' ').title()} data type not found. Please contact an administrator.",
         )
-        return False, redirect(url_for("main.dashboard"))
 
     saved_tracks_sync = UserDataSync.query.filter_by(
-        user_id=current_user.id, data_type_id=saved_tracks_type.id
+        user_id=user.id, data_type_id=saved_tracks_type.id
     ).first()
 
     if not saved_tracks_sync or not saved_tracks_sync.last_sync:
-        flash(f"Please sync your {data_type_name.replace('_', ' ')} first.")
-        return False, redirect(url_for("main.dashboard"))
+        return False, f"Please sync your {data_type_name.replace('_', ' ')} first."
 
     return True, None
 
@@ -61,11 +45,11 @@ def check_saved_tracks_dependency(current_user, data_type_name="saved_tracks"):
 def process_audio_data_batch(
     sp, cursor, data_type, batch, batch_info, single_track=False
 ):
-    import json
-    import time
     import random
-    from datetime import datetime
-    from flask import current_app, flash
+    import time
+    from flask import current_app
+    from spotipy.exceptions import SpotifyException
+    from app.spotify.user_db import write_track_data
 
     current_batch, total_batches = batch_info
     retry_count = 0
@@ -103,10 +87,6 @@ def process_audio_data_batch(
                             results.append(
                                 {"id": track_id, "data": simplified_analysis}
                             )
-
-                    # Add a small delay between individual track requests
-                    if track_id != batch[-1]:
-                        time.sleep(0.5)
             else:
                 # Process a batch of tracks at once (for audio features)
                 features_batch = sp.audio_features(batch)
@@ -115,16 +95,12 @@ def process_audio_data_batch(
                     if feature:  # Some tracks might not have features
                         results.append({"id": feature["id"], "data": feature})
 
-            # Process and store each result
-            for result in results:
-                track_id = result["id"]
-                data_json = json.dumps(result["data"])
-
-                cursor.execute(
-                    f"INSERT OR REPLACE INTO {data_type} (id, track_id, data, fetched_at) VALUES (?, ?, ?, ?)",
-                    (track_id, track_id, data_json, datetime.utcnow().isoformat()),
-                )
-                record_count += 1
+            # Store the whole batch at once
+            record_count = write_track_data(
+                cursor,
+                data_type,
+                [(result["id"], result["data"]) for result in results],
+            )
 
             # Commit after successful batch processing
             cursor.connection.commit()
@@ -139,32 +115,27 @@ def process_audio_data_batch(
             error_msg = str(batch_error)
             current_app.logger.error(f"Error processing {data_type} batch: {error_msg}")
 
-            # Check if this is a rate limiting issue
-            if "429" in error_msg or "too many requests" in error_msg.lower():
-                backoff = (2**retry_count) + random.uniform(0, 1)
-                current_app.logger.info(
-                    f"Rate limited. Retrying after {backoff:.2f} seconds (attempt {retry_count}/3)"
-                )
-                time.sleep(backoff)
-            elif "403" in error_msg or "forbidden" in error_msg.lower():
-                current_app.logger.info(
-                    f"Permission issue. Waiting longer before retry (attempt {retry_count}/3)"
-                )
-                time.sleep(10)  # 10 second delay for permission issues
-            else:
-                time.sleep(2)
+            # Rate limits (429) and server errors are already retried by the
+            # client; a client error such as 403 won't go away on retry
+            if isinstance(batch_error, SpotifyException) and (
+                400 <= batch_error.http_status < 500
+            ):
+                retry_count = 3
 
             # If we've hit max retries, stop processing entirely
             if retry_count >= 3:
-                flash(f"Error processing batch {current_batch}: {error_msg}")
                 current_app.logger.error(
                     f"Max retries reached for batch {current_batch}. Stopping all processing."
                 )
                 return -1  # Signal to stop all processing
 
-    # Add a delay between batches to avoid rate limiting
-    if current_batch < total_batches:
-        time.sleep(2)
+            # Connection resets, read timeouts and database errors aren't
+            # retried below us, so back off before trying the batch again
+            backoff = (2**retry_count) + random.uniform(0, 1)
+            current_app.logger.info(
+                f"Retrying batch {current_batch} after {backoff:.2f} seconds (attempt {retry_count}/3)"
+            )
+            time.sleep(backoff)
 
     return record_count
 
@@ -195,15 +166,18 @@ def setup_audio_data_table(cursor, data_type):
 
 
 def get_tracks_to_process(cursor, data_type, max_tracks=None):
-    from flask import flash, redirect, url_for
+    """
+    Saved track IDs that don't have data_type data yet.
 
+    Returns (track_ids, message, total_tracks); track_ids is None and message
+    explains why when there is nothing to process.
+    """
     # Get all saved track IDs from the database
     cursor.execute("SELECT id FROM saved_tracks")
     all_track_ids = [row[0] for row in cursor.fetchall()]
 
     if not all_track_ids:
-        flash("No saved tracks found to process.")
-        return None, redirect(url_for("main.dashboard")), 0
+        return None, "No saved tracks found to process.", 0
 
     # Limit the number of tracks if specified
     if max_tracks:
@@ -217,9 +191,10 @@ def get_tracks_to_process(cursor, data_type, max_tracks=None):
     tracks_to_process = [tid for tid in all_track_ids if tid not in existing_track_ids]
 
     if not tracks_to_process:
-        flash(
-            f"All {len(all_track_ids)} tracks already have {data_type.replace('_', ' ')} data."
+        return (
+            None,
+            f"All {len(all_track_ids)} tracks already have {data_type.replace('_', ' ')} data.",
+            len(all_track_ids),
         )
-        return None, redirect(url_for("main.dashboard")), len(all_track_ids)
 
     return tracks_to_process, None, len(all_track_ids)
@@ -24,15 +24,78 @@ class Config:
     USER_DB_PATH = os.environ.get("USER_DB_PATH") or os.path.join(
         basedir, "instance", "user_data"
     )
+    # SQLite database of Spotify artists and tracks shared by all users
+    # (defaults to shared.db in USER_DB_PATH), and seconds before a shared
+    # artist is fetched again
+    SHARED_DB_PATH = os.environ.get("SHARED_DB_PATH")
+    SHARED_ARTIST_TTL = int(os.environ.get("SHARED_ARTIST_TTL", str(7 * 24 * 3600)))
 
     # Track features CSV configuration
     TRACK_FEATURES_CSV_PATH = (
         os.environ.get("TRACK_FEATURES_CSV_PATH") or "data/tracks_features.csv"
     )
+    # Keep a binary sidecar cache of the parsed CSV (rebuilt when the CSV changes)
+    TRACK_FEATURES_USE_CACHE = os.environ.get(
+        "TRACK_FEATURES_USE_CACHE", "True"
+    ).lower() in ("true", "yes", "1")
+    # Comma-separated columns to load from the CSV ("all" loads every column);
+    # unset uses the fields the app reads
+    TRACK_FEATURES_COLUMNS = os.environ.get("TRACK_FEATURES_COLUMNS")
+    # Optional memory-mapped feature store built with `flask build-feature-store`
+    TRACK_FEATURES_STORE_PATH = os.environ.get("TRACK_FEATURES_STORE_PATH")
+    # Seconds between checks for a replaced features CSV, which is then reloaded
+    # in the background without a restart (0 disables the check)
+    TRACK_FEATURES_RELOAD_INTERVAL = int(
+        os.environ.get("TRACK_FEATURES_RELOAD_INTERVAL", "60")
+    )
+    # Start loading the track features in a background thread at app start
+    PRELOAD_TRACK_FEATURES = os.environ.get(
+        "PRELOAD_TRACK_FEATURES", "False"
+    ).lower() in ("true", "yes", "1")
     # Use CSV for audio features instead of Spotify API
     USE_CSV_FOR_AUDIO_FEATURES = os.environ.get(
         "USE_CSV_FOR_AUDIO_FEATURES", "True"
     ).lower() in ("true", "yes", "1")
 
+    # Concurrent page requests per Spotify listing, and the cap on Spotify
+    # requests in flight across the whole process
+    SPOTIFY_PAGE_WORKERS = int(os.environ.get("SPOTIFY_PAGE_WORKERS", "4"))
+    SPOTIFY_MAX_CONCURRENT_REQUESTS = int(
+        os.environ.get("SPOTIFY_MAX_CONCURRENT_REQUESTS", "8")
+    )
+
+    # Spotify API requests per second: the starting rate, the bounds it adapts
+    # within when the API rate limits us, and the burst allowed after idling.
+    # Shared across processes through REDIS_URL when it is set.
+    SPOTIFY_RATE_LIMIT = float(os.environ.get("SPOTIFY_RATE_LIMIT", "10"))
+    SPOTIFY_RATE_LIMIT_MIN = float(os.environ.get("SPOTIFY_RATE_LIMIT_MIN", "1"))
+    SPOTIFY_RATE_LIMIT_MAX = float(os.environ.get("SPOTIFY_RATE_LIMIT_MAX", "30"))
+    SPOTIFY_RATE_LIMIT_BURST = int(os.environ.get("SPOTIFY_RATE_LIMIT_BURST", "10"))
+
+    # Kept-alive connections to the Spotify API, shared by all clients in a
+    # process (keep it at least SPOTIFY_MAX_CONCURRENT_REQUESTS), and seconds
+    # a user's cached client may sit unused before it is dropped
+    SPOTIFY_HTTP_POOL_SIZE = int(os.environ.get("SPOTIFY_HTTP_POOL_SIZE", "16"))
+    SPOTIFY_CLIENT_IDLE_TIMEOUT = int(
+        os.environ.get("SPOTIFY_CLIENT_IDLE_TIMEOUT", "600")
+    )
+
+    # Seconds before it expires at which a Spotify access token is refreshed
+    SPOTIFY_TOKEN_REFRESH_MARGIN = int(
+        os.environ.get("SPOTIFY_TOKEN_REFRESH_MARGIN", "300")
+    )
+    # Seconds the cached token of a login that never completed is kept
+    SPOTIFY_TEMP_TOKEN_TTL = int(os.environ.get("SPOTIFY_TEMP_TOKEN_TTL", "3600"))
+
+    # Run syncs in `flask sync-worker` processes instead of inside the request
+    SYNC_IN_BACKGROUND = os.environ.get("SYNC_IN_BACKGROUND", "False").lower() in (
+        "true",
+        "yes",
+        "1",
+    )
+    # Redis server for the sync job queue and the shared Spotify rate limiter
+    # (the app database and a per-process limiter are used when unset)
+    REDIS_URL = os.environ.get("REDIS_URL")
+
     CACHE_TYPE = "simple"
     CACHE_DEFAULT_TIMEOUT = 300
@@ -1,18 +1,80 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+# Rows of the larger CSV held in memory at once in streaming/parallel modes
+DEFAULT_CHUNK_ROWS = 100_000
+
+# Create mapping between different column names
+COLUMN_MAPPING = {
+    "id": "track_id",  # id in small_df maps to track_id in large_df
+    "name": "track_name",  # name maps to track_name
+    "album": "album_name",  # album maps to album_name
+    # Other mappings can be added here
+}
+
+# Every mode reads values as text so they are written back exactly as read
+# (no int -> float promotion where a join leaves gaps); only empty fields
+# are missing
+TEXT_CSV = dict(dtype=str, keep_default_na=False, na_values=[""])
+
+MERGE_SUFFIXES = ("_x", "_y")
+SCHEMA_SUFFIX = ".schema.json"
+
+# Incremental mode state kept next to the output. The delta file and its
+# _deleted column are read by app/spotify/csv_data_manager.py.
+MANIFEST_SUFFIX = ".manifest.npz"
+DELTA_SUFFIX = ".delta.csv"
+DELETED_COLUMN = "_deleted"
+# Default incremental output. Incremental mode can't overwrite its small
+# input, so tracks_features.csv stays the base and the app is pointed at this
+# file with TRACK_FEATURES_CSV_PATH=data/tracks_features_merged.csv
+INCREMENTAL_OUTPUT = "tracks_features_merged.csv"
+# Fold the delta into the output once it holds this fraction of all ids
+COMPACT_DELTA_FRACTION = 0.2
+# Mixes the small and large hashes of an id into one content hash
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
 
 
 def merge_csv_files(
-    small_csv_filename, large_csv_filename, output_filename, data_dir=None
+    small_csv_filename,
+    large_csv_filename,
+    output_filename,
+    data_dir=None,
+    mode="memory",
+    chunk_size=DEFAULT_CHUNK_ROWS,
+    workers=None,
+    large_columns=None,
 ):
     """
     Merge two CSV files based on common columns.
 
+    The output has one column per field: a field present in both files (or
+    mapped through COLUMN_MAPPING) is coalesced into a single column that
+    prefers the small file's value. Where each column came from is written
+    next to the output as <output>.schema.json.
+
     Parameters:
     - small_csv_filename: Filename of the smaller CSV file with target columns
     - large_csv_filename: Filename of the larger CSV file to merge into
     - output_filename: Filename to save the merged CSV file
     - data_dir: Optional directory where CSV files are located (uses script dir by default)
+    - mode: "memory" merges both files in pandas; "stream" hashes the smaller
+      file and reads the larger one in chunks; "parallel" partitions both
+      files by key hash and streams each partition in its own process;
+      "incremental" only merges ids whose rows changed since the last run
+      and records them in <output>.delta.csv instead of rewriting the output
+    - chunk_size: Rows of the larger file read at a time (stream/parallel)
+    - workers: Processes for parallel mode (defaults to the CPU count)
+    - large_columns: Optional columns to read from the larger file (the join
+      key is always read)
     """
     print("Starting merge process...")
 
@@ -38,86 +100,660 @@ def merge_csv_files(
     if not large_csv_path.exists():
         raise FileNotFoundError(f"Large CSV file not found: {large_csv_path}")
 
+    print("Finding common columns for merging...")
+    plan = _plan_merge(
+        _read_header(small_csv_path), _read_header(large_csv_path), large_columns
+    )
+
+    if mode == "incremental":
+        if output_path.resolve() in (
+            small_csv_path.resolve(),
+            large_csv_path.resolve(),
+        ):
+            raise ValueError(
+                "Incremental mode needs an output separate from its inputs"
+            )
+        rows = _merge_incremental(
+            small_csv_path, large_csv_path, output_path, plan, chunk_size
+        )
+        _write_schema(output_path, small_csv_filename, large_csv_filename, plan)
+        print(f"Merge complete. Merged {rows} changed rows into {output_filename}")
+        return
+
+    # The output may replace one of the inputs, so it is written next to its
+    # destination and moved into place only once complete
+    tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    try:
+        if mode == "memory":
+            rows = _merge_in_memory(small_csv_path, large_csv_path, tmp_path, plan)
+        elif mode == "stream":
+            rows = _merge_streaming(
+                small_csv_path, large_csv_path, tmp_path, plan, chunk_size
+            )
+        elif mode == "parallel":
+            rows = _merge_parallel(
+                small_csv_path,
+                large_csv_path,
+                tmp_path,
+                plan,
+                chunk_size,
+                workers or os.cpu_count() or 1,
+            )
+        else:
+            raise ValueError(f"Unknown merge mode: {mode}")
+
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    # A full rewrite supersedes any incremental state for this output
+    for suffix in (DELTA_SUFFIX, MANIFEST_SUFFIX):
+        stale_path = Path(f"{output_path}{suffix}")
+        if stale_path.exists():
+            stale_path.unlink()
+
+    _write_schema(output_path, small_csv_filename, large_csv_filename, plan)
+    print(f"Merge complete. Saved {rows} rows to {output_filename}")
+
+
+def _read_header(path):
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def _join_keys(small_columns, large_columns):
+    """Pick the key columns to merge on: (small key, large key)"""
+    # Determine which key to use for merging
+    if "id" in small_columns and "track_id" in large_columns:
+        print("Using 'id' from first file and 'track_id' from second file for merging")
+        return "id", "track_id"
+
+    print("WARNING: Expected key columns 'id' or 'track_id' not found in both files")
+    # Try to find alternative columns
+    print("Attempting to find alternative common columns...")
+    common_cols = [col for col in small_columns if col in set(large_columns)]
+    if not common_cols:
+        raise KeyError("No common columns found between the files for merging")
+
+    print(f"Using common column '{common_cols[0]}' for merging")
+    return common_cols[0], common_cols[0]
+
+
+def _plan_merge(small_header, large_header, large_columns=None):
+    """
+    Work out the join keys, the column names pd.merge gives both sides, and
+    the canonical output schema. Every mode (and every parallel worker)
+    shares the plan, so they all write identical columns.
+    """
+    left_on, right_on = _join_keys(small_header, large_header)
+
+    if large_columns:
+        large_header = [
+            col for col in large_header if col in set(large_columns) or col == right_on
+        ]
+
+    # pd.merge drops the right key when both keys share a name and suffixes
+    # every other overlapping name
+    large_merged = [
+        col for col in large_header if not (left_on == right_on and col == right_on)
+    ]
+    overlap = set(small_header) & set(large_merged)
+    small_names = [
+        col + MERGE_SUFFIXES[0] if col in overlap else col for col in small_header
+    ]
+    large_names = [
+        col + MERGE_SUFFIXES[1] if col in overlap else col for col in large_merged
+    ]
+
+    # Canonical columns: every small column, coalesced with its large
+    # equivalent, then the large columns that have no small equivalent
+    equivalents = {large: small for small, large in COLUMN_MAPPING.items()}
+    schema = {
+        col: [("small", col, name)] for col, name in zip(small_header, small_names)
+    }
+    for col, name in zip(large_merged, large_names):
+        target = col if col in schema else equivalents.get(col)
+        if target in schema:
+            schema[target].append(("large", col, name))
+        else:
+            schema[col] = [("large", col, name)]
+
+    return {
+        "left_on": left_on,
+        "right_on": right_on,
+        "small_header": small_header,
+        "small_names": small_names,
+        "large_header": large_header,
+        "large_merged": large_merged,
+        "large_names": large_names,
+        "schema": schema,
+    }
+
+
+def _apply_schema(merged, plan):
+    """Coalesce merged (pd.merge-named) columns into the canonical schema"""
+    columns = {}
+    for name, sources in plan["schema"].items():
+        series = None
+        for _, _, merged_name in sources:
+            if merged_name not in merged.columns:
+                continue
+            column = merged[merged_name]
+            series = column if series is None else series.fillna(column)
+        columns[name] = (
+            series
+            if series is not None
+            else pd.Series(np.nan, index=merged.index, dtype=object)
+        )
+    return pd.DataFrame(columns, index=merged.index)
+
+
+def _write_schema(output_path, small_csv_filename, large_csv_filename, plan):
+    """Record where every output column came from next to the output"""
+    schema = {
+        "sources": {"small": str(small_csv_filename), "large": str(large_csv_filename)},
+        "key": {"small": plan["left_on"], "large": plan["right_on"]},
+        "prefer": "small",
+        "columns": [
+            {
+                "name": name,
+                "from": [f"{side}.{column}" for side, column, _ in sources],
+            }
+            for name, sources in plan["schema"].items()
+        ],
+    }
+    schema_path = Path(f"{output_path}{SCHEMA_SUFFIX}")
+    tmp_path = schema_path.with_name(f".{schema_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(schema, f, indent=2)
+    os.replace(tmp_path, schema_path)
+
+
+def _merge_in_memory(small_csv_path, large_csv_path, output_path, plan):
     # Read the CSV files
     print("Reading first CSV file...")
-    small_df = pd.read_csv(small_csv_path)
+    small_df = pd.read_csv(small_csv_path, **TEXT_CSV)
     print(
         f"First CSV loaded with {len(small_df)} rows and {len(small_df.columns)} columns"
     )
     print(f"Columns in first CSV: {small_df.columns.tolist()}")
 
     print("Reading second CSV file...")
-    large_df = pd.read_csv(large_csv_path)
+    large_df = pd.read_csv(large_csv_path, usecols=plan["large_header"], **TEXT_CSV)
     print(
         f"Second CSV loaded with {len(large_df)} rows and {len(large_df.columns)} columns"
     )
     print(f"Columns in second CSV: {large_df.columns.tolist()}")
 
-    # Create mapping between different column names
-    column_mapping = {
-        "id": "track_id",  # id in small_df maps to track_id in large_df
-        "name": "track_name",  # name maps to track_name
-        "album": "album_name",  # album maps to album_name
-        # Other mappings can be added here
-    }
-
-    print("Finding common columns for merging...")
-
-    # Determine which key to use for merging
-    if "id" in small_df.columns and "track_id" in large_df.columns:
-        print("Using 'id' from first file and 'track_id' from second file for merging")
-
-        # Perform the merge using the mapped columns
-        print("Performing merge operation...")
-        merged_df = pd.merge(
-            small_df, large_df, left_on="id", right_on="track_id", how="left"
-        )
+    # Perform the merge using the mapped columns
+    print("Performing merge operation...")
+    left_on, right_on = plan["left_on"], plan["right_on"]
+    if left_on == right_on:
+        merged_df = pd.merge(small_df, large_df, on=left_on, how="left")
     else:
-        print(
-            "WARNING: Expected key columns 'id' or 'track_id' not found in both files"
+        merged_df = pd.merge(
+            small_df, large_df, left_on=left_on, right_on=right_on, how="left"
         )
-        # Try to find alternative columns
-        print("Attempting to find alternative common columns...")
-        common_cols = set(small_df.columns).intersection(set(large_df.columns))
-        if common_cols:
-            common_col = list(common_cols)[0]
-            print(f"Using common column '{common_col}' for merging")
-            merged_df = pd.merge(small_df, large_df, on=common_col, how="left")
-        else:
-            raise KeyError("No common columns found between the files for merging")
 
     # Handle duplicate columns (columns with same data but different names)
-    print("Cleaning up duplicate columns...")
+    print("Coalescing duplicate columns...")
     print(f"Merged data shape before cleanup: {merged_df.shape}")
-
-    # Keep only the columns from the small CSV plus any new columns from large CSV
-    # that don't have equivalents in the small CSV
-    columns_to_keep = small_df.columns.tolist()
-    for col in large_df.columns:
-        if col not in column_mapping.values() and col not in columns_to_keep:
-            columns_to_keep.append(col)
-
-    # Filter to relevant columns if possible
-    if set(columns_to_keep).issubset(set(merged_df.columns)):
-        merged_df = merged_df[columns_to_keep]
+    merged_df = _apply_schema(merged_df, plan)
 
     print(f"Final data shape: {merged_df.shape}")
     print(f"Saving merged data to {output_path}")
 
     # Save the merged CSV
     merged_df.to_csv(output_path, index=False)
+    return len(merged_df)
+
+
+class _HashedSide:
+    """
+    The smaller CSV held in memory, with its rows grouped by join key so a
+    chunk of the larger CSV can be joined against it without re-hashing it.
+    """
+
+    def __init__(self, df, key):
+        self.df = df
+        codes, uniques = pd.factorize(df[key], use_na_sentinel=False)
+        self.keys = pd.Index(uniques)
+        self.codes = codes
+
+        # Rows of key k are rows[offsets[k]:offsets[k + 1]], in file order
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(uniques))
+        self.rows = order
+        self.offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.matched = np.zeros(len(uniques), dtype=bool)
+
+    def join(self, keys):
+        """Pairs of (small row, chunk row) for every match of keys"""
+        codes = self.keys.get_indexer(keys)
+        chunk_rows = np.flatnonzero(codes >= 0)
+        codes = codes[chunk_rows]
+        self.matched[codes] = True
+
+        starts = self.offsets[codes]
+        counts = self.offsets[codes + 1] - starts
+        shifts = starts - (np.cumsum(counts) - counts)
+        small_rows = self.rows[np.repeat(shifts, counts) + np.arange(counts.sum())]
+        return small_rows, np.repeat(chunk_rows, counts)
+
+    def unmatched_rows(self):
+        """Small rows whose key never appeared in the large CSV, in file order"""
+        return np.flatnonzero(~self.matched[self.codes])
+
+
+def _merge_streaming(
+    small_csv_path,
+    large_csv_path,
+    output_path,
+    plan,
+    chunk_size=DEFAULT_CHUNK_ROWS,
+    write_header=True,
+    verbose=True,
+    keys=None,
+):
+    """
+    Left-join the small CSV with the large one, reading the large CSV in
+    chunks. Memory holds the small CSV plus one chunk, whatever the size of
+    the large file.
+
+    Output rows are the same as the in-memory merge, but grouped by where
+    their first match appears in the large file, with small rows that found
+    no match written last. With keys, only small rows with those keys are
+    merged.
+    """
+    left_on, right_on = plan["left_on"], plan["right_on"]
+    large_header = plan["large_header"]
+
+    if verbose:
+        print("Hashing first CSV file...")
+    # Keys are read as strings on both sides so they always compare equal
+    if keys is None:
+        small_df = pd.read_csv(small_csv_path, **TEXT_CSV)
+    else:
+        small_df = pd.concat(
+            [
+                chunk[chunk[left_on].isin(keys)]
+                for chunk in pd.read_csv(
+                    small_csv_path, chunksize=chunk_size, **TEXT_CSV
+                )
+            ],
+            ignore_index=True,
+        )
+    small = _HashedSide(small_df, left_on)
+    if verbose:
+        print(f"First CSV loaded with {len(small.df)} rows")
+    small_df = small.df.set_axis(plan["small_names"], axis=1)
+
+    rows = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as out:
+        if write_header:
+            pd.DataFrame(columns=list(plan["schema"])).to_csv(out, index=False)
+
+        for number, chunk in enumerate(
+            pd.read_csv(
+                large_csv_path,
+                usecols=large_header,
+                chunksize=chunk_size,
+                **TEXT_CSV,
+            )
+        ):
+            small_rows, chunk_rows = small.join(chunk[right_on])
+            if len(small_rows):
+                merged = pd.concat(
+                    [
+                        small_df.take(small_rows).reset_index(drop=True),
+                        chunk[plan["large_merged"]]
+                        .take(chunk_rows)
+                        .set_axis(plan["large_names"], axis=1)
+                        .reset_index(drop=True),
+                    ],
+                    axis=1,
+                )
+                _apply_schema(merged, plan).to_csv(out, header=False, index=False)
+                rows += len(merged)
+            if verbose:
+                print(f"Chunk {number + 1}: {rows} merged rows written")
+
+        unmatched = small_df.take(small.unmatched_rows())
+        _apply_schema(unmatched, plan).to_csv(out, header=False, index=False)
+        rows += len(unmatched)
+
+    return rows
+
+
+def _partition_csv(path, key, partitions, tmp_dir, prefix, chunk_size, usecols=None):
+    """Split a CSV into partition files by hash of key; returns their paths"""
+    paths = [os.path.join(tmp_dir, f"{prefix}.{p}.csv") for p in range(partitions)]
+    header = usecols or _read_header(path)
+
+    for part_path in paths:
+        pd.DataFrame(columns=header).to_csv(part_path, index=False)
+
+    for chunk in pd.read_csv(path, usecols=header, chunksize=chunk_size, **TEXT_CSV):
+        chunk = chunk[header]
+        hashes = pd.util.hash_pandas_object(chunk[key], index=False).to_numpy()
+        parts = hashes % partitions
+        for p in range(partitions):
+            part = chunk[parts == p]
+            if len(part):
+                part.to_csv(paths[p], mode="a", header=False, index=False)
+
+    return paths
+
+
+def _merge_partition(args):
+    small_path, large_path, output_path, plan, chunk_size = args
+    return _merge_streaming(
+        small_path,
+        large_path,
+        output_path,
+        plan,
+        chunk_size,
+        write_header=False,
+        verbose=False,
+    )
+
+
+def _merge_parallel(
+    small_csv_path,
+    large_csv_path,
+    output_path,
+    plan,
+    chunk_size=DEFAULT_CHUNK_ROWS,
+    workers=1,
+):
+    """
+    Partition both CSVs by hash of the join key, merge the partition pairs in
+    separate processes and concatenate the results. Each process holds one
+    partition of the small CSV plus one chunk of the large one.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="merge_csvs_", dir=Path(output_path).parent)
+    try:
+        print(f"Partitioning inputs into {workers} parts...")
+        small_parts = _partition_csv(
+            small_csv_path, plan["left_on"], workers, tmp_dir, "small", chunk_size
+        )
+        large_parts = _partition_csv(
+            large_csv_path,
+            plan["right_on"],
+            workers,
+            tmp_dir,
+            "large",
+            chunk_size,
+            plan["large_header"],
+        )
+        merged_parts = [
+            os.path.join(tmp_dir, f"merged.{p}.csv") for p in range(workers)
+        ]
+
+        print(f"Merging partitions in {workers} processes...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(
+                executor.map(
+                    _merge_partition,
+                    [
+                        (small_part, large_part, merged_part, plan, chunk_size)
+                        for small_part, large_part, merged_part in zip(
+                            small_parts, large_parts, merged_parts
+                        )
+                    ],
+                )
+            )
+
+        with open(output_path, "w", newline="", encoding="utf-8") as out:
+            pd.DataFrame(columns=list(plan["schema"])).to_csv(out, index=False)
+            for merged_part in merged_parts:
+                with open(merged_part, encoding="utf-8") as part:
+                    shutil.copyfileobj(part, out)
+
+        return sum(counts)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _content_hashes(path, key, columns, chunk_size):
+    """Per-key hash of all rows with that key, independent of row order"""
+    partials = []
+    for chunk in pd.read_csv(
+        path, usecols=columns, dtype=str, keep_default_na=False, chunksize=chunk_size
+    ):
+        hashes = pd.util.hash_pandas_object(chunk[columns], index=False)
+        partials.append(hashes.groupby(chunk[key].to_numpy()).sum())
+    if not partials:
+        return pd.Series([], dtype=np.uint64)
+    return pd.concat(partials).groupby(level=0).sum().astype(np.uint64)
+
+
+def _current_hashes(small_csv_path, large_csv_path, plan, chunk_size):
+    """Content hash of every small id, covering its small and large rows"""
+    small_hashes = _content_hashes(
+        small_csv_path, plan["left_on"], plan["small_header"], chunk_size
+    )
+    large_hashes = _content_hashes(
+        large_csv_path, plan["right_on"], plan["large_header"], chunk_size
+    )
+
+    positions = large_hashes.index.get_indexer(small_hashes.index)
+    matched = np.where(
+        positions >= 0, large_hashes.to_numpy()[np.maximum(positions, 0)], 0
+    ).astype(np.uint64)
+    hashes = small_hashes.to_numpy(dtype=np.uint64) * HASH_MULTIPLIER + matched
+    return small_hashes.index.to_numpy(dtype=object), hashes
+
 
-    print(f"Merge complete. Saved {len(merged_df)} rows to {output_filename}")
+def _source_signature(small_csv_path, large_csv_path):
+    """(size, mtime) of both inputs, recorded in the manifest"""
+    signature = {}
+    for name, path in (("small", small_csv_path), ("large", large_csv_path)):
+        stat = os.stat(path)
+        signature[name] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def _read_manifest(manifest_path, plan):
+    if not manifest_path.exists():
+        return None
+    with np.load(manifest_path, allow_pickle=False) as manifest:
+        meta = json.loads(str(manifest["meta"]))
+        if meta.get("columns") != list(plan["schema"]):
+            print("Output columns changed since the last merge, rebuilding")
+            return None
+        ids = np.char.decode(manifest["ids"], "utf-8").astype(object)
+        return ids, manifest["hashes"], meta.get("sources")
+
+
+def _write_manifest(manifest_path, ids, hashes, plan, sources):
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            ids=np.array([str(value).encode("utf-8") for value in ids], dtype="S"),
+            hashes=hashes.astype(np.uint64),
+            meta=np.array(
+                json.dumps({"columns": list(plan["schema"]), "sources": sources})
+            ),
+        )
+    os.replace(tmp_path, manifest_path)
+
+
+def _merge_incremental(small_csv_path, large_csv_path, output_path, plan, chunk_size):
+    """
+    Merge only the ids whose rows changed since the last run.
+
+    A manifest of per-id content hashes is kept next to the output, with the
+    size and mtime of both inputs; when neither input changed nothing is
+    read, otherwise both are hashed to find the changed ids. Changed
+    and new ids have all of their merged rows written to <output>.delta.csv,
+    and ids that disappeared get a row flagged in its _deleted column; the
+    output itself is left alone until the delta grows past
+    COMPACT_DELTA_FRACTION of the ids, when it is compacted.
+    """
+    manifest_path = Path(f"{output_path}{MANIFEST_SUFFIX}")
+    delta_path = Path(f"{output_path}{DELTA_SUFFIX}")
+    key = plan["left_on"]
+
+    # Taken before reading, so a file replaced mid-run is hashed next time
+    sources = _source_signature(small_csv_path, large_csv_path)
+    manifest = _read_manifest(manifest_path, plan)
+    if manifest is not None and output_path.exists() and manifest[2] == sources:
+        print("Neither input changed since the last merge")
+        return 0
+
+    print("Hashing rows of both files...")
+    ids, hashes = _current_hashes(small_csv_path, large_csv_path, plan, chunk_size)
+
+    if manifest is None or not output_path.exists():
+        print("No manifest for this output, merging everything...")
+        tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+        try:
+            rows = _merge_streaming(
+                small_csv_path, large_csv_path, tmp_path, plan, chunk_size
+            )
+            os.replace(tmp_path, output_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        if delta_path.exists():
+            delta_path.unlink()
+        _write_manifest(manifest_path, ids, hashes, plan, sources)
+        return rows
+
+    old_ids, old_hashes, _ = manifest
+    old_index = pd.Index(old_ids)
+    positions = old_index.get_indexer(ids)
+    changed = (positions < 0) | (old_hashes[np.maximum(positions, 0)] != hashes)
+    changed_ids = ids[changed]
+    removed_ids = old_ids[~old_index.isin(ids)]
+    print(f"{len(changed_ids)} new or changed ids, {len(removed_ids)} removed ids")
+
+    if not len(changed_ids) and not len(removed_ids):
+        # Touched but unchanged: record the new signature to skip hashing next time
+        _write_manifest(manifest_path, ids, hashes, plan, sources)
+        return 0
+
+    rows_path = delta_path.with_name(f".{delta_path.name}.{os.getpid()}.rows")
+    try:
+        _merge_streaming(
+            small_csv_path,
+            large_csv_path,
+            rows_path,
+            plan,
+            chunk_size,
+            verbose=False,
+            keys=set(changed_ids),
+        )
+        new_rows = pd.read_csv(rows_path, dtype=str, keep_default_na=False)
+    finally:
+        if rows_path.exists():
+            rows_path.unlink()
+
+    # Earlier delta rows stay unless this run replaces their id again
+    parts = []
+    if delta_path.exists():
+        previous = pd.read_csv(delta_path, dtype=str, keep_default_na=False)
+        replaced = set(changed_ids) | set(removed_ids)
+        parts.append(previous[~previous[key].isin(replaced)])
+    parts.append(new_rows.assign(**{DELETED_COLUMN: ""}))
+    parts.append(pd.DataFrame({key: removed_ids, DELETED_COLUMN: "1"}))
+    delta = pd.concat(parts, ignore_index=True).reindex(
+        columns=list(plan["schema"]) + [DELETED_COLUMN], fill_value=""
+    )
+
+    tmp_path = delta_path.with_name(f".{delta_path.name}.{os.getpid()}.tmp")
+    delta.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, delta_path)
+    _write_manifest(manifest_path, ids, hashes, plan, sources)
+
+    if delta[key].nunique() > COMPACT_DELTA_FRACTION * max(len(ids), 1):
+        compact_incremental_output(output_path, key, chunk_size)
+
+    return len(new_rows)
+
+
+def compact_incremental_output(output_path, key="id", chunk_size=DEFAULT_CHUNK_ROWS):
+    """Fold <output>.delta.csv into the output and remove it"""
+    output_path = Path(output_path)
+    delta_path = Path(f"{output_path}{DELTA_SUFFIX}")
+    if not delta_path.exists():
+        return
+
+    print(f"Compacting {delta_path.name} into {output_path.name}...")
+    delta = pd.read_csv(delta_path, dtype=str, keep_default_na=False)
+    replaced = set(delta[key])
+    live = delta[delta[DELETED_COLUMN] == ""].drop(columns=[DELETED_COLUMN])
+
+    tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as out:
+            header = True
+            for chunk in pd.read_csv(
+                output_path, dtype=str, keep_default_na=False, chunksize=chunk_size
+            ):
+                chunk[~chunk[key].isin(replaced)].to_csv(
+                    out, header=header, index=False
+                )
+                header = False
+            live.reindex(columns=_read_header(output_path)).to_csv(
+                out, header=header, index=False
+            )
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    delta_path.unlink()
 
 
 # Example usage
 if __name__ == "__main__":
-    try:
-        merge_csv_files(
-            small_csv_filename="tracks_features.csv",
-            large_csv_filename="dataset_to_merge.csv",
-            output_filename="tracks_features.csv",
+    parser = argparse.ArgumentParser(description="Merge the track features CSVs")
+    parser.add_argument(
+        "--mode",
+        choices=["memory", "stream", "parallel", "incremental"],
+        default="memory",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help=(
+            "Output filename. Defaults to tracks_features.csv, replacing the "
+            f"small input, or to {INCREMENTAL_OUTPUT} in incremental mode, which "
+            "needs an output separate from its inputs; point the app at it "
+            f"with TRACK_FEATURES_CSV_PATH=data/{INCREMENTAL_OUTPUT}"
+        ),
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Fold the output's incremental delta into it and exit",
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = (
+            INCREMENTAL_OUTPUT
+            if args.mode == "incremental" or args.compact
+            else "tracks_features.csv"
         )
+
+    try:
+        if args.compact:
+            compact_incremental_output(Path(__file__).parent / args.output)
+        else:
+            merge_csv_files(
+                small_csv_filename="tracks_features.csv",
+                large_csv_filename="dataset_to_merge.csv",
+                output_filename=args.output,
+                mode=args.mode,
+                chunk_size=args.chunk_size,
+                workers=args.workers,
+            )
         print("Script completed successfully!")
     except Exception as e:
         print(f"Error: {e}")
+        sys.exit(1)
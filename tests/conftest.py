@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import create_app, db
+from config import Config
+
+TRACK_COUNT = 200
+
+
+def make_tracks(count=TRACK_COUNT, seed=0):
+    """A small track features table in the layout of data/tracks_features.csv"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "id": [f"t{i:021d}" for i in range(count)],
+            "name": [
+                f"Canción {i}" if i % 5 == 0 else f"Song {i}" for i in range(count)
+            ],
+            "album": [f"Album {i % 17}" for i in range(count)],
+            "artists": [f"['Artist {i % 23}']" for i in range(count)],
+            "explicit": rng.integers(0, 2, count).astype(bool),
+            "danceability": rng.random(count).round(3),
+            "energy": rng.random(count).round(3),
+            "key": rng.integers(0, 12, count),
+            "loudness": (rng.random(count) * -30).round(3),
+            "mode": rng.integers(0, 2, count),
+            "speechiness": rng.random(count).round(4),
+            "acousticness": rng.random(count).round(4),
+            "instrumentalness": rng.random(count).round(5),
+            "liveness": rng.random(count).round(4),
+            "valence": rng.random(count).round(3),
+            "tempo": (60 + rng.random(count) * 120).round(3),
+            "duration_ms": rng.integers(60_000, 400_000, count),
+            "time_signature": rng.integers(3, 6, count),
+            "year": rng.integers(1950, 2024, count),
+            "release_date": [f"{1950 + i % 70}-01-01" for i in range(count)],
+        }
+    )
+
+
+@pytest.fixture
+def tracks():
+    return make_tracks()
+
+
+@pytest.fixture
+def tracks_csv(tmp_path, tracks):
+    path = tmp_path / "tracks_features.csv"
+    tracks.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def _app(tmp_path_factory):
+    # create_app adds routes to module-level blueprints, so it runs once
+    tmp_path = tmp_path_factory.mktemp("app")
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'app.db'}"
+        USER_DB_PATH = str(tmp_path / "user_data")
+        PRELOAD_TRACK_FEATURES = False
+        REDIS_URL = None
+
+    return create_app(TestConfig)
+
+
+@pytest.fixture
+def app(_app):
+    with _app.app_context():
+        # Stands in for `flask db upgrade`, with empty tables for every test
+        db.drop_all()
+        db.create_all()
+        yield _app
+        db.session.remove()
@@ -0,0 +1,56 @@
+import sqlite3
+import time
+
+from spotipy.exceptions import SpotifyException
+
+from app.spotify.utils import process_audio_data_batch
+
+
+class FlakySpotify:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def audio_features(self, batch):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return [{"id": track_id} for track_id in batch]
+
+
+def audio_features_cursor():
+    cursor = sqlite3.connect(":memory:").cursor()
+    cursor.execute(
+        "CREATE TABLE audio_features "
+        "(id TEXT PRIMARY KEY, track_id TEXT, data TEXT, fetched_at TIMESTAMP)"
+    )
+    return cursor
+
+
+def test_transport_errors_back_off_before_retrying(app, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    sp = FlakySpotify([ConnectionResetError("reset"), TimeoutError("timeout")])
+
+    count = process_audio_data_batch(
+        sp, audio_features_cursor(), "audio_features", ["a", "b"], (1, 1)
+    )
+
+    assert count == 2
+    assert sp.calls == 3
+    assert len(sleeps) == 2
+    assert 2 <= sleeps[0] < 3 and 4 <= sleeps[1] < 5
+
+
+def test_client_errors_are_not_retried(app, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    sp = FlakySpotify([SpotifyException(403, -1, "forbidden")])
+
+    count = process_audio_data_batch(
+        sp, audio_features_cursor(), "audio_features", ["a"], (1, 1)
+    )
+
+    assert count == -1
+    assert sp.calls == 1
+    assert sleeps == []
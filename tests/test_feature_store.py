@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from app.spotify.csv_data_manager import (
+    CONTINUOUS_FEATURE_COLUMNS,
+    TrackFeaturesDataset,
+    read_track_features,
+)
+from app.spotify.feature_store import build_feature_store, get_feature_store
+
+
+@pytest.fixture
+def dataset(tracks_csv):
+    return TrackFeaturesDataset(read_track_features(tracks_csv, columns=None))
+
+
+@pytest.fixture
+def store(tracks_csv, tmp_path):
+    store_path = str(tmp_path / "features.store")
+    build_feature_store(tracks_csv, store_path)
+    store = get_feature_store(store_path)
+    yield store
+    store.reload()
+
+
+def test_store_records_match_the_dataset(store, dataset, tracks):
+    for track_id in tracks["id"]:
+        assert store.get_features_by_id(track_id) == dataset.get_features_by_id(
+            track_id
+        )
+
+
+def test_records_keep_csv_precision(store, dataset, tracks):
+    for source in (store, dataset):
+        record = source.get_features_by_id(tracks.id[7])
+        for name in CONTINUOUS_FEATURE_COLUMNS:
+            assert record[name] == tracks[name][7], name
+
+
+def test_batch_keeps_request_order_and_skips_unknown_ids(store, dataset, tracks):
+    ids = [tracks.id[9], "nope", tracks.id[2], tracks.id[9], tracks.id[2] + "XX", "é"]
+    expected = [tracks.id[9], tracks.id[2]]
+    assert [r["id"] for r in store.get_features_batch(ids)] == expected
+    assert [r["id"] for r in dataset.get_features_batch(ids)] == expected
+
+
+def test_store_similarity_matches_the_dataset(store, dataset, tracks):
+    seeds = list(tracks["id"][:10])
+    from_store = store.find_similar_batch(seeds, k=5)
+    from_dataset = dataset.find_similar_batch(seeds, k=5)
+
+    assert set(from_store) == set(from_dataset) == set(seeds)
+    for seed in seeds:
+        assert [r["id"] for r in from_store[seed]] == [
+            r["id"] for r in from_dataset[seed]
+        ]
+        distances = [r["distance"] for r in from_store[seed]]
+        assert distances == sorted(distances)
+        assert seed not in [r["id"] for r in from_store[seed]]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        {"name": "canc"},
+        {"name": "song 1"},
+        {"name": "s"},
+        {"artist": "artist 2", "album": "album 1"},
+        {"album": "no such album"},
+    ],
+)
+def test_store_search_matches_the_dataset(store, dataset, query):
+    from_store = store.search_tracks(limit=500, **query)
+    from_dataset = dataset.search_tracks(limit=500, **query)
+    assert sorted(r["id"] for r in from_store) == sorted(r["id"] for r in from_dataset)
+
+
+def test_short_queries_match_prefixes(dataset, tracks):
+    ids = {r["id"] for r in dataset.search_tracks(name="ca", limit=500)}
+    assert ids == set(tracks["id"][tracks["name"].str.lower().str.startswith("ca")])
+
+
+@pytest.mark.parametrize("source", ["store", "dataset"])
+def test_percentiles_are_bounded_and_monotonic(source, request, tracks):
+    distributions = request.getfixturevalue(source).distributions
+    for name in CONTINUOUS_FEATURE_COLUMNS:
+        values = np.sort(tracks[name].to_numpy())
+        percentiles = [distributions.percentile(name, value) for value in values]
+        assert all(0 <= p <= 100 for p in percentiles), name
+        assert percentiles == sorted(percentiles), name
+        assert distributions.percentile(name, values[0] - 1) == 0
+        assert distributions.percentile(name, values[-1] + 1) == 100
+        assert distributions.percentile(name, None) is None
+
+
+def test_store_distributions_match_the_dataset(store, dataset):
+    for name in CONTINUOUS_FEATURE_COLUMNS:
+        np.testing.assert_allclose(
+            store.distributions.quantiles[name],
+            dataset.distributions.quantiles[name],
+            rtol=1e-6,
+        )
+
+
+def test_staleness(store, tracks_csv):
+    assert not store.is_stale(tracks_csv)
+    with open(tracks_csv, "a") as f:
+        f.write("\n")
+    assert store.is_stale(tracks_csv)
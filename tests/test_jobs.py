@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import SyncJob
+from app.spotify import jobs
+from app.spotify.jobs import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    STALE_JOB_SECONDS,
+    DatabaseSyncQueue,
+    JobProgress,
+)
+
+
+def test_enqueue_is_deduplicated_until_claimed_and_finished(app):
+    queue = DatabaseSyncQueue()
+    operation_id = queue.enqueue(1, "saved_tracks")
+    assert queue.enqueue(1, "saved_tracks") == operation_id
+    assert SyncJob.query.count() == 1
+    assert queue.get_progress(operation_id)["complete"] is False
+
+    job = queue.claim(timeout=0)
+    assert job["operation_id"] == operation_id
+    assert queue.enqueue(1, "saved_tracks") == operation_id
+    assert SyncJob.query.count() == 1
+
+    queue.finish(job, {"complete": True, "status": "Done"}, "Done")
+    assert db.session.get(SyncJob, job["id"]).status == DONE
+    queue.enqueue(1, "saved_tracks")
+    assert SyncJob.query.filter_by(status=QUEUED).count() == 1
+
+
+def test_long_queued_job_is_never_stale(app):
+    queue = DatabaseSyncQueue()
+    queue.enqueue(1, "artists")
+    SyncJob.query.update(
+        {"updated_at": datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS * 2)}
+    )
+    db.session.commit()
+
+    queue.enqueue(1, "artists")
+    assert SyncJob.query.count() == 1
+
+
+def test_stale_running_job_is_failed_and_replaced(app):
+    queue = DatabaseSyncQueue()
+    queue.enqueue(1, "artists")
+    job = queue.claim(timeout=0)
+    SyncJob.query.update(
+        {"updated_at": datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS + 1)}
+    )
+    db.session.commit()
+
+    queue.enqueue(1, "artists")
+    assert db.session.get(SyncJob, job["id"]).status == FAILED
+    assert [j.status for j in SyncJob.query.order_by(SyncJob.id)] == [FAILED, QUEUED]
+
+
+def test_claim_waits_when_the_queue_is_empty(app, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(jobs.time, "sleep", sleeps.append)
+    assert DatabaseSyncQueue().claim(timeout=3) is None
+    assert sleeps == [3]
+
+
+def test_claimed_job_runs_once(app, monkeypatch):
+    monkeypatch.setattr(jobs.time, "sleep", lambda seconds: None)
+    queue = DatabaseSyncQueue()
+    queue.enqueue(1, "artists")
+    assert queue.claim(timeout=0) is not None
+    assert SyncJob.query.one().status == RUNNING
+    assert queue.claim(timeout=0) is None
+
+
+def test_job_progress_saves_at_most_once_per_interval(app):
+    saved = []
+    progress = JobProgress(saved.append, {"percent": 0}, interval=3600)
+    progress["percent"] = 10
+    progress["percent"] = 20
+    progress.update(percent=30)
+    assert [s["percent"] for s in saved] == [10]
+
+    progress.update(percent=100, complete=True)
+    assert saved[-1] == {"percent": 100, "complete": True}
@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.spotify.csv_data_manager import read_track_features
+from data import merge_csvs
+from data.merge_csvs import merge_csv_files
+from tests.conftest import make_tracks
+
+FULL_MODES = ["memory", "stream", "parallel"]
+
+
+@pytest.fixture
+def merge_dir(tmp_path):
+    tracks = make_tracks(60)
+    tracks[["id", "name", "album", "artists", "energy", "danceability"]].to_csv(
+        tmp_path / "small.csv", index=False
+    )
+
+    # Some small ids have two large rows, some none, and some large ids are
+    # not in the small file
+    rng = np.random.default_rng(1)
+    large_ids = list(tracks["id"][::2]) + list(tracks["id"][::6]) + ["x" * 22] * 2
+    pd.DataFrame(
+        {
+            "track_id": large_ids,
+            "track_name": [f"Other {i}" for i in range(len(large_ids))],
+            "artists": "B",
+            "energy": rng.random(len(large_ids)).round(3),
+            "popularity": rng.integers(0, 100, len(large_ids)),
+            "track_genre": "rock",
+        }
+    ).to_csv(tmp_path / "large.csv", index=False)
+    return tmp_path
+
+
+def merge(merge_dir, output, mode):
+    merge_csv_files(
+        small_csv_filename="small.csv",
+        large_csv_filename="large.csv",
+        output_filename=output,
+        data_dir=merge_dir,
+        mode=mode,
+        chunk_size=7,
+        workers=2,
+    )
+
+
+def sorted_rows(df):
+    df = df.astype(str)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_merge_modes_write_the_same_rows(merge_dir):
+    outputs = {}
+    for mode in FULL_MODES + ["incremental"]:
+        merge(merge_dir, f"{mode}.csv", mode)
+        outputs[mode] = pd.read_csv(merge_dir / f"{mode}.csv", dtype=str)
+
+    expected = sorted_rows(outputs["memory"])
+    assert len(expected) > 60
+    for mode, output in outputs.items():
+        assert list(output.columns) == list(outputs["memory"].columns), mode
+        pd.testing.assert_frame_equal(sorted_rows(output), expected, obj=mode)
+
+
+def test_incremental_delta_matches_a_full_merge(merge_dir):
+    merge(merge_dir, "incremental.csv", "incremental")
+
+    small = pd.read_csv(merge_dir / "small.csv", dtype=str)
+    small.loc[3, "name"] = "Renamed"
+    small = small.drop(index=5)
+    small.to_csv(merge_dir / "small.csv", index=False)
+
+    merge(merge_dir, "incremental.csv", "incremental")
+    merge(merge_dir, "memory.csv", "memory")
+    assert os.path.exists(merge_dir / "incremental.csv.delta.csv")
+
+    incremental = read_track_features(str(merge_dir / "incremental.csv"))
+    full = read_track_features(str(merge_dir / "memory.csv"))
+    pd.testing.assert_frame_equal(sorted_rows(incremental), sorted_rows(full))
+
+
+def test_incremental_skips_hashing_unchanged_inputs(merge_dir, monkeypatch):
+    merge(merge_dir, "incremental.csv", "incremental")
+
+    calls = []
+    current_hashes = merge_csvs._current_hashes
+    monkeypatch.setattr(
+        merge_csvs,
+        "_current_hashes",
+        lambda *args: calls.append(args) or current_hashes(*args),
+    )
+
+    merge(merge_dir, "incremental.csv", "incremental")
+    assert calls == []
+
+    stat = os.stat(merge_dir / "large.csv")
+    os.utime(merge_dir / "large.csv", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    merge(merge_dir, "incremental.csv", "incremental")
+    assert len(calls) == 1
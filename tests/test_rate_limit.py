@@ -0,0 +1,71 @@
+import pytest
+
+from app.spotify import rate_limit
+from app.spotify.rate_limit import (
+    DEFAULT_RETRY_AFTER,
+    RATE_DECREASE,
+    TokenBucket,
+    retry_after_seconds,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_is_granted_without_waiting(clock):
+    bucket = TokenBucket(rate=5, burst=3, max_rate=5)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.now == 1000.0
+
+    bucket.acquire()
+    assert clock.now == pytest.approx(1000.2)
+
+
+def test_rate_rises_to_its_maximum(clock):
+    bucket = TokenBucket(rate=10, burst=100, max_rate=11)
+    for _ in range(100):
+        bucket.acquire()
+    assert bucket.rate == 11
+
+
+def test_penalize_pauses_and_halves_down_to_the_minimum(clock):
+    bucket = TokenBucket(rate=8, burst=5, min_rate=3)
+    bucket.penalize(2.0)
+    assert bucket.rate == 8 * RATE_DECREASE
+
+    bucket.acquire()
+    assert clock.now >= 1002.0
+
+    bucket.penalize(0)
+    assert bucket.rate == 3
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"Retry-After": "4"}, 4.0),
+        ({"Retry-After": "-1"}, 0.0),
+        ({"Retry-After": "soon"}, DEFAULT_RETRY_AFTER),
+        ({}, DEFAULT_RETRY_AFTER),
+        (None, DEFAULT_RETRY_AFTER),
+    ],
+)
+def test_retry_after_seconds(headers, expected):
+    assert retry_after_seconds(headers) == expected
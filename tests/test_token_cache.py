@@ -0,0 +1,64 @@
+import pytest
+
+from app import db
+from app.models import SpotifyTokenCache
+from app.spotify import token_cache
+from app.spotify.token_cache import DatabaseCacheHandler, delete_cached_token
+
+
+def write_behind_cache(cache_key, token_info):
+    """Save a token the way another worker process would"""
+    table = SpotifyTokenCache.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            table.update()
+            .where(table.c.cache_key == cache_key)
+            .values(token_info=token_info)
+        )
+
+
+@pytest.fixture(autouse=True)
+def empty_memory():
+    token_cache._tokens.clear()
+
+
+def expire_memory(monkeypatch):
+    monkeypatch.setattr(token_cache, "MEMORY_TTL", 0)
+
+
+def test_reads_are_served_from_memory(app):
+    handler = DatabaseCacheHandler("user_1")
+    handler.save_token_to_cache({"access_token": "a"})
+    write_behind_cache("user_1", '{"access_token": "b"}')
+
+    assert handler.get_cached_token() == {"access_token": "a"}
+
+
+def test_refresh_by_another_worker_is_seen_after_ttl(app, monkeypatch):
+    handler = DatabaseCacheHandler("user_1")
+    handler.save_token_to_cache({"access_token": "a"})
+    write_behind_cache("user_1", '{"access_token": "b"}')
+    expire_memory(monkeypatch)
+
+    assert handler.get_cached_token() == {"access_token": "b"}
+
+
+def test_misses_are_not_cached(app):
+    assert DatabaseCacheHandler("user_2").get_cached_token() is None
+    table = SpotifyTokenCache.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            table.insert().values(
+                cache_key="user_2", token_info='{"access_token": "c"}'
+            )
+        )
+
+    assert DatabaseCacheHandler("user_2").get_cached_token() == {"access_token": "c"}
+
+
+def test_delete_evicts_memory(app):
+    handler = DatabaseCacheHandler("temp_x")
+    handler.save_token_to_cache({"access_token": "t"})
+    delete_cached_token("temp_x")
+
+    assert handler.get_cached_token() is None
@@ -0,0 +1,73 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import User
+from app.spotify import routes
+from app.spotify.tokens import get_access_token, token_needs_refresh
+
+
+class FakeOAuth:
+    def __init__(self):
+        self.refreshes = 0
+        self.lock = threading.Lock()
+
+    def refresh_access_token(self, refresh_token):
+        with self.lock:
+            self.refreshes += 1
+        time.sleep(0.2)
+        return {"access_token": "new", "expires_in": 3600}
+
+
+def add_user(expires_in):
+    user = User(
+        spotify_id="u1",
+        spotify_token="old",
+        spotify_refresh_token="refresh",
+        token_expires_at=datetime.utcnow() + timedelta(seconds=expires_in),
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+def test_token_needs_refresh(app):
+    now = datetime.utcnow()
+    assert token_needs_refresh(None, now + timedelta(hours=1))
+    assert token_needs_refresh("token", None)
+    assert token_needs_refresh("token", now + timedelta(seconds=60))
+    assert not token_needs_refresh("token", now + timedelta(hours=1))
+
+
+def test_valid_token_is_not_refreshed(app, monkeypatch):
+    oauth = FakeOAuth()
+    monkeypatch.setattr(routes, "get_spotify_oauth", lambda user_id=None: oauth)
+    user = db.session.get(User, add_user(3600))
+
+    assert get_access_token(user) == "old"
+    assert oauth.refreshes == 0
+
+
+def test_concurrent_refreshes_are_single_flight(app, monkeypatch):
+    oauth = FakeOAuth()
+    monkeypatch.setattr(routes, "get_spotify_oauth", lambda user_id=None: oauth)
+    user_id = add_user(10)
+    db.session.remove()
+
+    tokens = []
+
+    def request():
+        with app.app_context():
+            tokens.append(get_access_token(db.session.get(User, user_id)))
+            db.session.remove()
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert tokens == ["new"] * 4
+    assert oauth.refreshes == 1
+    assert db.session.get(User, user_id).spotify_token == "new"
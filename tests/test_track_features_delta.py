@@ -0,0 +1,65 @@
+import pandas as pd
+
+from app.spotify.csv_data_manager import (
+    DELETED_COLUMN,
+    DELTA_SUFFIX,
+    TrackFeaturesDataset,
+    read_track_features,
+)
+
+INTEGER_COLUMNS = ["key", "mode", "duration_ms", "time_signature", "year"]
+
+
+def write_delta(csv_path, rows):
+    pd.DataFrame(rows).to_csv(f"{csv_path}{DELTA_SUFFIX}", index=False)
+
+
+def test_delta_replaces_deletes_and_appends(tracks_csv, tracks):
+    replaced = tracks.iloc[1].to_dict()
+    replaced["name"] = "Replaced"
+    added = tracks.iloc[2].to_dict()
+    added["id"] = "9" * 22
+    write_delta(
+        tracks_csv,
+        [
+            {**replaced, DELETED_COLUMN: ""},
+            {**added, DELETED_COLUMN: ""},
+            {"id": tracks.id[0], DELETED_COLUMN: "1"},
+        ],
+    )
+
+    df = read_track_features(tracks_csv, columns=None)
+    ids = set(df["id"])
+    assert len(df) == len(tracks)
+    assert tracks.id[0] not in ids
+    assert added["id"] in ids
+    assert df.loc[df["id"] == replaced["id"], "name"].tolist() == ["Replaced"]
+
+
+def test_tombstone_keeps_integer_dtypes(tracks_csv, tracks):
+    write_delta(tracks_csv, [{"id": tracks.id[0], DELETED_COLUMN: "1"}])
+
+    df = read_track_features(tracks_csv, columns=None)
+    for name in INTEGER_COLUMNS:
+        assert pd.api.types.is_integer_dtype(df[name]), name
+
+    record = TrackFeaturesDataset(df).get_features_by_id(tracks.id[5])
+    for name in INTEGER_COLUMNS:
+        assert isinstance(record[name], int), name
+        assert record[name] == tracks[name][5]
+
+
+def test_tombstone_with_replacement_keeps_integer_dtypes(tracks_csv, tracks):
+    replaced = tracks.iloc[3].to_dict()
+    write_delta(
+        tracks_csv,
+        [
+            {**replaced, DELETED_COLUMN: ""},
+            {"id": tracks.id[0], DELETED_COLUMN: "1"},
+        ],
+    )
+
+    df = read_track_features(tracks_csv, columns=None)
+    for name in INTEGER_COLUMNS:
+        assert pd.api.types.is_integer_dtype(df[name]), name
+    assert df["explicit"].dtype == bool